@@ -0,0 +1,74 @@
+"""Compares per-file ImageMagick conversion with batched conversion on the same source images
+
+Usage:
+    python benchmarks/batch_convert.py -s source/ --batch-size 32
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "spt"))
+from extensions import image
+
+def findImages(source_folder:Path) -> dict:
+    """Groups every PNG under the source folder by the folder it is in
+
+    Args:
+        source_folder (Path): The folder to search
+
+    Returns:
+        dict: Lists of PNG files keyed by their parent folder relative to the source folder
+    """
+    folders = {}
+    for file in sorted(source_folder.rglob("*")):
+        if file.is_file() and file.suffix.lower() == ".png":
+            folders.setdefault(file.parent.relative_to(source_folder), []).append(file)
+    return folders
+
+def runPerFile(folders:dict, output_folder:Path) -> int:
+    failed = 0
+    for relative_folder, files in folders.items():
+        (output_folder / relative_folder).mkdir(parents=True, exist_ok=True)
+        for file in files:
+            new_file = output_folder / relative_folder / f"{file.stem}.dds"
+            failed += not image.convertImage(image_file=file, new_file=new_file).success
+    return failed
+
+def runBatched(folders:dict, output_folder:Path, batch_size:int) -> int:
+    failed = 0
+    for relative_folder, files in folders.items():
+        (output_folder / relative_folder).mkdir(parents=True, exist_ok=True)
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            new_files = [output_folder / relative_folder / f"{file.stem}.dds" for file in batch]
+            conversion_results = image.convertImageBatch(image_files=batch, new_files=new_files)
+            failed += sum(not conversion_result.success for conversion_result in conversion_results)
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-file against batched ImageMagick conversion")
+    parser.add_argument("-s", "--source-folder", dest="source_folder", required=True, type=Path)
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=32)
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    folders = findImages(args.source_folder)
+    image_count = sum(len(files) for files in folders.values())
+    if image_count == 0:
+        sys.exit(f"No PNG files found in '{args.source_folder}'")
+
+    modes = {
+        "per-file": lambda output_folder: runPerFile(folders, output_folder),
+        f"batch-{args.batch_size}": lambda output_folder: runBatched(folders, output_folder, args.batch_size)
+    }
+    for mode, run in modes.items():
+        timings = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as output_folder:
+                start = time.perf_counter()
+                failed = run(Path(output_folder))
+                timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"{mode:>12}: {image_count} images in {best:.2f}s ({image_count / best:.1f} images/s, {failed} failed, best of {args.repeat})")
@@ -0,0 +1,88 @@
+"""Measures how fast existing configs are read back, by writing a synthetic vanilla-sized portraits file with the
+serializer and parsing it with clausewitz.load and clausewitz.iterPairs
+
+Peak memory is measured with tracemalloc, so it only counts what the parser allocates. iterPairs hands over one top
+level pair at a time, so its peak depends on the largest pair rather than the size of the file
+
+Usage:
+    python benchmarks/clausewitz_parse.py --groups 2000 --images 50 --json-out clausewitz_parse.json
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCHMARK_FOLDER = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_FOLDER.parent / "spt"))
+
+from extensions import clausewitz, templates
+
+def writeConfigFile(config_file:Path, groups:int, images:int):
+    """Writes one portraits config per group to the same file, commented like a hand edited vanilla file
+
+    Args:
+        config_file (Path): The file to write
+        groups (int): The number of portrait groups
+        images (int): The number of portraits in each group
+    """
+    with open(config_file, "w", encoding="utf-8") as open_file:
+        for group_number in range(groups):
+            group_name = f"species_{group_number:05d}"
+            portrait_files = {
+                f"{group_name}_{image_number:03d}": {"texturefile": f"gfx/models/portraits/{group_name}/portrait_{image_number:03d}.dds"}
+                for image_number in range(images)
+            }
+            portraits = templates.Portraits(portrait_group_name=group_name, portrait_refs=list(portrait_files), portrait_files=portrait_files)
+            open_file.write(f"# {group_name}\n")
+            clausewitz.dump(portraits.config, open_file, quoted_value_keys={"texturefile"})
+            open_file.write("\n")
+
+def measure(function) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(seconds, 3),
+        "peak_mb": round(peak / (1024 * 1024), 1)
+    }
+
+def loadFile(config_file:Path):
+    with open(config_file, encoding="utf-8-sig") as open_file:
+        clausewitz.load(open_file)
+
+def iterFile(config_file:Path):
+    with open(config_file, encoding="utf-8-sig") as open_file:
+        for _ in clausewitz.iterPairs(open_file):
+            pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures how fast existing configs are read back")
+    parser.add_argument("--groups", type=int, default=2000, help="The number of portrait groups in the file")
+    parser.add_argument("--images", type=int, default=50, help="The number of portraits in each group")
+    parser.add_argument("--json-out", type=Path, help="Write the results to this JSON file as well as stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="spt-clausewitz-parse-") as work_folder:
+        config_file = Path(work_folder) / "portraits.txt"
+        writeConfigFile(config_file=config_file, groups=args.groups, images=args.images)
+        file_mb = config_file.stat().st_size / (1024 * 1024)
+        # Timed without tracemalloc, which slows every allocation down
+        start = time.perf_counter()
+        loadFile(config_file)
+        load_seconds = time.perf_counter() - start
+        report = {
+            "file_mb": round(file_mb, 1),
+            "load_seconds": round(load_seconds, 3),
+            "mb_per_second": round(file_mb / load_seconds, 1),
+            "load": measure(lambda: loadFile(config_file)),
+            "iter_pairs": measure(lambda: iterFile(config_file))
+        }
+    print(json.dumps(report, indent=1))
+    if args.json_out:
+        args.json_out.write_text(json.dumps(report, indent=1))
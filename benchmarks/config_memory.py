@@ -0,0 +1,124 @@
+"""Checks that config generation runs in bounded memory, by generating every config for a synthetic output tree of
+empty DDS files and measuring peak RSS in a fresh process
+
+The tree is indexed before the baseline is taken, so the growth measured is only what config generation itself holds.
+The check runs the same measurement on a tree a tenth of the size and fails if the larger tree grows by more than the
+tolerance on top of the smaller one
+
+Usage:
+    python benchmarks/config_memory.py --images 100000 --group-size 50 --json-out config_memory.json
+"""
+import argparse
+import json
+import logging
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCHMARK_FOLDER = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_FOLDER.parent / "spt"))
+
+def peakRssMb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def generateOutputTree(output_folder:Path, images:int, group_size:int):
+    """Creates empty DDS files laid out like converted portraits, group_size to a folder
+
+    Args:
+        output_folder (Path): The output folder to create the tree in
+        images (int): The number of DDS files
+        group_size (int): The number of DDS files in each portrait folder
+    """
+    image_root = output_folder / "gfx" / "models" / "portraits"
+    for image_number in range(images):
+        group_folder = image_root / f"species_{image_number // group_size:05d}"
+        if image_number % group_size == 0:
+            group_folder.mkdir(parents=True)
+        (group_folder / f"portrait_{image_number % group_size:03d}.dds").touch()
+
+def measure(output_folder:Path) -> dict:
+    """Generates every config for an output tree and reports the peak RSS before and after. Runs in a child process,
+    so nothing from an earlier measurement is counted
+
+    Args:
+        output_folder (Path): The output tree to generate configs for
+
+    Returns:
+        dict: The baseline and peak RSS in MiB, and the generation time
+    """
+    from extensions import config, index
+
+    file_index = index.FileIndex()
+    file_index.tree(output_folder).ensureScanned()
+    baseline_mb = peakRssMb()
+
+    params = {
+        "source_path": output_folder,
+        "mod_prefix": "benchmark",
+        "conflict_resolution_method": "replace",
+        "file_index": file_index
+    }
+    start = time.perf_counter()
+    portraits = config.Portraits(**params)
+    portraits.generate()
+    params["portrait_groups"] = list(portraits.config_store)
+    config.PortraitSets(**params).generate()
+    config.SpeciesClass(**params).generate()
+    config.SpeciesNames(**params).generate()
+    config.PortraitCategories(**params).generate()
+    seconds = time.perf_counter() - start
+
+    peak_mb = peakRssMb()
+    return {
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(peak_mb, 1),
+        "growth_mb": round(peak_mb - baseline_mb, 1),
+        "seconds": round(seconds, 3)
+    }
+
+def measureTree(images:int, group_size:int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="spt-config-memory-") as work_folder:
+        output_folder = Path(work_folder) / "output"
+        generateOutputTree(output_folder=output_folder, images=images, group_size=group_size)
+        result = subprocess.run(
+            [sys.executable, __file__, "--measure", str(output_folder)],
+            check=True, text=True, capture_output=True
+        )
+    measurement = json.loads(result.stdout)
+    measurement["images"] = images
+    measurement["groups"] = -(-images // group_size)
+    return measurement
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks that config generation runs in bounded memory")
+    parser.add_argument("--images", type=int, default=100000, help="The number of DDS files in the large tree")
+    parser.add_argument("--group-size", type=int, default=50, help="The number of DDS files in each portrait folder")
+    parser.add_argument("--tolerance-mb", type=float, default=8.0, help="How much more the large tree may grow than a tree a tenth of its size")
+    parser.add_argument("--json-out", type=Path, help="Write the results to this JSON file as well as stdout")
+    parser.add_argument("--measure", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        sys.exit(0)
+
+    small = measureTree(images=max(args.group_size, args.images // 10), group_size=args.group_size)
+    large = measureTree(images=args.images, group_size=args.group_size)
+    extra_growth_mb = round(large["growth_mb"] - small["growth_mb"], 1)
+    report = {
+        "small": small,
+        "large": large,
+        "extra_growth_mb": extra_growth_mb,
+        "tolerance_mb": args.tolerance_mb,
+        "passed": extra_growth_mb <= args.tolerance_mb
+    }
+    print(json.dumps(report, indent=1))
+    if args.json_out:
+        args.json_out.write_text(json.dumps(report, indent=1))
+    sys.exit(0 if report["passed"] else 1)
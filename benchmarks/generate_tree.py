@@ -0,0 +1,83 @@
+"""Generates a synthetic source tree of portrait PNGs laid out like the README example
+
+Usage:
+    python benchmarks/generate_tree.py -o source/ --species 20 --variants 2 --images 10
+"""
+import argparse
+import struct
+import zlib
+from pathlib import Path
+
+def createPng(width:int, height:int, seed:int) -> bytes:
+    """Creates a small RGBA PNG whose pixels depend on the seed, so every generated image is unique
+
+    Args:
+        width (int): The image width in pixels
+        height (int): The image height in pixels
+        seed (int): Changes the colours of the image
+
+    Returns:
+        bytes: The PNG file
+    """
+    def chunk(chunk_type:bytes, data:bytes) -> bytes:
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    scanlines = bytearray()
+    for y in range(height):
+        scanlines.append(0)
+        for x in range(width):
+            scanlines += bytes(((x * 4 + seed) % 256, (y * 4 + seed * 7) % 256, (x + y + seed * 13) % 256, 255 - (y % 256)))
+
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(bytes(scanlines))),
+        chunk(b"IEND", b"")
+    ])
+
+def generateTree(source_folder:Path, species:int=10, variants:int=1, images:int=10, image_size:int=64) -> list[Path]:
+    """Creates gfx/models/portraits/<species>/ folders of PNGs, each with nested variant folders like orks/bigga
+
+    Args:
+        source_folder (Path): The source folder to create the tree in
+        species (int, optional): The number of species folders. Defaults to 10
+        variants (int, optional): The number of variant subfolders in each species folder. Defaults to 1
+        images (int, optional): The number of images in every species and variant folder. Defaults to 10
+        image_size (int, optional): The width and height of every image. Defaults to 64
+
+    Returns:
+        list[Path]: Every generated image
+    """
+    portraits_folder = Path(source_folder) / "gfx/models/portraits"
+    generated = []
+    seed = 0
+    for species_number in range(species):
+        species_folder = portraits_folder / f"species_{species_number:03d}"
+        folders = [species_folder] + [species_folder / f"variant_{variant_number:02d}" for variant_number in range(variants)]
+        for folder in folders:
+            folder.mkdir(parents=True, exist_ok=True)
+            for image_number in range(images):
+                role = "ruler" if image_number % 5 == 0 else "pop"
+                image_file = folder / f"{species_folder.name}_{role}_{image_number:03d}.png"
+                image_file.write_bytes(createPng(width=image_size, height=image_size, seed=seed))
+                generated.append(image_file)
+                seed += 1
+    return generated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic portrait source tree")
+    parser.add_argument("-o", "--output-folder", dest="output_folder", required=True, type=Path)
+    parser.add_argument("--species", dest="species", type=int, default=10)
+    parser.add_argument("--variants", dest="variants", type=int, default=1)
+    parser.add_argument("--images", dest="images", type=int, default=10)
+    parser.add_argument("--image-size", dest="image_size", type=int, default=64)
+    args = parser.parse_args()
+
+    generated = generateTree(
+        source_folder=args.output_folder,
+        species=args.species,
+        variants=args.variants,
+        images=args.images,
+        image_size=args.image_size
+    )
+    print(f"Generated {len(generated)} images in '{args.output_folder}'")
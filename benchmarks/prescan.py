@@ -0,0 +1,49 @@
+"""Measures how many PNG headers per second the pre-scan stage reads, optionally on a generated tree of tiny PNGs
+
+Usage:
+    python benchmarks/prescan.py -s source/
+    python benchmarks/prescan.py --generate 20000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "spt"))
+from extensions import prescan
+from generate_tree import createPng
+
+def scanFolder(source_folder:Path, repeat:int):
+    image_files = sorted(file for file in source_folder.rglob("*") if file.is_file() and file.suffix.lower() == ".png")
+    if not image_files:
+        sys.exit(f"No PNG files found in '{source_folder}'")
+    file_stats = [file.stat() for file in image_files]
+
+    timings = []
+    for _ in range(repeat):
+        png_index = prescan.PngIndex()
+        start = time.perf_counter()
+        png_headers = png_index.scan(image_files=image_files, file_stats=file_stats)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    invalid = sum(not png_header.valid for png_header in png_headers)
+    print(f"{len(image_files)} headers in {best:.3f}s ({len(image_files) / best:.0f} files/s, {invalid} invalid, best of {repeat})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PNG header pre-scan")
+    parser.add_argument("-s", "--source-folder", dest="source_folder", type=Path)
+    parser.add_argument("--generate", dest="generate", type=int, default=0, help="Scan this many generated PNGs instead of a source folder")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.generate:
+        with tempfile.TemporaryDirectory(prefix="spt-prescan-") as source_folder:
+            png_data = createPng(width=64, height=64, seed=0)
+            for number in range(args.generate):
+                Path(source_folder, f"{number:06d}.png").write_bytes(png_data)
+            scanFolder(Path(source_folder), args.repeat)
+    elif args.source_folder:
+        scanFolder(args.source_folder, args.repeat)
+    else:
+        parser.error("Provide --source-folder or --generate")
@@ -0,0 +1,142 @@
+"""Runs spt against a synthetic portrait tree and reports throughput, per-stage wall time and peak RSS as JSON
+
+The fake magick in benchmarks/fake_magick is put first on the PATH unless --real-magick is passed, so runs work offline
+and are reproducible. Compare the JSON from two commits to spot regressions
+
+Usage:
+    python benchmarks/run.py --species 50 --variants 2 --images 20 --latency 0.005 --json-out before.json
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCHMARK_FOLDER = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_FOLDER.parent / "spt"))
+
+from generate_tree import generateTree
+from spt import StellarisPortraitTool
+
+def peakRssMb(who:int) -> float:
+    """Returns the peak resident set size of this process, or of its largest finished child process
+
+    Args:
+        who (int): resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN
+
+    Returns:
+        float: The peak RSS in MiB
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def gitCommit() -> str:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_FOLDER, check=True, text=True, capture_output=True)
+        return result.stdout.strip()
+    except Exception:
+        return ""
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def time(self, stage:str, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.stages[stage] = round(self.stages.get(stage, 0) + time.perf_counter() - start, 4)
+        return result
+
+def runBenchmark(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="spt-benchmark-") as work_folder:
+        source_folder = Path(work_folder) / "source"
+        output_folder = Path(work_folder) / "output"
+        timer = StageTimer()
+
+        images = timer.time(
+            "generate_tree",
+            generateTree,
+            source_folder=source_folder,
+            species=args.species,
+            variants=args.variants,
+            images=args.images,
+            image_size=args.image_size
+        )
+
+        tool_params = {
+            "source_folder": source_folder,
+            "output_folder": output_folder,
+            "conflict_resolution_method": "replace",
+            "config_prefix": "benchmark",
+            "jobs": args.jobs,
+            "batch_size": args.batch_size,
+            "encoder": args.encoder,
+            "compression": args.compression
+        }
+        tool = timer.time("setup", StellarisPortraitTool, **tool_params)
+        if args.pipeline:
+            timer.time("convert_and_generate", tool.bulkConvertAndGenerate)
+            conversion_time = timer.stages["convert_and_generate"]
+        else:
+            timer.time("convert", tool.bulkConvertImages)
+            timer.time("generate_configs", tool.bulkGenerateConfigs)
+            conversion_time = timer.stages["convert"]
+
+        # A second run over the unchanged tree measures the incremental path
+        rerun_tool = timer.time("rerun_setup", StellarisPortraitTool, **tool_params)
+        timer.time("rerun_convert", rerun_tool.bulkConvertImages)
+        timer.time("rerun_generate_configs", rerun_tool.bulkGenerateConfigs)
+
+        return {
+            "commit": gitCommit(),
+            "params": {
+                "species": args.species,
+                "variants": args.variants,
+                "images_per_folder": args.images,
+                "image_size": args.image_size,
+                "latency": args.latency,
+                "jobs": args.jobs,
+                "batch_size": args.batch_size,
+                "encoder": args.encoder,
+                "compression": args.compression,
+                "pipeline": args.pipeline,
+                "real_magick": args.real_magick
+            },
+            "files": len(images),
+            "files_per_sec": round(len(images) / conversion_time, 2) if conversion_time else None,
+            "stages": timer.stages,
+            "peak_rss_mb": round(peakRssMb(resource.RUSAGE_SELF), 2),
+            "peak_child_rss_mb": round(peakRssMb(resource.RUSAGE_CHILDREN), 2)
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark spt on a synthetic portrait tree")
+    parser.add_argument("--species", dest="species", type=int, default=10)
+    parser.add_argument("--variants", dest="variants", type=int, default=1)
+    parser.add_argument("--images", dest="images", type=int, default=10, help="Images in every species and variant folder")
+    parser.add_argument("--image-size", dest="image_size", type=int, default=64)
+    parser.add_argument("--latency", dest="latency", type=float, default=0.0, help="Seconds the fake magick waits per call")
+    parser.add_argument("--jobs", dest="jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1)
+    parser.add_argument("--encoder", dest="encoder", choices=["magick", "numpy"], default="magick")
+    parser.add_argument("--compression", dest="compression", choices=["auto", "dxt1", "dxt5"], default="dxt5")
+    parser.add_argument("--pipeline", dest="pipeline", action="store_true")
+    parser.add_argument("--real-magick", dest="real_magick", action="store_true", help="Use the ImageMagick on the PATH instead of the fake")
+    parser.add_argument("--json-out", dest="json_out", type=Path, help="Write the report to this file as well as stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    if not args.real_magick:
+        os.environ["PATH"] = os.pathsep.join([str(BENCHMARK_FOLDER / "fake_magick"), os.environ.get("PATH", "")])
+        os.environ["SPT_FAKE_MAGICK_LATENCY"] = str(args.latency)
+
+    report = json.dumps(runBenchmark(args), indent=4)
+    print(report)
+    if args.json_out:
+        args.json_out.write_text(report + "\n")
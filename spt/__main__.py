@@ -1,7 +1,11 @@
 import argparse
+import json
+import os
+import sys
 from pathlib import Path
 import logging
 from spt import StellarisPortraitTool
+from extensions import errors, metrics, plan, resize, schedule, shard
 
 def setup_logger(mode:str="INFO"):
     # Create a logger object
@@ -33,17 +37,21 @@ if __name__ == "__main__":
         "-s",
         "--source-folder",
         dest="source_folder",
-        required=True,
         type=Path,
-        help="The source folder containing all files/subfolders"
+        help="The source folder containing all files/subfolders. Required unless merging shards"
     )
     parser.add_argument(
         "-o",
         "--output-folder",
         dest="output_folder",
-        required=True,
         type=Path,
-        help="The location to output all new files"
+        help="The location to output all new files. Required unless serving"
+    )
+    parser.add_argument(
+        "--output-archive",
+        dest="output_archive",
+        action="store_true",
+        help="Write every file straight into a zip archive at the --output-folder path, such as output/example.zip, instead of a folder"
     )
     parser.add_argument(
         "--file-conflict",
@@ -59,6 +67,145 @@ if __name__ == "__main__":
         action="store_true",
         help="Do not convert any images"
     )
+    parser.add_argument(
+        "--full-rebuild",
+        dest="full_rebuild",
+        action="store_true",
+        help="Convert every image, even if the build manifest shows it is unchanged"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="The number of images to convert in parallel (defaults to the number of CPU cores)"
+    )
+    parser.add_argument(
+        "--encoder",
+        dest="encoder",
+        choices=["magick", "numpy"],
+        default="magick",
+        type=str,
+        help="The encoder used to convert images. 'numpy' runs in-process and does not need ImageMagick"
+    )
+    parser.add_argument(
+        "--compression",
+        dest="compression",
+        choices=["auto", "dxt1", "dxt5"],
+        default="dxt5",
+        type=str,
+        help="The DDS compression. 'auto' uses DXT1, which is half the size, for fully opaque images and DXT5 for the rest"
+    )
+    parser.add_argument(
+        "--dedupe",
+        dest="dedupe",
+        choices=["link", "copy", "off"],
+        default="link",
+        type=str,
+        help="Encode byte-identical source images once and hardlink ('link') or copy ('copy') the output for the other copies"
+    )
+    parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        type=int,
+        default=1,
+        help="The number of images in the same folder to convert with a single ImageMagick process"
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        help="Kill an ImageMagick process, and every process it started, once it has spent this many seconds per image. Timed out images are not retried"
+    )
+    parser.add_argument(
+        "--retries",
+        dest="retries",
+        type=int,
+        default=1,
+        help="How many more times to try converting an image that failed, waiting 0.5s before the first retry and twice as long before each one after"
+    )
+    parser.add_argument(
+        "--straggler-seconds",
+        dest="straggler_seconds",
+        type=float,
+        default=30.0,
+        help="Warn about every image still converting after this many seconds, repeating until it finishes. 0 turns the warnings off"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        dest="memory_budget",
+        type=str,
+        help="Only start a conversion once its memory, estimated from the image's dimensions, fits in this budget, such as 4G. ImageMagick is limited to each conversion's share"
+    )
+    parser.add_argument(
+        "--verify",
+        dest="verify",
+        action="store_true",
+        help="Check the header, dimensions and length of every DDS file before any config references it, converting invalid ones again. With --skip-image-convert, invalid and missing outputs fail the run"
+    )
+    parser.add_argument(
+        "--portrait-size",
+        dest="portrait_size",
+        type=str,
+        help="Resize every image to WIDTHxHEIGHT pixels while converting it, such as 512x512"
+    )
+    parser.add_argument(
+        "--fit",
+        dest="fit",
+        choices=resize.FITS,
+        default="cover",
+        type=str,
+        help="With --portrait-size, 'cover' fills the portrait and crops the overflow, 'contain' keeps the whole image and pads it"
+    )
+    parser.add_argument(
+        "--anchor",
+        dest="anchor",
+        choices=list(resize.ANCHORS),
+        default="center",
+        type=str,
+        help="With --portrait-size, the part of the image kept when cropping, or where it is placed when padding"
+    )
+    parser.add_argument(
+        "--padding",
+        dest="padding",
+        type=int,
+        default=0,
+        help="With --portrait-size, a transparent border in pixels around every side of the image"
+    )
+    parser.add_argument(
+        "--shard",
+        dest="shard",
+        type=str,
+        help="Only convert the images in shard i of N, written as i/N such as 1/4, and write a partial manifest for --merge-shards. Images are assigned to shards by a hash of their path"
+    )
+    parser.add_argument(
+        "--merge-shards",
+        dest="merge_shards",
+        nargs="+",
+        type=Path,
+        help="Generate every config from the partial manifests written by each --shard, without scanning any images"
+    )
+    ### Service
+    parser.add_argument(
+        "--serve",
+        dest="serve",
+        action="store_true",
+        help="Keep running as a local service, taking conversion and config jobs as JSON over HTTP on localhost or a Unix socket"
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        type=Path,
+        help="With --serve, listen on this Unix socket instead of a localhost port"
+    )
+    parser.add_argument(
+        "--port",
+        dest="port",
+        type=int,
+        default=8470,
+        help="With --serve, the port to listen on, only reachable from localhost"
+    )
     ### Debugging
     parser.add_argument(
         "--logging",
@@ -67,6 +214,12 @@ if __name__ == "__main__":
         default="INFO",
         help="Logging mode to use"
     )
+    parser.add_argument(
+        "--metrics-out",
+        dest="metrics_out",
+        type=Path,
+        help="Write per-phase timings, per-file conversion latency and bytes read/written to this JSON file"
+    )
     ### Config
     parser.add_argument(
         "-g",
@@ -75,6 +228,37 @@ if __name__ == "__main__":
         action="store_true",
         help="Generate configs for matching files"
     )
+    parser.add_argument(
+        "--pipeline",
+        dest="pipeline",
+        action="store_true",
+        help="Write each portrait group config as soon as its images are converted, instead of after every image is converted"
+    )
+    parser.add_argument(
+        "--plan",
+        dest="plan",
+        action="store_true",
+        help="Print what the run would convert, write, remove and conflict with as JSON, without converting or writing anything"
+    )
+    parser.add_argument(
+        "--watch",
+        dest="watch",
+        action="store_true",
+        help="Keep running after converting, and update outputs (and configs with -g) whenever source files change"
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        dest="watch_debounce",
+        type=float,
+        default=0.2,
+        help="With --watch, the seconds to wait for more changes before updating, so a burst of saves is handled once"
+    )
+    parser.add_argument(
+        "--merge-configs",
+        dest="merge_configs",
+        action="store_true",
+        help="Merge new portrait refs and missing keys into configs that were edited or written by something else, instead of handling them with --file-conflict. Comments in merged files are not kept"
+    )
     parser.add_argument(
         "--config-prefix",
         dest="config_prefix",
@@ -95,23 +279,101 @@ if __name__ == "__main__":
 
     logger = setup_logger(mode=args.logging)
 
+    if args.watch and args.skip_image_convert:
+        parser.error("--watch updates outputs as images change, so it can't be used with --skip-image-convert")
+    if args.serve:
+        if args.source_folder or args.output_folder or args.shard or args.merge_shards or args.watch:
+            parser.error("--serve takes the source and output folders from each job, so it can't be used with -s, -o, --shard, --merge-shards or --watch")
+    elif args.output_folder is None:
+        parser.error("the following arguments are required: -o/--output-folder")
+    elif args.source_folder is None and not args.merge_shards:
+        parser.error("the following arguments are required: -s/--source-folder")
+    if args.shard and (args.generate_configs or args.watch or args.skip_image_convert):
+        parser.error("--shard only converts images, generate configs afterwards with --merge-shards")
+    if args.merge_shards and (args.shard or args.watch):
+        parser.error("--merge-shards only generates configs, so it can't be used with --shard or --watch")
+    if args.plan and (args.watch or args.merge_shards or args.serve):
+        parser.error("--plan describes a single run, so it can't be used with --watch, --merge-shards or --serve")
+    if args.watch and args.output_archive:
+        parser.error("--watch updates outputs in place, which a zip archive doesn't support, so it can't be used with --output-archive")
+    if args.padding < 0:
+        parser.error("--padding is a border in pixels, so it can't be negative")
+
     spt_params = {
         "source_folder": args.source_folder,
         "output_folder": args.output_folder,
         "conflict_resolution_method": args.conflict_resolution_method,
-        "species_archetype": args.species_archetype
+        "species_archetype": args.species_archetype,
+        "jobs": args.jobs,
+        "full_rebuild": args.full_rebuild,
+        "batch_size": args.batch_size,
+        "encoder": args.encoder,
+        "compression": args.compression,
+        "dedupe": args.dedupe,
+        "output_archive": args.output_archive,
+        "timeout": args.timeout,
+        "retries": args.retries,
+        "straggler_seconds": args.straggler_seconds,
+        "verify": args.verify,
+        "merge_configs": args.merge_configs
     }
 
     if args.config_prefix:
         spt_params["config_prefix"] = args.config_prefix
 
+    if args.shard:
+        try:
+            spt_params["shard"] = shard.parseShard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.memory_budget:
+        try:
+            spt_params["memory_budget"] = schedule.MemoryBudget(schedule.parseMemorySize(args.memory_budget))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.portrait_size:
+        try:
+            spt_params["crop_settings"] = resize.CropSettings.fromSize(args.portrait_size, fit=args.fit, anchor=args.anchor, padding=args.padding)
+        except ValueError as e:
+            parser.error(str(e))
+
+    run_metrics = metrics.Metrics() if args.metrics_out else metrics.NullMetrics()
+    spt_params["run_metrics"] = run_metrics
+
     ### Start tool execution ###
-    spt = StellarisPortraitTool(
-        **spt_params
-    )
-    
-    if not args.skip_image_convert:
-        spt.bulkConvertImages()
-    
-    if args.generate_configs:
-        spt.bulkGenerateConfigs()
+    if args.serve:
+        import service
+
+        for job_param in ["source_folder", "output_folder", "conflict_resolution_method", "species_archetype", "full_rebuild", "merge_configs", "jobs"]:
+            spt_params.pop(job_param)
+        # Each job records its own metrics, which are returned with its result
+        spt_params.pop("run_metrics")
+        portrait_service = service.PortraitService(spt_params=spt_params, jobs=args.jobs)
+        service.serve(portrait_service, socket_path=args.socket, port=args.port)
+        sys.exit(0)
+
+    try:
+        with StellarisPortraitTool(**spt_params) as spt:
+            if args.merge_shards:
+                spt.mergeShards(shard_manifest_paths=args.merge_shards)
+            elif args.plan:
+                build_plan = spt.plan(generate_configs=args.generate_configs, skip_image_convert=args.skip_image_convert)
+                plan_report = build_plan.report()
+                print(json.dumps(plan_report, indent=1))
+                logging.info(f"Plan: {plan_report['work']['images']} images to convert, {plan_report['images']['up_to_date']} up to date, {plan_report['work']['configs_written']} configs to write and {len(plan_report['conflicts'])} conflicts")
+                # Nothing was written, so an archive is left as it was
+                spt.close(completed=False)
+                if args.conflict_resolution_method == "stop" and build_plan.conflicts:
+                    raise plan.conflictError(build_plan.conflicts)
+            elif args.watch:
+                spt.watch(generate_configs=args.generate_configs, debounce=args.watch_debounce)
+            else:
+                spt.run(generate_configs=args.generate_configs, pipeline=args.pipeline, skip_image_convert=args.skip_image_convert)
+    except errors.SptError as e:
+        logging.error(e)
+        sys.exit(1)
+    finally:
+        if args.metrics_out:
+            run_metrics.write(args.metrics_out)
@@ -1 +1 @@
-__all__ = ["image", "config"]
\ No newline at end of file
+__all__ = ["image", "config", "templates", "manifest", "encoders", "clausewitz", "metrics", "index", "png", "dds", "resize", "prescan", "watch", "output", "shard", "errors", "schedule", "plan", "verify"]
\ No newline at end of file
@@ -0,0 +1,481 @@
+import re
+from typing import TextIO
+
+# https://pdx.tools/blog/a-tour-of-pds-clausewitz-syntax
+
+QUOTE_REQUIRED_CHARACTERS = frozenset(' \t\r\n/\\={}[]"#')
+
+OPERATORS = frozenset(["=", "<", ">", "<=", ">=", "!=", "?="])
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:\#[^\n]*(?=\n|$)\s*)*                         # Whitespace and comments before the token
+    (
+        [^\s{}=<>\#"!?]+(?:[!?](?!=)[^\s{}=<>\#"!?]*)*  # A bare word
+        |[{}=]
+        |"[^"\\]*(?:\\.?[^"\\]*)*"?                     # A quoted string, which may be cut off at the end of the text
+        |[<>]=?|[!?]=                                   # A comparison
+        |[!?](?:[^\s{}=<>\#"!?]|[!?](?!=))*             # A bare word starting with ! or ?
+        |\Z                                             # Only whitespace and comments left, so no text is skipped
+    )
+""", re.VERBOSE | re.DOTALL)
+QUOTED_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+INTEGER_PATTERN = re.compile(r"-?\d+")
+FLOAT_PATTERN = re.compile(r"-?\d+\.\d+")
+ESCAPE_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+
+class RepeatedValues(list):
+    """The values of a key that appears more than once in a block, in file order. Written back as one pair per value
+    """
+
+class Comparison:
+    def __init__(self, operator:str, value):
+        """A pair that compares rather than assigns, such as num_pops > 5 in a trigger
+
+        Args:
+            operator (str): The operator, such as ">" or "!="
+            value: The value compared against
+        """
+        self.operator = operator
+        self.value = value
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Comparison) and (self.operator, self.value) == (other.operator, other.value)
+
+    def __repr__(self) -> str:
+        return f"Comparison({self.operator!r}, {self.value!r})"
+
+class ClausewitzSyntaxError(ValueError):
+    def __init__(self, message:str, line:int):
+        super().__init__(f"{message} on line {line}")
+        self.line = line
+
+def quoteString(string:str) -> str:
+    """Wraps a string in quotes, escaping any quote or backslash characters inside it
+
+    Args:
+        string (str): The string to quote
+
+    Returns:
+        str: The quoted string
+    """
+    return '"' + string.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def formatKey(key) -> str:
+    """Formats a key, only quoting it when it contains characters that would break the syntax
+
+    Args:
+        key: The key to format
+
+    Returns:
+        str: The formatted key
+    """
+    key = str(key)
+    if not key or not QUOTE_REQUIRED_CHARACTERS.isdisjoint(key):
+        return quoteString(key)
+    return key
+
+def formatScalar(value, quoted:bool=False) -> str:
+    """Formats a single value
+
+    Args:
+        value: The value to format. Numbers are never quoted, and booleans are written as yes/no
+        quoted (bool, optional): Whether string values should always be quoted. Defaults to False
+
+    Returns:
+        str: The formatted value
+    """
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, (int, float)):
+        return str(value)
+    string = "" if value is None else str(value)
+    if quoted or not string or not QUOTE_REQUIRED_CHARACTERS.isdisjoint(string):
+        return quoteString(string)
+    return string
+
+class Serializer:
+    def __init__(self, file:TextIO, quoted_value_keys:set=frozenset(), indent:str="    "):
+        """Writes python dicts to a file handle in PDX Clausewitz syntax, one line at a time
+
+        Args:
+            file (TextIO): The file handle to write to
+            quoted_value_keys (set, optional): Keys whose string values should always be quoted. Defaults to frozenset()
+            indent (str, optional): The indentation for each nesting level. Defaults to "    "
+        """
+        self.file = file
+        self.quoted_value_keys = quoted_value_keys
+        self.indent = indent
+        self.indents = [""]
+        self.started = False
+
+    def writeLine(self, depth:int, *parts:str):
+        """Writes a single line. Lines are separated, not terminated, by newlines, so the file has no trailing newline
+
+        Args:
+            depth (int): The nesting level of the line
+            *parts (str): The text of the line
+        """
+        while len(self.indents) <= depth:
+            self.indents.append(self.indents[-1] + self.indent)
+        if self.started:
+            self.file.write("\n")
+        self.started = True
+        self.file.write(self.indents[depth])
+        for part in parts:
+            self.file.write(part)
+
+    def writePairs(self, mapping:dict, depth:int=0):
+        """Writes every key = value pair of a dict
+
+        Args:
+            mapping (dict): The dict to write
+            depth (int, optional): The nesting level of the pairs. Defaults to 0
+        """
+        for key, value in mapping.items():
+            self.writeValue(key=key, value=value, depth=depth)
+
+    def writeValue(self, key, value, depth:int):
+        """Writes a single key = value pair, where the value may be a dict, list or scalar
+
+        Args:
+            key: The key of the pair
+            value: The value of the pair
+            depth (int): The nesting level of the pair
+        """
+        formatted_key = formatKey(key)
+        if isinstance(value, RepeatedValues):
+            for repeated_value in value:
+                self.writeValue(key=key, value=repeated_value, depth=depth)
+        elif isinstance(value, Comparison):
+            self.writeLine(depth, formatted_key, f" {value.operator} ", formatScalar(value.value, quoted=key in self.quoted_value_keys))
+        elif isinstance(value, dict):
+            if not value:
+                self.writeLine(depth, formatted_key, " = {}")
+                return
+            self.writeLine(depth, formatted_key, " = {")
+            self.writePairs(value, depth + 1)
+            self.writeLine(depth, "}")
+        elif isinstance(value, (list, tuple)):
+            if not value:
+                self.writeLine(depth, formatted_key, " = {}")
+                return
+            self.writeLine(depth, formatted_key, " = {")
+            self.writeItems(value, depth + 1)
+            self.writeLine(depth, "}")
+        else:
+            self.writeLine(depth, formatted_key, " = ", formatScalar(value, quoted=key in self.quoted_value_keys))
+
+    def writeItems(self, items:list, depth:int):
+        """Writes the items of a list, one per line. Dict and list items are written as anonymous blocks
+
+        Args:
+            items (list): The items to write
+            depth (int): The nesting level of the items
+        """
+        for item in items:
+            if isinstance(item, dict):
+                self.writeLine(depth, "{")
+                self.writePairs(item, depth + 1)
+                self.writeLine(depth, "}")
+            elif isinstance(item, list):
+                self.writeLine(depth, "{")
+                self.writeItems(item, depth + 1)
+                self.writeLine(depth, "}")
+            else:
+                self.writeLine(depth, formatScalar(item))
+
+def dump(config:dict, file:TextIO, quoted_value_keys:set=frozenset()):
+    """Writes a config dict to a file handle in PDX Clausewitz syntax
+
+    Args:
+        config (dict): The config, as produced by the classes in templates.py
+        file (TextIO): The file handle to write to
+        quoted_value_keys (set, optional): Keys whose string values should always be quoted. Defaults to frozenset()
+    """
+    Serializer(file=file, quoted_value_keys=quoted_value_keys).writePairs(config)
+
+def findTokens(text:str, end:int) -> list[str]:
+    tokens = TOKEN_PATTERN.findall(text, 0, end)
+    # The empty matches at the end of the text
+    while tokens and not tokens[-1]:
+        tokens.pop()
+    return tokens
+
+class Tokenizer:
+    def __init__(self, file:TextIO, chunk_size:int=65536):
+        """Splits PDX Clausewitz text into tokens, reading the file a chunk at a time so the whole file is never in memory.
+        Whitespace and comments are dropped
+
+        Args:
+            file (TextIO): The file handle to read from
+            chunk_size (int, optional): The characters read at a time. Defaults to 65536
+        """
+        self.file = file
+        self.chunk_size = chunk_size
+        # The whole lines most recently split into tokens, and the line they start on, so errors can name their line
+        self.text = ""
+        self.first_line = 1
+
+    def chunks(self):
+        """Yields the tokens of the file a chunk at a time. Only whole lines are split, as only a quoted string can carry
+        on past the end of a line. Quoted strings keep their quotes, so they can be told apart from bare words
+
+        Raises:
+            ClausewitzSyntaxError: When a quoted string isn't closed
+
+        Yields:
+            list[str]: The tokens of each chunk
+        """
+        remainder = ""
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                break
+            buffer = remainder + chunk
+            cut = buffer.rfind("\n") + 1
+            remainder = buffer[cut:]
+            tokens = findTokens(buffer, cut)
+            if tokens and tokens[-1][0] == '"' and not QUOTED_PATTERN.fullmatch(tokens[-1]):
+                # A quoted string that spans lines runs to the cut, and is finished in a later chunk
+                cut -= len(tokens.pop())
+                remainder = buffer[cut:]
+            self.first_line += self.text.count("\n")
+            self.text = buffer[:cut]
+            yield tokens
+
+        tokens = findTokens(remainder, len(remainder))
+        self.first_line += self.text.count("\n")
+        self.text = remainder
+        if tokens and tokens[-1][0] == '"' and not QUOTED_PATTERN.fullmatch(tokens[-1]):
+            raise self.error("Unclosed quoted string", index=len(tokens) - 1)
+        yield tokens
+
+    def tokens(self):
+        """Yields every token in the file
+
+        Yields:
+            str: Each token
+        """
+        for tokens in self.chunks():
+            yield from tokens
+
+    def line(self, index:int) -> int:
+        """Finds the line of a token in the chunk most recently yielded. Only used for errors, so the tokens are found again
+        rather than tracking where every token is
+
+        Args:
+            index (int): The position of the token in the chunk
+
+        Returns:
+            int: The line number, starting from 1
+        """
+        for position, match in enumerate(TOKEN_PATTERN.finditer(self.text)):
+            if position == index:
+                return self.first_line + self.text.count("\n", 0, match.start(1))
+        return self.first_line + self.text.count("\n")
+
+    def error(self, message:str, index:int) -> ClausewitzSyntaxError:
+        return ClausewitzSyntaxError(message, line=self.line(index))
+
+def parseScalar(token:str):
+    """Converts a token to the value it stands for. Numbers that would be written back the same way become numbers, and
+    everything else stays a string, including yes and no
+
+    Args:
+        token (str): A quoted string or bare word
+
+    Returns:
+        str | int | float: The value
+    """
+    if token[0] == '"':
+        string = token[1:-1]
+        return ESCAPE_PATTERN.sub(r"\1", string) if "\\" in string else string
+    if token[0] in "-0123456789":
+        if INTEGER_PATTERN.fullmatch(token) and str(int(token)) == token:
+            return int(token)
+        if FLOAT_PATTERN.fullmatch(token) and str(float(token)) == token:
+            return float(token)
+    return token
+
+def blockValue(mapping:dict, items:list):
+    # Empty blocks are empty dicts, so the shape matches templates.py
+    return items or mapping
+
+class Parser:
+    def __init__(self, file:TextIO, chunk_size:int=65536):
+        """Reads PDX Clausewitz text into python dicts shaped like the ones in templates.py. Blocks of key = value pairs
+        become dicts, blocks of bare values become lists, and keys that appear more than once in a block become
+        RepeatedValues
+
+        Args:
+            file (TextIO): The file handle to read from
+            chunk_size (int, optional): The characters read at a time. Defaults to 65536
+        """
+        self.tokenizer = Tokenizer(file=file, chunk_size=chunk_size)
+
+    def pairs(self):
+        """Yields each top level pair as soon as its closing brace is read, so a large file is read one pair at a time.
+        Nested blocks are read with a stack rather than recursion, so deep nesting can't exceed the recursion limit
+
+        Raises:
+            ClausewitzSyntaxError: When the file isn't valid Clausewitz syntax
+
+        Yields:
+            tuple: The key and value of each pair
+        """
+        # The pairs and bare values of the open block
+        mapping = {}
+        items = []
+        # (mapping, items, key, operator) of each enclosing block, where key and operator lead to the open block
+        stack = []
+        # A word that is either a key or a bare value, decided by the token after it
+        word = None
+        key = None
+        operator = None
+        index = 0
+
+        for tokens in self.tokenizer.chunks():
+            for index, token in enumerate(tokens):
+                if word is not None:
+                    if token in OPERATORS:
+                        key = parseScalar(word) if word[0] == '"' else word
+                        operator = token
+                        word = None
+                        continue
+                    if not stack:
+                        raise self.tokenizer.error("Bare value outside of a block", index=max(0, index - 1))
+                    items.append(parseScalar(word))
+                    word = None
+
+                if operator is not None:
+                    if token == "{":
+                        stack.append((mapping, items, key, operator))
+                        mapping = {}
+                        items = []
+                    elif token == "}" or token in OPERATORS:
+                        raise self.tokenizer.error(f"Missing value after '{operator}'", index=index)
+                    else:
+                        value = parseScalar(token)
+                        addPair(mapping, key, value if operator == "=" else Comparison(operator, value))
+                    key = None
+                    operator = None
+                elif token == "{":
+                    # An anonymous block, which is a bare value of the open block. Tagged values such as
+                    # "color = hsv { 0.1 0.2 0.3 }" aren't supported, and would otherwise leave one here
+                    if not stack:
+                        raise self.tokenizer.error("Anonymous block outside of a block", index=index)
+                    stack.append((mapping, items, None, None))
+                    mapping = {}
+                    items = []
+                elif token == "}":
+                    if not stack:
+                        raise self.tokenizer.error("Unexpected '}'", index=index)
+                    if mapping and items:
+                        raise self.tokenizer.error("Block mixes key = value pairs and bare values", index=index)
+                    value = blockValue(mapping, items)
+                    mapping, items, block_key, block_operator = stack.pop()
+                    if block_key is None:
+                        items.append(value)
+                    else:
+                        addPair(mapping, block_key, value if block_operator == "=" else Comparison(block_operator, value))
+                elif token in OPERATORS:
+                    raise self.tokenizer.error(f"Unexpected '{token}'", index=index)
+                else:
+                    word = token
+
+                if mapping and not stack:
+                    # A top level pair is complete as soon as it is added
+                    yield from mapping.items()
+                    mapping = {}
+
+        if word is not None:
+            raise self.tokenizer.error("Bare value outside of a block" if not stack else "Missing '}' at the end of the file", index=index)
+        if operator is not None:
+            raise self.tokenizer.error(f"Missing value after '{operator}'", index=index)
+        if stack:
+            raise self.tokenizer.error("Missing '}' at the end of the file", index=index)
+
+def addPair(mapping:dict, key:str, value):
+    """Adds a pair to a block, collecting the values of a repeated key in RepeatedValues
+
+    Args:
+        mapping (dict): The block's pairs
+        key (str): The key
+        value: The value
+    """
+    if key not in mapping:
+        mapping[key] = value
+    elif isinstance(mapping[key], RepeatedValues):
+        mapping[key].append(value)
+    else:
+        mapping[key] = RepeatedValues([mapping[key], value])
+
+def iterPairs(file:TextIO):
+    """Reads the top level pairs of a PDX Clausewitz file one at a time
+
+    Args:
+        file (TextIO): The file handle to read from
+
+    Raises:
+        ClausewitzSyntaxError: When the file isn't valid Clausewitz syntax
+
+    Yields:
+        tuple: The key and value of each pair
+    """
+    yield from Parser(file=file).pairs()
+
+def load(file:TextIO) -> dict:
+    """Reads a PDX Clausewitz file into a config dict, the reverse of dump
+
+    Args:
+        file (TextIO): The file handle to read from
+
+    Raises:
+        ClausewitzSyntaxError: When the file isn't valid Clausewitz syntax
+
+    Returns:
+        dict: The config
+    """
+    config = {}
+    for key, value in iterPairs(file):
+        addPair(config, key, value)
+    return config
+
+def merge(existing, generated):
+    """Merges a generated config into one read from an existing file. Keys and list items missing from the existing
+    config are added, while every value it already has is kept
+
+    Args:
+        existing: The existing config or value, which is updated in place where possible
+        generated: The generated config or value
+
+    Returns:
+        The merged config or value
+    """
+    if isinstance(existing, RepeatedValues):
+        # Of several blocks such as add = { ... }, merged into the first with the same keys, so a hand written block with
+        # extra conditions is left alone. Otherwise merged into the first value that can take it
+        candidates = [index for index, existing_value in enumerate(existing) if type(existing_value) is type(generated)]
+        if isinstance(generated, dict):
+            candidates.sort(key=lambda index: existing[index].keys() != generated.keys())
+        if candidates:
+            existing[candidates[0]] = merge(existing[candidates[0]], generated)
+        return existing
+    if isinstance(existing, dict) and isinstance(generated, dict):
+        for key, value in generated.items():
+            existing[key] = merge(existing[key], value) if key in existing else value
+        return existing
+    if isinstance(existing, list) and isinstance(generated, list):
+        existing_items = set(item for item in existing if not isinstance(item, (dict, list)))
+        for item in generated:
+            if isinstance(item, (dict, list)):
+                if item not in existing:
+                    existing.append(item)
+            elif item not in existing_items:
+                existing.append(item)
+                existing_items.add(item)
+        return existing
+    if existing == {} and isinstance(generated, list):
+        # An empty block reads back as an empty dict
+        return list(generated)
+    return existing
@@ -1,15 +1,60 @@
+import collections
+import hashlib
+import io
 import logging
 from pathlib import Path
-import json
-import sys
 
-from . import templates
+from . import templates, clausewitz, errors, index, manifest, metrics, output
 
 # https://pdx.tools/blog/a-tour-of-pds-clausewitz-syntax
 
+class RenderedConfigs:
+    def __init__(self, budget:int=64 * 1024 ** 2):
+        """Configs rendered while planning a run, so writing them afterwards doesn't render them again. Only up to the
+        budget is kept, and anything past it is rendered again when written, so memory stays bounded however many
+        configs there are
+
+        Args:
+            budget (int, optional): The most rendered bytes to keep. Defaults to 64MiB
+        """
+        self.budget = budget
+        self.size = 0
+        self.contents = {
+            # Example
+            # Path("output/gfx/portraits/portraits/example_tau.txt"): b"portraits = {..."
+        }
+
+    def add(self, config_filepath:Path, config_content:bytes):
+        if self.size + len(config_content) <= self.budget:
+            self.contents[config_filepath] = config_content
+            self.size += len(config_content)
+
+    def pop(self, config_filepath:Path) -> bytes:
+        """Takes the rendered content of a config out of the cache
+
+        Args:
+            config_filepath (Path): The config file
+
+        Returns:
+            bytes: The content, or None if it wasn't kept
+        """
+        config_content = self.contents.pop(config_filepath, None)
+        if config_content is not None:
+            self.size -= len(config_content)
+        return config_content
+
+    def clear(self):
+        """Drops every rendered config, such as when a failed conversion means the configs will differ from the plan
+        """
+        self.contents.clear()
+        self.size = 0
+
 class Configs:
-    def __init__(self, source_path, mod_prefix:str="", conflict_resolution_method:str="stop", species_archetype:str="BIOLOGICAL"):
+    def __init__(self, source_path, mod_prefix:str="", conflict_resolution_method:str="stop", species_archetype:str="BIOLOGICAL", file_index:index.FileIndex=None, portrait_groups:list=None, run_metrics:metrics.Metrics=None, build_manifest:manifest.Manifest=None, run_output:output.Output=None, merge_configs:bool=False, rendered_configs:RenderedConfigs=None):
         self.source_path = Path(source_path)
+        self.file_index = file_index or index.FileIndex()
+        self.output = run_output or output.DirectoryOutput(root=self.source_path, file_index=self.file_index)
+        self.tree = self.file_index.tree(self.source_path)
         self.config_store = {
             # Example
             # group_id: {
@@ -20,7 +65,14 @@ class Configs:
         self.mod_prefix = mod_prefix
         self.conflict_resolution_method = conflict_resolution_method
         self.species_archetype = species_archetype
-        self.quoted_value_keys = []
+        self.portrait_groups = portrait_groups
+        self.metrics = run_metrics or metrics.NullMetrics()
+        self.build_manifest = build_manifest
+        self.merge_configs = merge_configs
+        # Filled in by planGroups and used by renderConfig, when the run is planned first
+        self.rendered_configs = rendered_configs
+        self.config_counts = collections.Counter()
+        self.quoted_value_keys = set()
         try:
             self.setup()
         except AttributeError as e:
@@ -46,124 +98,6 @@ class Configs:
             key_string = key_string.replace(string, seperator)
         return key_string
 
-
-    @staticmethod
-    def replaceSquareBrackets(string:str) -> str:
-        """Replaces all [] with {} characters in the provided string
-
-        Args:
-            string (str): The string to clear of [] characters
-
-        Returns:
-            str: The string with only {} characters
-        """
-        replace_array = [
-            ['[', '{'], 
-            [']', '}']
-        ]
-        for replacement in replace_array:
-            string = string.replace(*replacement)
-        
-        return string
-
-    @staticmethod
-    def checkRequiredQuotes(string:str) -> bool:
-        """Check if the provided string has any characters that require the string remain quoted
-
-        Args:
-            string (str): The string to check
-
-        Returns:
-            bool: Whether the string should be kept quoted
-        """
-        quote_required_characters = [
-            " ",
-            "/",
-            "\\"
-        ]
-        # if not any(substring in string.strip(" ") for substring in quote_required_characters):
-        #     # string = self.removeQuotes(string)
-        quotes_required = any(substring in string.strip(" ") for substring in quote_required_characters)
-
-        return quotes_required
-
-    def removeQuotes(self, string:str) -> str:
-        """Remove all quotes where allowed in the provided string
-
-        Args:
-            string (str): The string to clear of quote characters where allowed
-
-        Returns:
-            str: The cleaned string
-        """
-        replace_array = [
-            ['"', ''], 
-            ["'", '']
-        ]
-        if self.checkRequiredQuotes(string=string):
-            return string
-        
-        for replacement in replace_array:
-            string = string.replace(*replacement)
-        
-        return string
-
-    def checkQuotedValueKey(self, key:str) -> bool:
-        """Check if the provided key should have its value kept inside of a quote
-
-        Args:
-            key (str): The key to check against the internal self.quoted_value_keys list
-
-        Returns:
-            bool: Whether the key is for a value that should remain quoted
-        """
-        trimmed_key = self.removeQuotes(key.strip())
-        if trimmed_key in self.quoted_value_keys:
-            return True
-        return False
-
-    def cleanConfig(self, string:str) -> str:
-        """Converts the python dict to a format closer to what Stellaris requires in its config
-
-        Args:
-            string (str): The python dict as a pretty printed string
-
-        Returns:
-            str: The cleaned config as a string
-        """
-        # Replace square brackets with curly
-        string = self.replaceSquareBrackets(string)
-
-        # Remove leading/trailing curly brackets
-        string = string.split('{\n',1)[1].rsplit('}',1)[0]
-
-        # Remove quotes on all leading variable names etc
-        lines = string.splitlines()
-
-        cleaned_lines = []
-        for line in lines:
-            if "=" not in line:
-                cleaned_lines.append(self.removeQuotes(line)[4:])
-                continue
-            
-            line_parts = line.split("=")
-            new_parts = []
-            for part in line_parts[:-1]:
-                new_parts.append(self.removeQuotes(part))
-
-            potential_key = new_parts[0]
-            last_part = line_parts[-1]
-            if not self.checkQuotedValueKey(key=potential_key):
-                new_parts.append(self.removeQuotes(last_part))
-            else:
-                new_parts.append(last_part)
-        
-            cleaned_lines.append("=".join(new_parts)[4:])
-
-        string = "\n".join(cleaned_lines)
-
-        return string
-    
     def createSpeciesClassName(self):
         species_class_name = "_".join([
             self.mod_prefix,
@@ -197,7 +131,7 @@ class Configs:
         return portrait_category_name
 
     def createVariantPrefix(self, file:Path) -> str:
-        """Creates a variant prefix to be used to denote sub classes of a species
+        """Creates a variant prefix to be used to denote sub classes of a species. The prefix is cached per folder
 
         Args:
             file (Path): The file you'd like generate the variant prefix for
@@ -205,20 +139,27 @@ class Configs:
         Returns:
             str: The variant prefix
         """
-        image_relative_path = file.relative_to(self.image_root_path)
+        directory = file.parent
+        return self.file_index.cached(
+            ("variant_prefix", self.image_root_path, directory),
+            lambda: self.createDirectoryVariantPrefix(directory=directory)
+        )
 
-        if (len(image_relative_path.parents)) <= 2:
+    def createDirectoryVariantPrefix(self, directory:Path) -> str:
+        directory_relative_path = directory.relative_to(self.image_root_path)
+
+        if (len(directory_relative_path.parents)) <= 1:
             return ""
         
         # The below creates the variant prefix which is any sub folder under each portrait folder
-        variant_prefix = str(image_relative_path.parent)
+        variant_prefix = str(directory_relative_path)
         variant_prefix = self.replaceKeySeperators(variant_prefix)
         variant_prefix = variant_prefix.split("_", 1)[1]
 
         return variant_prefix
     
     def createGroupKey(self, file:Path) -> str:
-        """Create a group key based on the file path
+        """Create a group key based on the file path. The key is cached per folder
 
         Args:
             file (Path): The group key for the specific file
@@ -226,8 +167,14 @@ class Configs:
         Returns:
             str: The generated group key
         """
-        image_relative_path = file.relative_to(self.image_root_path)
-        group_key = str(image_relative_path.parent)
+        directory = file.parent
+        return self.file_index.cached(
+            ("group_key", self.image_root_path, self.mod_prefix, directory),
+            lambda: self.createDirectoryGroupKey(directory=directory)
+        )
+
+    def createDirectoryGroupKey(self, directory:Path) -> str:
+        group_key = str(directory.relative_to(self.image_root_path))
         group_key = self.replaceKeySeperators(group_key)
         if self.mod_prefix != "":
             group_key = "_".join([
@@ -237,94 +184,637 @@ class Configs:
         return group_key
 
     def dumpConfigs(self):
-        """Converts the stored configs in this class to pretty printed JSON, which are then converted to Stellaris PDX clausewitz format
+        """Writes the stored configs in this class straight to their files in Stellaris PDX clausewitz format, then
+        removes the configs an earlier run wrote that are no longer generated
         """
 
         for group_key in self.config_store.keys():
-            logging.debug(f"Creating config for '{group_key}'")
-            pretty_config = json.dumps(
-                self.config_store[group_key]['content'],
-                sort_keys=False,
-                indent=4,
-                separators=('', ' = ')
-            )
-
-            pretty_config = self.cleanConfig(string=pretty_config)
-        
-            config_filename = self.config_store[group_key]['filename']
-            config_filepath = self.config_root_path / config_filename
-
-            if config_filepath.is_file():
-                match self.conflict_resolution_method:
-                    case "stop":
-                        logging.error(f"File conflict: '{config_filepath}' already exists, stopping execution. Check --help if you'd like files to be overrode")
-                        sys.exit(1)
-                    case "skip":
-                        logging.debug(f"File conflict: '{config_filepath}' already exists, skipping")
-                        continue
-            
-            logging.info(f"Saving '{group_key}' config to '{config_filepath}'")
-            config_filepath.parent.mkdir(parents=True, exist_ok=True)
-            with open(config_filepath, "w") as config_file:
-                config_file.write(pretty_config)
+            self.dumpConfig(group_key=group_key)
+        self.removeStaleConfigs()
+        self.reportConfigCounts()
+
+    def renderConfig(self, group_key:str) -> bytes:
+        """Renders a single stored config in Stellaris PDX clausewitz format, or takes it from rendered_configs if the
+        plan already rendered it
+
+        Args:
+            group_key (str): The key of the config in the config_store
+
+        Returns:
+            bytes: The config file content
+        """
+        if self.rendered_configs is not None:
+            config_content = self.rendered_configs.pop(self.config_root_path / self.config_store[group_key]['filename'])
+            if config_content is not None:
+                return config_content
+        return self.renderContent(config_content=self.config_store[group_key]['content'])
+
+    def renderContent(self, config_content:dict) -> bytes:
+        config_buffer = io.StringIO()
+        clausewitz.dump(
+            config=config_content,
+            file=config_buffer,
+            quoted_value_keys=self.quoted_value_keys
+        )
+        return config_buffer.getvalue().encode("utf-8")
+
+    def isOwnConfig(self, config_filepath:Path, existing_digest:str) -> bool:
+        """Check whether an existing config was written by this tool and hasn't been edited since, so it can be updated
+        or removed without treating it as a conflict
+
+        Args:
+            config_filepath (Path): The existing config file
+            existing_digest (str): The sha256 hex digest of its current content
+
+        Returns:
+            bool: Whether the file belongs to this tool
+        """
+        if config_filepath in self.file_index.written_files:
+            return True
+        return self.build_manifest is not None and self.build_manifest.configDigest(config_filepath) == existing_digest
+
+    def checkConfig(self, config_filepath:Path, config_content:bytes) -> str:
+        """Compares a rendered config with the file it would be written to, without writing anything
+
+        Args:
+            config_filepath (Path): The config file
+            config_content (bytes): The rendered config
+
+        Returns:
+            str: "new" when there is no file yet, "unchanged" when the file already holds the content, "update" when this
+                tool wrote the file, "merge" when merging configs into a file this tool didn't write or merged into before,
+                or "conflict" when it didn't write it and configs aren't merged
+        """
+        if not self.tree.isFile(config_filepath):
+            return "new"
+        try:
+            existing_content = self.output.readBytes(config_filepath)
+        except OSError as e:
+            logging.warning(f"Unable to read '{config_filepath}', it will be treated as changed: {e}")
+            existing_content = None
+        if existing_content == config_content:
+            return "unchanged"
+
+        existing_digest = None if existing_content is None else hashlib.sha256(existing_content).hexdigest()
+        own_config = self.isOwnConfig(config_filepath=config_filepath, existing_digest=existing_digest)
+        if self.build_manifest is not None and self.build_manifest.isMergedConfig(config_filepath):
+            # A merged file holds edits this tool didn't make, so it is only ever merged into again
+            own_config = False
+        if self.merge_configs and existing_content is not None and not own_config:
+            return "merge"
+        if own_config:
+            return "update"
+        return "conflict"
+
+    def mergeConfig(self, config_filepath:Path, group_key:str) -> tuple[str, bytes]:
+        """Merges a stored config into the existing file it would be written to, adding what is missing from the file
+        and keeping everything else in it. Comments and formatting are not kept
+
+        Args:
+            config_filepath (Path): The existing config file
+            group_key (str): The key of the config in the config_store
+
+        Returns:
+            tuple[str, bytes]: "merge" and the merged content, "unchanged" and the existing content when there is nothing
+                to add, or "conflict" and the rendered config when the existing file can't be read
+        """
+        try:
+            existing_content = self.output.readBytes(config_filepath)
+            existing_config = clausewitz.load(io.TextIOWrapper(io.BytesIO(existing_content), encoding="utf-8-sig"))
+        except (OSError, UnicodeDecodeError, clausewitz.ClausewitzSyntaxError) as e:
+            logging.warning(f"Unable to merge into '{config_filepath}', it will be treated as a conflict: {e}")
+            return "conflict", self.renderConfig(group_key=group_key)
+
+        with self.metrics.phase(f"merge_configs:{self.__class__.__name__}"):
+            merged_content = self.renderContent(config_content=self.mergeContent(
+                existing_config=existing_config,
+                config_content=self.config_store[group_key]['content']
+            ))
+        if merged_content == existing_content:
+            return "unchanged", existing_content
+        return "merge", merged_content
+
+    def mergeContent(self, existing_config:dict, config_content:dict) -> dict:
+        """Merges a generated config into one read from an existing file. Child classes can replace this to remove
+        what is no longer generated first
+
+        Args:
+            existing_config (dict): The config read from the existing file
+            config_content (dict): The generated config
+
+        Returns:
+            dict: The merged config
+        """
+        return clausewitz.merge(existing_config, config_content)
+
+    def dumpConfig(self, group_key:str) -> str:
+        """Writes a single stored config to its file in Stellaris PDX clausewitz format. Files that already hold the same
+        content are left untouched, so their modification time only changes when their content does
+
+        Args:
+            group_key (str): The key of the config in the config_store
+
+        Returns:
+            str: What happened to the file, one of "written", "merged", "unchanged" or "skipped"
+        """
+        logging.debug(f"Creating config for '{group_key}'")
+        config_filename = self.config_store[group_key]['filename']
+        config_filepath = self.config_root_path / config_filename
+
+        with self.metrics.phase(f"dump_configs:{self.__class__.__name__}"):
+            config_content = self.renderConfig(group_key=group_key)
+            config_state = self.checkConfig(config_filepath=config_filepath, config_content=config_content)
+            merged = config_state == "merge"
+            if merged:
+                config_state, config_content = self.mergeConfig(config_filepath=config_filepath, group_key=group_key)
+                merged = config_state != "conflict"
+            config_digest = hashlib.sha256(config_content).hexdigest()
+
+            match config_state:
+                case "unchanged":
+                    logging.debug(f"'{config_filepath}' is unchanged, skipping")
+                    self.recordConfig(config_filepath=config_filepath, config_digest=config_digest, outcome="unchanged", merged=merged)
+                    return "unchanged"
+                case "conflict":
+                    match self.conflict_resolution_method:
+                        case "stop":
+                            raise errors.FileConflictError(f"File conflict: '{config_filepath}' already exists, stopping execution. Check --help if you'd like files to be overrode")
+                        case "skip":
+                            logging.debug(f"File conflict: '{config_filepath}' already exists, skipping")
+                            self.config_counts["skipped"] += 1
+                            return "skipped"
+
+            if merged:
+                logging.info(f"Merging '{group_key}' config into '{config_filepath}'")
+            else:
+                logging.info(f"Saving '{group_key}' config to '{config_filepath}'")
+            self.output.writeBytes(config_filepath, config_content)
+            self.metrics.recordBytes(bytes_written=len(config_content))
+        self.tree.addFile(config_filepath)
+        outcome = "merged" if merged else "written"
+        self.recordConfig(config_filepath=config_filepath, config_digest=config_digest, outcome=outcome, merged=merged)
+        return outcome
+
+    def recordConfig(self, config_filepath:Path, config_digest:str, outcome:str, merged:bool=False):
+        self.config_counts[outcome] += 1
+        self.file_index.written_files.add(config_filepath)
+        if self.build_manifest is not None:
+            self.build_manifest.recordConfig(config_file=config_filepath, config_digest=config_digest, merged=merged)
+
+    def removeConfig(self, config_filepath:Path) -> bool:
+        """Deletes a config this tool wrote. Configs edited since they were written are kept, and only forgotten
+
+        Args:
+            config_filepath (Path): The config file
+
+        Returns:
+            bool: Whether the file was deleted
+        """
+        if self.build_manifest is not None:
+            tracked_digest = self.build_manifest.configDigest(config_filepath)
+            merged = self.build_manifest.isMergedConfig(config_filepath)
+            self.build_manifest.forgetConfig(config_filepath)
+        else:
+            tracked_digest = None
+            merged = False
+        if merged:
+            logging.warning(f"'{config_filepath}' is no longer generated, but holds content merged from an existing file, so it is kept")
+            return False
+        try:
+            existing_content = self.output.readBytes(config_filepath)
+        except OSError:
+            self.tree.removeFile(config_filepath)
+            return False
+
+        if config_filepath not in self.file_index.written_files and hashlib.sha256(existing_content).hexdigest() != tracked_digest:
+            logging.warning(f"'{config_filepath}' is no longer generated, but was edited since it was written, so it is kept")
+            return False
+
+        self.output.remove(config_filepath)
+        self.tree.removeFile(config_filepath)
+        self.file_index.written_files.discard(config_filepath)
+        self.config_counts["removed"] += 1
+        logging.info(f"Removed '{config_filepath}' as it is no longer generated")
+        return True
+
+    def staleConfigs(self) -> list[Path]:
+        """Lists the configs an earlier run wrote to this class's config folder that are no longer in the config_store
+
+        Returns:
+            list[Path]: The stale config files
+        """
+        if self.build_manifest is None:
+            return []
+        current_files = {self.config_root_path / entry['filename'] for entry in self.config_store.values()}
+        return [
+            config_filepath
+            for config_filepath in self.build_manifest.trackedConfigs(config_folder=self.config_root_path)
+            if config_filepath not in current_files
+        ]
+
+    def removeStaleConfigs(self):
+        """Deletes the configs an earlier run wrote to this class's config folder that are no longer in the config_store
+        """
+        for config_filepath in self.staleConfigs():
+            self.removeConfig(config_filepath=config_filepath)
+
+    def reportConfigCounts(self):
+        outcomes = ["written", "unchanged", "removed"]
+        if self.config_counts["skipped"]:
+            outcomes.insert(2, "skipped")
+        if self.config_counts["merged"]:
+            outcomes.insert(1, "merged")
+        counts = ", ".join(f"{self.config_counts[outcome]} {outcome}" for outcome in outcomes)
+        logging.info(f"{self.__class__.__name__} configs: {counts}")
 
     def generateConfigs(self):
         """Should be replaced by child class inheriting this parent class. This function will typically generate the configs as dicts and store them in the config_store dict
         """
         logging.error(f"{self.__class__} does not contain a proper generateConfigs() function")
 
+    def generateGroups(self):
+        """Stores configs in the config_store, yielding the key of each one as soon as it is stored. Child classes with
+        many configs can replace this to build one config at a time, so they never all need to be in memory
+
+        Yields:
+            str: The key of each config in the config_store
+        """
+        self.generateConfigs()
+        yield from list(self.config_store)
+
+    def releaseConfig(self, group_key:str):
+        """Frees the content of a config that has been written. Its filename is kept, so the config_store still lists
+        every config generated
+
+        Args:
+            group_key (str): The key of the config in the config_store
+        """
+        self.config_store[group_key]['content'] = None
+
+    def writeGroups(self, group_keys):
+        """Writes each config as soon as it is generated and then frees it, so memory use is bounded by the largest
+        config rather than the number of configs. Then removes the configs an earlier run wrote that are no longer generated
+
+        Args:
+            group_keys (Iterator[str]): Yields the key of each config once it is in the config_store, such as generateGroups()
+        """
+        while True:
+            with self.metrics.phase(f"generate_configs:{self.__class__.__name__}"):
+                group_key = next(group_keys, None)
+            if group_key is None:
+                break
+            self.dumpConfig(group_key=group_key)
+            self.releaseConfig(group_key=group_key)
+        self.removeStaleConfigs()
+        self.reportConfigCounts()
+
+    def planGroups(self, group_keys) -> list[dict]:
+        """Works out what writeGroups would do to each config file, without writing or removing anything
+
+        Args:
+            group_keys (Iterator[str]): Yields the key of each config once it is in the config_store, such as generateGroups()
+
+        Returns:
+            list[dict]: The file and action of each config, where the action is "write", "merge", "unchanged", "conflict"
+                or "remove". Conflicts are left to the caller, as they depend on the conflict resolution method
+        """
+        config_plan = []
+        for group_key in group_keys:
+            config_filepath = self.config_root_path / self.config_store[group_key]['filename']
+            config_content = self.renderContent(config_content=self.config_store[group_key]['content'])
+            if self.rendered_configs is not None:
+                self.rendered_configs.add(config_filepath, config_content)
+            config_state = self.checkConfig(config_filepath=config_filepath, config_content=config_content)
+            if config_state == "merge":
+                config_state, _ = self.mergeConfig(config_filepath=config_filepath, group_key=group_key)
+            config_plan.append({
+                "file": config_filepath,
+                "action": "write" if config_state in ["new", "update"] else config_state
+            })
+            self.releaseConfig(group_key=group_key)
+        for config_filepath in self.staleConfigs():
+            config_plan.append({"file": config_filepath, "action": "remove"})
+        return config_plan
+
     def generate(self):
         """Basic function to run the generation and config dump in a single call
         """
-        self.generateConfigs()
-        self.dumpConfigs()
+        self.writeGroups(self.generateGroups())
 
 class Portraits(Configs):
     def setup(self):
         self.image_root_path = self.source_path / Path("gfx/models/portraits")
         self.config_root_path = self.source_path / Path("gfx/portraits/portraits")
-        self.quoted_value_keys = [
+        self.quoted_value_keys = {
             "texturefile"
-        ]
+        }
+        self.portrait_files = {
+            # Example
+            # portrait_group_name: {
+            #     image_ref: {'texturefile': "gfx/models/portraits/tau/tau_pop_00.dds"}
+            # }
+        }
+
+    def addPortrait(self, file:Path) -> str:
+        """Adds a single DDS file to its portrait group
+
+        Args:
+            file (Path): The DDS file under the image root
+
+        Returns:
+            str: The portrait group the file was added to
+        """
+        image_relative_path = file.relative_to(self.source_path)
+        portrait_group_name = self.createGroupKey(file=file)
+        variant_prefix = self.createVariantPrefix(file=file)
+
+        if variant_prefix != "":
+            image_ref = "_".join([variant_prefix, file.stem])
+        else:
+            image_ref = file.stem
+
+        try:
+            self.portrait_files[portrait_group_name]
+        except:
+            self.portrait_files[portrait_group_name] = {}
+
+        self.portrait_files[portrait_group_name][image_ref] = {
+            "texturefile": str(image_relative_path)
+        }
+        return portrait_group_name
+
+    def buildGroup(self, portrait_group_name:str):
+        """Creates the config for a portrait group from the files added to it, and stores it in the config_store
+
+        Args:
+            portrait_group_name (str): The portrait group to build
+        """
+        portrait_refs = list(self.portrait_files[portrait_group_name].keys())
+        portraits = templates.Portraits(
+            portrait_group_name = portrait_group_name,
+            portrait_refs = portrait_refs,
+            portrait_files = self.portrait_files[portrait_group_name]
+        )
+
+        config_filename = f"{portrait_group_name}.txt"
+        self.config_store[portrait_group_name] = {
+            'filename': config_filename, 
+            'content': portraits.config
+        }
+
+    def listGroupDirectories(self) -> list[Path]:
+        """Lists every folder holding DDS files, from the index rather than the disk
+
+        Returns:
+            list[Path]: Every group folder, in folder order
+        """
+        group_directories = []
+        for relative_dir, _, filenames in self.tree.walk(self.image_root_path):
+            if any(filename.endswith(".dds") for filename in filenames):
+                group_directories.append(self.tree.root / relative_dir)
+        return group_directories
+
+    def listGroups(self) -> list[str]:
+        """Lists the portrait group of every folder holding DDS files, from the index rather than the disk
+
+        Returns:
+            list[str]: Every portrait group, in folder order
+        """
+        return [self.createDirectoryGroupKey(directory=directory) for directory in self.listGroupDirectories()]
+
+    def checkGroupKeys(self, directories):
+        """Checks that no two group folders share a group key, such as "orks/bigga" and "orks_bigga". The key names the
+        group's config file, so one folder's portraits would replace the other's
+
+        Args:
+            directories (Iterable[Path]): The group folders under the image root
+
+        Raises:
+            errors.PortraitGroupError: When two folders share a group key
+        """
+        group_directories = {}
+        for directory in sorted(directories):
+            group_key = self.createDirectoryGroupKey(directory=directory)
+            other_directory = group_directories.setdefault(group_key, directory)
+            if other_directory != directory:
+                raise errors.PortraitGroupError(
+                    f"'{other_directory.relative_to(self.image_root_path)}' and '{directory.relative_to(self.image_root_path)}' "
+                    f"would both write the portrait group '{group_key}', rename one of the folders"
+                )
+
+    def removeGroup(self, directory:Path):
+        """Deletes the config of a group folder that no longer holds any DDS files, if this tool wrote it
+
+        Args:
+            directory (Path): The group folder under the image root
+        """
+        config_filepath = self.config_root_path / f"{self.createDirectoryGroupKey(directory=directory)}.txt"
+        if config_filepath in self.file_index.written_files or (self.build_manifest is not None and self.build_manifest.configDigest(config_filepath) is not None):
+            self.removeConfig(config_filepath=config_filepath)
+
+    def releaseConfig(self, group_key:str):
+        super().releaseConfig(group_key=group_key)
+        self.portrait_files.pop(group_key, None)
+
+    def mergeContent(self, existing_config:dict, config_content:dict) -> dict:
+        """Merges a generated portrait group into an existing file. Refs to DDS files in the group's folder that are no
+        longer generated are removed first, while refs to textures anywhere else are kept
+
+        Args:
+            existing_config (dict): The config read from the existing file
+            config_content (dict): The generated config
+
+        Returns:
+            dict: The merged config
+        """
+        generated_files = {Path(portrait["texturefile"]) for portrait in config_content["portraits"].values()}
+        group_folders = {texturefile.parent for texturefile in generated_files}
+        existing_portraits = existing_config.get("portraits")
+        if isinstance(existing_portraits, dict):
+            stale_refs = set()
+            for image_ref, portrait in list(existing_portraits.items()):
+                texturefile = portrait.get("texturefile") if isinstance(portrait, dict) else None
+                if isinstance(texturefile, str) and Path(texturefile) not in generated_files and Path(texturefile).parent in group_folders:
+                    stale_refs.add(image_ref)
+                    del existing_portraits[image_ref]
+            if stale_refs:
+                logging.debug(f"Removing refs to DDS files that no longer exist: {', '.join(sorted(stale_refs))}")
+                self.removeRefs(existing_config.get("portrait_groups"), stale_refs=stale_refs, config_content=config_content)
+        return clausewitz.merge(existing_config, config_content)
+
+    def removeRefs(self, value, stale_refs:set, config_content:dict):
+        """Removes refs from every list in a block, and points any default at a removed ref to the generated default
+
+        Args:
+            value: The block, or any value inside it
+            stale_refs (set): The refs to remove
+            config_content (dict): The generated config, holding the generated defaults
+        """
+        if isinstance(value, list):
+            value[:] = [item for item in value if not (isinstance(item, str) and item in stale_refs)]
+            for item in value:
+                self.removeRefs(item, stale_refs=stale_refs, config_content=config_content)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if key == "default" and isinstance(item, str) and item in stale_refs:
+                    value[key] = next(iter(config_content["portrait_groups"].values()))["default"]
+                else:
+                    self.removeRefs(item, stale_refs=stale_refs, config_content=config_content)
+
+    def generateGroups(self, files=None):
+        """Builds one portrait group at a time. Every portrait group is a single folder, so each group is complete, and
+        yielded, as soon as the files move on to the next folder
+
+        Args:
+            files (Iterable[Path], optional): The DDS files, grouped by folder as index.TreeIndex.files lists them. Files
+                outside the image root are ignored. Defaults to None, which uses the DDS files in the output folder
+
+        Raises:
+            errors.PortraitGroupError: When two folders share a group key, before any group is yielded
+
+        Yields:
+            str: The name of each portrait group, once it is in the config_store
+        """
+        if files is None:
+            self.checkGroupKeys(directories=self.listGroupDirectories())
+            files = self.tree.files(self.image_root_path, suffix=".dds")
+        else:
+            files = list(files)
+            self.checkGroupKeys(directories={file.parent for file in files if self.image_root_path in file.parents})
+        current_group_name = None
+        for file in files:
+            if self.image_root_path not in file.parents:
+                continue
+            portrait_group_name = self.addPortrait(file=file)
+            if portrait_group_name != current_group_name:
+                if current_group_name is not None:
+                    self.buildGroup(portrait_group_name=current_group_name)
+                    yield current_group_name
+                current_group_name = portrait_group_name
+        if current_group_name is not None:
+            self.buildGroup(portrait_group_name=current_group_name)
+            yield current_group_name
 
     def generateConfigs(self):
         """Generates the Configs which are stored under each group_key in the config_store of this class
         """
+        for _ in self.generateGroups():
+            pass
 
-        portrait_files = {}
+class PortraitPipeline:
+    def __init__(self, portraits:Portraits, directories:set=None):
+        """Writes each portrait group's config as soon as every queued conversion for that group has finished, instead
+        of waiting for the whole conversion stage and scanning the output folder afterwards
 
-        for file in self.image_root_path.rglob("*.dds"):
-            image_relative_path = file.relative_to(self.source_path)
-            portrait_group_name = self.createGroupKey(file=file)
-            variant_prefix = self.createVariantPrefix(file=file)
+        Args:
+            portraits (Portraits): The Portraits configs to build groups with
+            directories (set, optional): Only write the groups in these folders, leaving the rest as they are. Defaults
+                to None, which writes every group
+        """
+        self.portraits = portraits
+        self.tree = portraits.tree
+        self.directories = directories
+        self.pending = {
+            # Example
+            # Path("output/gfx/models/portraits/tau"): 2
+        }
+        self.written = {
+            # Example
+            # Path("output/gfx/models/portraits/tau"): "example_tau"
+        }
+        self.planned = False
 
-            if variant_prefix != "":
-                image_ref = "_".join([variant_prefix, file.stem])
-            else:
-                image_ref = file.stem
-            
-            try:
-                portrait_files[portrait_group_name]
-            except:
-                portrait_files[portrait_group_name] = {}
-
-            portrait_files[portrait_group_name][image_ref] = {
-                "texturefile": str(image_relative_path)
-            }
-        
-        for portrait_group_name in portrait_files.keys():
-            portrait_refs = list(portrait_files[portrait_group_name].keys())
-            portraits = templates.Portraits(
-                portrait_group_name = portrait_group_name,
-                portrait_refs = portrait_refs,
-                portrait_files = portrait_files[portrait_group_name]
-            )
-
-            config_filename = f"{portrait_group_name}.txt"
-            self.config_store[portrait_group_name] = {
-                'filename': config_filename, 
-                'content': portraits.config
-            }
+    def isPortraitDirectory(self, directory:Path) -> bool:
+        if self.directories is not None and directory not in self.directories:
+            return False
+        return directory == self.portraits.image_root_path or self.portraits.image_root_path in directory.parents
+
+    def groupDirectories(self):
+        """Yields every group folder this pipeline writes, in folder order
+
+        Yields:
+            Path: Each group folder
+        """
+        for relative_dir, _, _ in self.tree.walk(self.portraits.image_root_path):
+            directory = self.tree.root / relative_dir
+            if self.directories is None or directory in self.directories:
+                yield directory
+
+    def expect(self, new_file:Path):
+        """Registers a queued conversion, so its group waits for it
+
+        Args:
+            new_file (Path): The DDS file the conversion will create
+        """
+        directory = new_file.parent
+        if self.isPortraitDirectory(directory):
+            self.pending[directory] = self.pending.get(directory, 0) + 1
+
+    def checkGroupKeys(self):
+        """Checks the group keys of every folder, converted or queued, so a collision stops the run before any image is
+        converted or any group is written. Call it once every conversion is expected
+
+        Raises:
+            errors.PortraitGroupError: When two folders share a group key
+        """
+        self.portraits.checkGroupKeys(directories=set(self.portraits.listGroupDirectories()) | set(self.pending))
+
+    def plan(self):
+        """Marks every conversion as queued, and writes the groups that have nothing left to convert
+        """
+        self.planned = True
+        for directory in self.groupDirectories():
+            if self.pending.get(directory, 0) == 0:
+                self.writeGroup(directory=directory)
+
+    def finish(self, new_file:Path):
+        """Registers a finished conversion, successful or not, and writes its group if it was the last one
+
+        Args:
+            new_file (Path): The DDS file the conversion created
+        """
+        directory = new_file.parent
+        if directory not in self.pending:
+            return
+        self.pending[directory] -= 1
+        if self.planned and self.pending[directory] == 0:
+            self.writeGroup(directory=directory)
+
+    def writeGroup(self, directory:Path):
+        """Builds and writes the config for the DDS files directly inside a folder
+
+        Args:
+            directory (Path): The group folder under the image root
+        """
+        if directory in self.written:
+            return
+        portrait_group_name = None
+        for file in self.tree.listFiles(directory, suffix=".dds"):
+            portrait_group_name = self.portraits.addPortrait(file=file)
+        if portrait_group_name is None:
+            return
+        self.portraits.buildGroup(portrait_group_name=portrait_group_name)
+        self.portraits.dumpConfig(group_key=portrait_group_name)
+        self.portraits.releaseConfig(group_key=portrait_group_name)
+        self.written[directory] = portrait_group_name
+
+    def close(self) -> list[str]:
+        """Writes any group still waiting, such as ones left behind by failed conversions. When every group is written,
+        the configs of groups that no longer exist are removed
+
+        Returns:
+            list[str]: Every portrait group written, in folder order
+        """
+        self.planned = True
+        portrait_groups = []
+        for directory in self.groupDirectories():
+            self.writeGroup(directory=directory)
+            if directory in self.written:
+                portrait_groups.append(self.written[directory])
+        if self.directories is None:
+            self.portraits.removeStaleConfigs()
+            self.portraits.reportConfigCounts()
+        return portrait_groups
 
 class PortraitSets(Configs):
     def setup(self):
@@ -335,11 +825,14 @@ class PortraitSets(Configs):
         portrait_set_name = self.createPortraitSetName()
         species_class_name = self.createSpeciesClassName()
 
-        portrait_configs = []
-
-        for file in self.config_portraits_path.rglob("*.txt"):
-            config_ref = file.stem
-            portrait_configs.append(config_ref)
+        # Groups built earlier in the run are used directly, instead of reading back the files Portraits just wrote
+        if self.portrait_groups is not None:
+            portrait_configs = list(self.portrait_groups)
+        else:
+            portrait_configs = []
+            for file in self.tree.files(self.config_portraits_path, suffix=".txt"):
+                config_ref = file.stem
+                portrait_configs.append(config_ref)
         
         portrait_sets = templates.PortraitSets(
             portrait_set_name=portrait_set_name,
@@ -376,9 +869,9 @@ class SpeciesClass(Configs):
 class SpeciesNames(Configs):
     def setup(self):
         self.config_root_path = self.source_path / Path("common/species_names")
-        self.quoted_value_keys = [
+        self.quoted_value_keys = {
             "name_list"
-        ]
+        }
 
     def generateConfigs(self):
         species_class_name = self.createSpeciesClassName()
@@ -415,4 +908,7 @@ class PortraitCategories(Configs):
         self.config_store[portrait_category_name] = {
             'filename': config_filename, 
             'content': portrait_categorys.config
-        }
\ No newline at end of file
+        }
+
+# The configs built from the list of portrait groups, in the order they are generated
+SHARED_CONFIGS = [PortraitSets, SpeciesClass, SpeciesNames, PortraitCategories]
@@ -0,0 +1,217 @@
+import struct
+
+import numpy as np
+
+# https://learn.microsoft.com/en-us/windows/win32/direct3ddds/dds-header
+
+DDS_MAGIC = b"DDS "
+DDS_HEADER_SIZE = 124
+DDS_PIXELFORMAT_SIZE = 32
+
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_LINEARSIZE = 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_TEXTURE = 0x1000
+
+BLOCK_BYTES = {
+    b"DXT1": 8,
+    b"DXT5": 16
+}
+
+FOUR_CC = {
+    "dxt1": b"DXT1",
+    "dxt5": b"DXT5"
+}
+
+DXT1_BLOCK = np.dtype([
+    ("color_0", "<u2"),
+    ("color_1", "<u2"),
+    ("color_indices", "<u4")
+])
+
+DXT5_BLOCK = np.dtype([
+    ("alpha_0", "u1"),
+    ("alpha_1", "u1"),
+    ("alpha_indices", "u1", 6),
+    ("color_0", "<u2"),
+    ("color_1", "<u2"),
+    ("color_indices", "<u4")
+])
+
+def createHeader(width:int, height:int, four_cc:bytes=b"DXT5") -> bytes:
+    """Creates the magic number and header for a single surface, block compressed DDS file without mipmaps
+
+    Args:
+        width (int): The image width in pixels
+        height (int): The image height in pixels
+        four_cc (bytes, optional): The compression format. Defaults to b"DXT5"
+
+    Returns:
+        bytes: The 128 bytes that precede the compressed blocks
+    """
+    linear_size = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * BLOCK_BYTES[four_cc]
+    return struct.pack(
+        "<4s7I44x2I4s5I5I",
+        DDS_MAGIC,
+        DDS_HEADER_SIZE,
+        DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE,
+        height,
+        width,
+        linear_size,
+        0, # Depth
+        0, # Mipmap count
+        DDS_PIXELFORMAT_SIZE,
+        DDPF_FOURCC,
+        four_cc,
+        0, 0, 0, 0, 0, # RGB bit count and channel masks, unused for FourCC formats
+        DDSCAPS_TEXTURE,
+        0, 0, 0, 0 # Caps 2-4 and reserved
+    )
+
+def splitBlocks(pixels:np.ndarray) -> np.ndarray:
+    """Splits an image into 4x4 pixel blocks, repeating the edge pixels when a dimension is not a multiple of 4
+
+    Args:
+        pixels (np.ndarray): RGBA pixels with shape (height, width, 4)
+
+    Returns:
+        np.ndarray: The blocks in row-major order with shape (block_count, 16, 4)
+    """
+    height, width = pixels.shape[:2]
+    padded = np.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+    block_rows = padded.shape[0] // 4
+    block_columns = padded.shape[1] // 4
+    blocks = padded.reshape(block_rows, 4, block_columns, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(-1, 16, 4)
+
+def packRgb565(colors:np.ndarray) -> np.ndarray:
+    colors = colors.astype(np.uint16)
+    return (colors[..., 0] >> 3) << 11 | (colors[..., 1] >> 2) << 5 | colors[..., 2] >> 3
+
+def unpackRgb565(packed:np.ndarray) -> np.ndarray:
+    red = (packed >> 11) & 0x1F
+    green = (packed >> 5) & 0x3F
+    blue = packed & 0x1F
+    return np.stack([
+        (red << 3) | (red >> 2),
+        (green << 2) | (green >> 4),
+        (blue << 3) | (blue >> 2)
+    ], axis=-1).astype(np.int32)
+
+def encodeColorBlocks(colors:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Encodes the colour half of every block at once. Endpoints are the extreme pixels along each block's principal axis
+
+    Args:
+        colors (np.ndarray): RGB pixels with shape (block_count, 16, 3)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The two RGB565 endpoints and the packed 2 bit indices of each block
+    """
+    colors = colors.astype(np.float32)
+    centered = colors - colors.mean(axis=1, keepdims=True)
+    covariance = np.einsum("nki,nkj->nij", centered, centered)
+
+    axis = colors.max(axis=1) - colors.min(axis=1)
+    for _ in range(4):
+        axis = np.einsum("nij,nj->ni", covariance, axis)
+        axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-6)
+
+    projection = np.einsum("nki,ni->nk", centered, axis)
+    block_index = np.arange(len(colors))
+    endpoint_0 = packRgb565(np.rint(colors[block_index, projection.argmax(axis=1)]).astype(np.uint8))
+    endpoint_1 = packRgb565(np.rint(colors[block_index, projection.argmin(axis=1)]).astype(np.uint8))
+
+    # color_0 > color_1 selects the 4 colour mode, which has no transparent black entry
+    swap = endpoint_0 < endpoint_1
+    endpoint_0, endpoint_1 = np.where(swap, endpoint_1, endpoint_0), np.where(swap, endpoint_0, endpoint_1)
+
+    color_0 = unpackRgb565(endpoint_0)
+    color_1 = unpackRgb565(endpoint_1)
+    palette = np.stack([
+        color_0,
+        color_1,
+        (2 * color_0 + color_1) // 3,
+        (color_0 + 2 * color_1) // 3
+    ], axis=1)
+    distances = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=3)
+    indices = distances.argmin(axis=2).astype(np.uint32)
+    indices[endpoint_0 == endpoint_1] = 0
+
+    packed_indices = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+    return endpoint_0, endpoint_1, packed_indices
+
+def encodeAlphaBlocks(alphas:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Encodes the alpha half of every block at once, using the block's minimum and maximum as endpoints
+
+    Args:
+        alphas (np.ndarray): Alpha values with shape (block_count, 16)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The two alpha endpoints and the 6 bytes of packed 3 bit indices of each block
+    """
+    alphas = alphas.astype(np.int32)
+    alpha_0 = alphas.max(axis=1)
+    alpha_1 = alphas.min(axis=1)
+
+    # alpha_0 > alpha_1 selects the 8 value mode: both endpoints followed by 6 evenly spaced values
+    weights = np.arange(1, 7)
+    palette = np.concatenate([
+        alpha_0[:, None],
+        alpha_1[:, None],
+        ((7 - weights) * alpha_0[:, None] + weights * alpha_1[:, None] + 3) // 7
+    ], axis=1)
+    distances = np.abs(alphas[:, :, None] - palette[:, None, :])
+    indices = distances.argmin(axis=2).astype(np.uint64)
+    indices[alpha_0 == alpha_1] = 0
+
+    packed = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    packed_bytes = packed.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    return alpha_0.astype(np.uint8), alpha_1.astype(np.uint8), packed_bytes
+
+def encodeDxt1(pixels:np.ndarray) -> bytes:
+    """Compresses opaque RGB pixels to DXT1 (BC1) blocks, which are half the size of DXT5 blocks. Alpha is ignored, so
+    only use this for fully opaque images
+
+    Args:
+        pixels (np.ndarray): RGBA pixels with shape (height, width, 4)
+
+    Returns:
+        bytes: The compressed blocks in row-major order
+    """
+    blocks = splitBlocks(pixels)
+    compressed = np.empty(len(blocks), dtype=DXT1_BLOCK)
+    compressed["color_0"], compressed["color_1"], compressed["color_indices"] = encodeColorBlocks(blocks[..., :3])
+    return compressed.tobytes()
+
+def encodeDxt5(pixels:np.ndarray) -> bytes:
+    """Compresses RGBA pixels to DXT5 (BC3) blocks
+
+    Args:
+        pixels (np.ndarray): RGBA pixels with shape (height, width, 4)
+
+    Returns:
+        bytes: The compressed blocks in row-major order
+    """
+    blocks = splitBlocks(pixels)
+    compressed = np.empty(len(blocks), dtype=DXT5_BLOCK)
+    compressed["alpha_0"], compressed["alpha_1"], compressed["alpha_indices"] = encodeAlphaBlocks(blocks[..., 3])
+    compressed["color_0"], compressed["color_1"], compressed["color_indices"] = encodeColorBlocks(blocks[..., :3])
+    return compressed.tobytes()
+
+def writeDds(new_file, pixels:np.ndarray, compression:str="dxt5"):
+    """Writes RGBA pixels to a block compressed DDS file
+
+    Args:
+        new_file (Path): The path to the new DDS file
+        pixels (np.ndarray): RGBA pixels with shape (height, width, 4)
+        compression (str, optional): "dxt1" or "dxt5". Defaults to "dxt5"
+    """
+    height, width = pixels.shape[:2]
+    four_cc = FOUR_CC[compression]
+    compressed = encodeDxt1(pixels) if four_cc == b"DXT1" else encodeDxt5(pixels)
+    with open(new_file, "wb") as dds_file:
+        dds_file.write(createHeader(width=width, height=height, four_cc=four_cc))
+        dds_file.write(compressed)
@@ -0,0 +1,444 @@
+import abc
+import logging
+import subprocess
+import importlib.util
+import json
+import os
+import shutil
+import signal
+from pathlib import Path
+
+from . import prescan, resize
+
+COMPRESSIONS = ["auto", "dxt1", "dxt5"]
+
+def runCommand(command:list, timeout:float=None) -> subprocess.CompletedProcess:
+    """Runs a command in its own process group, so a command that runs past the timeout is killed along with every
+    process it started
+
+    Args:
+        command (list): The command and its arguments
+        timeout (float, optional): The seconds to wait before killing the command. Defaults to None, which waits forever
+
+    Raises:
+        subprocess.TimeoutExpired: When the command runs past the timeout
+        subprocess.CalledProcessError: When the command exits with an error
+
+    Returns:
+        subprocess.CompletedProcess: The finished command and its output
+    """
+    process = subprocess.Popen(command, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            process.kill()
+        stdout, stderr = process.communicate()
+        raise subprocess.TimeoutExpired(command, timeout, output=stdout, stderr=stderr)
+    result = subprocess.CompletedProcess(command, process.returncode, stdout=stdout, stderr=stderr)
+    result.check_returncode()
+    return result
+
+class ProbeCache:
+    def __init__(self, cache_file:Path=None):
+        """Stores encoder probe results on disk, so repeated runs don't need to launch the encoder to check it
+
+        Args:
+            cache_file (Path, optional): The cache file. Defaults to encoder-probe.json in $SPT_CACHE_DIR, $XDG_CACHE_HOME/spt or ~/.cache/spt
+        """
+        if cache_file is None:
+            cache_folder = os.environ.get("SPT_CACHE_DIR")
+            if not cache_folder:
+                cache_folder = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "spt"
+            cache_file = Path(cache_folder) / "encoder-probe.json"
+        self.cache_file = Path(cache_file)
+
+    def load(self) -> dict:
+        try:
+            with open(self.cache_file, "r") as open_file:
+                return json.load(open_file)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key:str) -> dict:
+        """Returns the stored capabilities for a probe key
+
+        Args:
+            key (str): Identifies the probed binary, including its path and modification time
+
+        Returns:
+            dict: The stored capabilities, or None when the binary was never probed or has changed
+        """
+        return self.load().get(key)
+
+    def set(self, key:str, capabilities:dict):
+        """Stores the capabilities for a probe key. Failing to write the cache is not an error
+
+        Args:
+            key (str): Identifies the probed binary, including its path and modification time
+            capabilities (dict): The probed capabilities
+        """
+        cache = self.load()
+        cache[key] = capabilities
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+            with open(temp_file, "w") as open_file:
+                json.dump(cache, open_file, indent=1)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            logging.debug(f"Unable to write the encoder probe cache '{self.cache_file}': {e}")
+
+class Encoder(abc.ABC):
+    name = ""
+    supports_batch = False
+    supports_interlaced = True
+    # The memory held for every pixel of the source and of the fitted output while encoding, and the memory an encoder
+    # needs whatever the image size
+    bytes_per_pixel = 16
+    base_memory = 0
+
+    def __init__(self, crop_settings:resize.CropSettings=None, compression:str="dxt5", png_index:prescan.PngIndex=None, timeout:float=None):
+        """
+        Args:
+            crop_settings (resize.CropSettings, optional): Fits every image to the portrait size while encoding. Defaults to
+                None, which keeps the source size
+            compression (str, optional): "dxt1", "dxt5", or "auto" to use DXT1 for fully opaque images and DXT5 for the
+                rest. Defaults to "dxt5"
+            png_index (prescan.PngIndex, optional): Already scanned PNG headers. Images the index knows to be opaque skip
+                the alpha check. Defaults to None
+            timeout (float, optional): The seconds an encoder process may take per image before it is killed. Encoders
+                that run in-process can't be interrupted, so they ignore it. Defaults to None, which waits forever
+
+        Raises:
+            ValueError: When the compression is unknown
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}', choose from {', '.join(COMPRESSIONS)}")
+        self.crop_settings = crop_settings
+        self.compression = compression
+        self.png_index = png_index
+        self.timeout = timeout
+
+    @abc.abstractmethod
+    def checkAvailable(self) -> bool:
+        """Checks whether everything the encoder needs is installed
+
+        Returns:
+            bool: Whether the encoder can be used
+        """
+
+    def checkCompressionAvailable(self) -> bool:
+        """Checks that the alpha channel of sources can be read when the compression is chosen automatically
+
+        Returns:
+            bool: Whether the compression can be used
+        """
+        if self.compression == "auto" and importlib.util.find_spec("numpy") is None:
+            logging.error(f"Missing NumPy dependency, which '--compression auto' requires to check the alpha channel of images")
+            logging.error(f"Please install NumPy: pip install numpy")
+            return False
+        return True
+
+    def chooseCompression(self, image_file:Path) -> str:
+        """Picks the compression for a source image. In "auto" mode, fully opaque images use DXT1, which is half the size of DXT5
+
+        Args:
+            image_file (Path): The source image
+
+        Returns:
+            str: "dxt1" or "dxt5"
+        """
+        if self.compression != "auto":
+            return self.compression
+        # Padding and letterboxing add transparent pixels that aren't in the source
+        if self.crop_settings is not None and self.crop_settings.addsTransparency():
+            return "dxt5"
+        png_header = self.png_index.get(image_file) if self.png_index is not None else None
+        if png_header is not None and png_header.valid and not png_header.has_alpha:
+            return "dxt1"
+
+        from . import png
+
+        try:
+            return "dxt1" if png.isOpaque(image_file) else "dxt5"
+        except png.PngError as e:
+            logging.debug(f"Unable to check the alpha channel of '{image_file}', using DXT5: {e}")
+            return "dxt5"
+
+    def checkHeader(self, png_header:prescan.PngHeader) -> str:
+        """Checks from its PNG header whether an image can be converted, before any conversion starts
+
+        Args:
+            png_header (prescan.PngHeader): The image's header
+
+        Returns:
+            str: Why the image can't be converted, or None if it can
+        """
+        if not png_header.valid:
+            return png_header.error
+        if png_header.interlaced and not self.supports_interlaced:
+            return f"Interlaced PNG files are not supported by the '{self.name}' encoder"
+        return None
+
+    def settings(self) -> dict:
+        """The settings that affect the converted output, used to detect when outputs need rebuilding
+
+        Returns:
+            dict: The encoder settings
+        """
+        settings = {
+            "encoder": self.name,
+            "format": "dds",
+            "compression": self.compression
+        }
+        if self.crop_settings is not None:
+            settings["crop"] = self.crop_settings.asDict()
+        return settings
+
+    def cropArguments(self) -> list[str]:
+        return self.crop_settings.magickArguments() if self.crop_settings is not None else []
+
+    def estimateMemory(self, png_header:prescan.PngHeader) -> int:
+        """Estimates the memory encoding an image takes from the dimensions in its PNG header
+
+        Args:
+            png_header (prescan.PngHeader): The image's header, or None if it hasn't been scanned
+
+        Returns:
+            int: The estimated memory in bytes
+        """
+        pixel_count = png_header.pixel_count if png_header is not None else 0
+        if self.crop_settings is not None:
+            pixel_count += self.crop_settings.width * self.crop_settings.height
+        return self.base_memory + pixel_count * self.bytes_per_pixel
+
+    @abc.abstractmethod
+    def encode(self, image_file:Path, new_file:Path, memory_limit:int=None) -> str:
+        """Converts a single image to DDS, raising on failure
+
+        Args:
+            image_file (Path): The source image
+            new_file (Path): The path to the new DDS file
+            memory_limit (int, optional): The memory in bytes the encoder should stay within, where it can. Defaults to None
+
+        Returns:
+            str: The compression used
+        """
+
+    def encodeBatch(self, image_files:list[Path], output_folder:Path, memory_limit:int=None) -> dict:
+        """Converts many images to DDS files named after their source in the output folder
+
+        Args:
+            image_files (list[Path]): The source images
+            output_folder (Path): The folder to write every DDS file to
+            memory_limit (int, optional): The memory in bytes the encoder should stay within, where it can. Defaults to None
+
+        Returns:
+            dict: The compression used for each source image
+        """
+        return {
+            image_file: self.encode(image_file=image_file, new_file=output_folder / f"{image_file.stem}.dds", memory_limit=memory_limit)
+            for image_file in image_files
+        }
+
+class MagickEncoder(Encoder):
+    name = "magick"
+    supports_batch = True
+    # Q16 HDRI builds, the default, hold four 32 bit float channels per pixel
+    bytes_per_pixel = 16
+    base_memory = 32 * 1024 ** 2
+
+    def checkAvailable(self) -> bool:
+        """Checks that ImageMagick is installed. The result is cached against the binary's path, size and modification
+        time, so magick is only launched again after it is moved, upgraded or replaced
+
+        Returns:
+            bool: Whether ImageMagick can be used
+        """
+        binary = shutil.which("magick")
+        if binary is None:
+            logging.error(f"Missing ImageMagick dependency: 'magick' was not found on the path")
+            logging.error(f"Please install ImageMagick to your system path: https://imagemagick.org/")
+            return False
+
+        try:
+            binary_stat = os.stat(binary)
+            probe_key = f"{self.name}:{binary}:{binary_stat.st_size}:{binary_stat.st_mtime_ns}"
+        except OSError:
+            probe_key = None
+
+        probe_cache = ProbeCache()
+        if probe_key is not None:
+            capabilities = probe_cache.get(probe_key)
+            if capabilities is not None:
+                logging.debug(f"Using cached ImageMagick probe: {capabilities}")
+                return True
+
+        try:
+            command = [binary, "--version"]
+            result = subprocess.run(command, check=True, text=True, capture_output=True)
+            logging.debug(result)
+        except Exception as e:
+            logging.error(f"Missing ImageMagick dependency: {e}")
+            logging.error(f"Please install ImageMagick to your system path: https://imagemagick.org/")
+            return False
+
+        if probe_key is not None:
+            version = result.stdout.splitlines()[0] if result.stdout else ""
+            probe_cache.set(probe_key, {"version": version})
+        return True
+
+    @staticmethod
+    def limitArguments(memory_limit:int=None) -> list[str]:
+        """ImageMagick's resource limits, so an image larger than its limit is cached on disk instead of in memory
+
+        Args:
+            memory_limit (int, optional): The memory in bytes. Defaults to None, which keeps ImageMagick's own limits
+
+        Returns:
+            list[str]: Arguments to place before the first input file
+        """
+        if memory_limit is None:
+            return []
+        return ["-limit", "memory", str(memory_limit), "-limit", "map", str(memory_limit)]
+
+    def encode(self, image_file:Path, new_file:Path, memory_limit:int=None) -> str:
+        """Converts a single image to DDS with its own ImageMagick process
+
+        Args:
+            image_file (Path): The source image
+            new_file (Path): The path to the new DDS file
+            memory_limit (int, optional): Passed to ImageMagick as its memory and map limits. Defaults to None
+
+        Raises:
+            subprocess.CalledProcessError: When ImageMagick fails to convert the image
+            subprocess.TimeoutExpired: When ImageMagick takes longer than self.timeout
+
+        Returns:
+            str: The compression used
+        """
+        compression = self.chooseCompression(image_file)
+        command = [
+            "magick",
+            *self.limitArguments(memory_limit),
+            "-format",
+            "dds",
+            "-define",
+            f"dds:compression={compression}",
+            image_file,
+            *self.cropArguments(),
+            new_file
+        ]
+        result = runCommand(command, timeout=self.timeout)
+        logging.debug(result)
+        return compression
+
+    def encodeBatch(self, image_files:list[Path], output_folder:Path, memory_limit:int=None) -> dict:
+        """Converts many images to DDS with a single ImageMagick process per compression. Each DDS keeps the name of its
+        source image
+
+        Args:
+            image_files (list[Path]): The images to convert
+            output_folder (Path): The folder to write every DDS file to
+            memory_limit (int, optional): Passed to ImageMagick as its memory and map limits. Defaults to None
+
+        Raises:
+            subprocess.CalledProcessError: When ImageMagick fails to convert any of the images
+            subprocess.TimeoutExpired: When a process takes longer than self.timeout for each of its images
+
+        Returns:
+            dict: The compression used for each source image
+        """
+        compressions = {image_file: self.chooseCompression(image_file) for image_file in image_files}
+        for compression in sorted(set(compressions.values())):
+            compression_files = [image_file for image_file, image_compression in compressions.items() if image_compression == compression]
+            command = [
+                "magick",
+                "mogrify",
+                *self.limitArguments(memory_limit),
+                "-path",
+                output_folder,
+                "-format",
+                "dds",
+                "-define",
+                f"dds:compression={compression}",
+                *self.cropArguments(),
+                *compression_files
+            ]
+            timeout = self.timeout * len(compression_files) if self.timeout is not None else None
+            result = runCommand(command, timeout=timeout)
+            logging.debug(result)
+        return compressions
+
+class NumpyEncoder(Encoder):
+    name = "numpy"
+    # png.decodePng only reads non-interlaced images
+    supports_interlaced = False
+
+    def checkAvailable(self) -> bool:
+        if importlib.util.find_spec("numpy") is None:
+            logging.error(f"Missing NumPy dependency, which the '{self.name}' encoder requires")
+            logging.error(f"Please install NumPy: pip install numpy")
+            return False
+        return True
+
+    def encode(self, image_file:Path, new_file:Path, memory_limit:int=None) -> str:
+        """Decodes a PNG, fits it to the portrait size when cropping is enabled and writes it as a DDS file without
+        leaving the Python process. The source is only decoded once
+
+        Args:
+            image_file (Path): The source PNG
+            new_file (Path): The path to the new DDS file
+            memory_limit (int, optional): Ignored, as memory can't be limited within the process. Defaults to None
+
+        Raises:
+            png.PngError: When the source is not a valid PNG
+
+        Returns:
+            str: The compression used
+        """
+        # Only imported here, so NumPy is not required when ImageMagick is used
+        from . import png, dds
+
+        pixels = png.decodePng(image_file)
+        if self.crop_settings is not None:
+            pixels = resize.fitPixels(pixels=pixels, crop_settings=self.crop_settings)
+        compression = self.compression
+        if compression == "auto":
+            # The fitted pixels are checked, so transparent padding is accounted for
+            compression = "dxt1" if pixels[..., 3].min() == 255 else "dxt5"
+        dds.writeDds(new_file=new_file, pixels=pixels, compression=compression)
+        return compression
+
+ENCODERS = {
+    MagickEncoder.name: MagickEncoder,
+    NumpyEncoder.name: NumpyEncoder
+}
+
+def getEncoder(name:str="magick", crop_settings:resize.CropSettings=None, compression:str="dxt5", png_index:prescan.PngIndex=None, timeout:float=None) -> Encoder:
+    """Creates the encoder registered under the provided name
+
+    Args:
+        name (str, optional): The encoder name. Defaults to "magick"
+        crop_settings (resize.CropSettings, optional): Fits every image to the portrait size while encoding. Defaults to None
+        compression (str, optional): "dxt1", "dxt5" or "auto". Defaults to "dxt5"
+        png_index (prescan.PngIndex, optional): Already scanned PNG headers. Defaults to None
+        timeout (float, optional): The seconds an encoder process may take per image. Defaults to None
+
+    Raises:
+        ValueError: When no encoder is registered under the name, or the compression is unknown
+
+    Returns:
+        Encoder: The encoder
+    """
+    try:
+        encoder_class = ENCODERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown encoder '{name}', choose from {', '.join(ENCODERS)}")
+    return encoder_class(crop_settings=crop_settings, compression=compression, png_index=png_index, timeout=timeout)
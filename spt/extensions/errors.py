@@ -0,0 +1,28 @@
+class SptError(Exception):
+    """Raised when a run can't continue. The command line logs the message and exits, while embedding code can catch it
+    and carry on
+    """
+
+class PathError(SptError):
+    """The source folder is missing, or the output can't be written to
+    """
+
+class DependencyError(SptError):
+    """The encoder, or something it needs, isn't installed
+    """
+
+class FileConflictError(SptError):
+    """An output file already exists and --file-conflict is "stop"
+    """
+
+class ShardError(SptError):
+    """The shard manifests can't be merged
+    """
+
+class ConversionError(SptError):
+    """Some images failed to convert, even after retrying
+    """
+
+class PortraitGroupError(SptError):
+    """Two portrait folders would write the same portrait group
+    """
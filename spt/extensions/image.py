@@ -1,31 +1,211 @@
 import logging
+import os
+import shutil
 import subprocess
+import time
 from pathlib import Path
 
+from . import encoders, resize
+
 class Image:
-    def __init__(self, image_file):
+    def __init__(self, image_file, encoder:encoders.Encoder=None):
         self.image_file = Path(image_file)
+        self.encoder = encoder or encoders.MagickEncoder()
+
+    def crop(self, crop_settings:resize.CropSettings=None):
+        """Fits the image to the portrait size, resizing and then cropping or padding it. Needs NumPy
+
+        Args:
+            crop_settings (resize.CropSettings, optional): How to fit the image. Defaults to the encoder's crop settings
+
+        Raises:
+            ValueError: When there are no crop settings
 
-    def crop(self):
-        pass
-    
-    def formatToDds(self, new_file:Path):
+        Returns:
+            np.ndarray: The fitted RGBA pixels with shape (height, width, 4)
+        """
+        from . import png
+
+        crop_settings = crop_settings or self.encoder.crop_settings
+        if crop_settings is None:
+            raise ValueError(f"No portrait size to crop '{self.image_file}' to")
+        return resize.fitPixels(pixels=png.decodePng(self.image_file), crop_settings=crop_settings)
+
+    def formatToDds(self, new_file:Path, memory_limit:int=None) -> str:
         """Formats the image file stored in the class to the DDS format required by Stellaris
 
         Args:
             new_file (Path): The path to the new filename/location for the DDS file
+            memory_limit (int, optional): The memory in bytes the encoder should stay within. Defaults to None
+
+        Raises:
+            Exception: Whatever the encoder raises when it fails to convert the image
+
+        Returns:
+            str: The compression used
+        """
+        return self.encoder.encode(image_file=self.image_file, new_file=new_file, memory_limit=memory_limit)
+
+    @staticmethod
+    def formatBatchToDds(image_files:list[Path], output_folder:Path, encoder:encoders.Encoder=None, memory_limit:int=None) -> dict:
+        """Formats many image files to DDS in one go where the encoder supports it. Each DDS keeps the name of its source image
+
+        Args:
+            image_files (list[Path]): The images to convert
+            output_folder (Path): The folder to write every DDS file to
+            encoder (encoders.Encoder, optional): The encoder to use. Defaults to ImageMagick
+            memory_limit (int, optional): The memory in bytes the encoder should stay within. Defaults to None
+
+        Raises:
+            Exception: Whatever the encoder raises when it fails to convert any of the images
+
+        Returns:
+            dict: The compression used for each image
+        """
+        encoder = encoder or encoders.MagickEncoder()
+        return encoder.encodeBatch(image_files=image_files, output_folder=output_folder, memory_limit=memory_limit)
+
+class ConversionResult:
+    def __init__(self, image_file:Path, new_file:Path):
+        """Holds the outcome of converting a single image, so results from worker threads can be reported in order
+
+        Args:
+            image_file (Path): The source image
+            new_file (Path): The DDS file the image was converted to
         """
-        command = [
-            "magick",
-            "-format",
-            "dds",
-            "-define",
-            "dds:compression=dxt5",
-            self.image_file,
-            new_file
-        ]
+        self.image_file = image_file
+        self.new_file = new_file
+        # Where the encoder wrote the output, which is a staging file when the output is an archive
+        self.staged_file = new_file
+        self.source_digest = None
+        self.compression = None
+        self.error = None
+        self.seconds = 0.0
+        self.attempts = 0
+        self.timed_out = False
+        # Set when the output was copied from an identical source instead of being encoded
+        self.duplicate_of = None
+        self.seconds_saved = 0.0
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+def convertImage(image_file:Path, new_file:Path, encoder:encoders.Encoder=None, retries:int=0, retry_delay:float=0.5, memory_limit:int=None) -> ConversionResult:
+    """Converts a single image to DDS, capturing any error instead of raising it. Failures are retried with a delay that
+    doubles each time, except timeouts, as an image that timed out will most likely time out again. Safe to run inside a
+    worker thread
+
+    Args:
+        image_file (Path): The source image
+        new_file (Path): The path to the new DDS file
+        encoder (encoders.Encoder, optional): The encoder to use. Defaults to ImageMagick
+        retries (int, optional): How many more times to try a failed conversion. Defaults to 0
+        retry_delay (float, optional): The seconds to wait before the first retry. Defaults to 0.5
+        memory_limit (int, optional): The memory in bytes the encoder should stay within. Defaults to None
+
+    Returns:
+        ConversionResult: The outcome of the conversion
+    """
+    conversion_result = ConversionResult(image_file=image_file, new_file=new_file)
+    start = time.perf_counter()
+    while True:
+        conversion_result.attempts += 1
+        conversion_result.error = None
         try:
-            result = subprocess.run(command, check=True, text=True, capture_output=True)
-            logging.debug(result)
+            # Always writing a new file keeps hardlinked duplicates of the old output unchanged
+            new_file.unlink(missing_ok=True)
+            conversion_result.compression = Image(image_file=image_file, encoder=encoder).formatToDds(new_file=new_file, memory_limit=memory_limit)
+        except subprocess.TimeoutExpired as e:
+            conversion_result.error = f"Timed out after {e.timeout:g}s"
+            conversion_result.timed_out = True
+        except subprocess.CalledProcessError as e:
+            conversion_result.error = f"{e} {e.stderr.strip()}".strip()
         except Exception as e:
-            logging.error(f"Unable to convert to 'dds': {e}")
\ No newline at end of file
+            conversion_result.error = str(e)
+
+        if conversion_result.success or conversion_result.timed_out or conversion_result.attempts > retries:
+            break
+        delay = retry_delay * 2 ** (conversion_result.attempts - 1)
+        logging.warning(f"Converting '{image_file}' failed, retrying in {delay:g}s: {conversion_result.error}")
+        time.sleep(delay)
+    conversion_result.seconds = time.perf_counter() - start
+    return conversion_result
+
+def convertImageBatch(image_files:list[Path], new_files:list[Path], encoder:encoders.Encoder=None, retries:int=0, retry_delay:float=0.5, memory_limit:int=None) -> list[ConversionResult]:
+    """Converts images that share an output folder with one ImageMagick process. Any image without an output afterwards,
+    including every image of a batch that timed out, is retried on its own, so a single bad file only costs its own
+    conversion. Safe to run inside a worker thread
+
+    Args:
+        image_files (list[Path]): The source images
+        new_files (list[Path]): The paths to the new DDS files, all in the same folder and named after their source
+        encoder (encoders.Encoder, optional): The encoder to use. Defaults to ImageMagick
+        retries (int, optional): How many more times to try an image that fails on its own. Defaults to 0
+        retry_delay (float, optional): The seconds to wait before the first retry. Defaults to 0.5
+        memory_limit (int, optional): The memory in bytes the encoder should stay within. Defaults to None
+
+    Returns:
+        list[ConversionResult]: The outcome of each conversion, in the order provided
+    """
+    # Existing outputs are removed first, so a missing file afterwards always means that conversion failed
+    for new_file in new_files:
+        new_file.unlink(missing_ok=True)
+
+    compressions = {}
+    start = time.perf_counter()
+    try:
+        compressions = Image.formatBatchToDds(image_files=image_files, output_folder=new_files[0].parent, encoder=encoder, memory_limit=memory_limit)
+    except Exception as e:
+        logging.debug(f"Batch conversion of {len(image_files)} images failed, retrying failed images individually: {e}")
+    # The batch cost is shared evenly, as a single process converted every image
+    seconds_per_image = (time.perf_counter() - start) / len(image_files)
+
+    conversion_results = []
+    for image_file, new_file in zip(image_files, new_files):
+        if new_file.is_file():
+            conversion_result = ConversionResult(image_file=image_file, new_file=new_file)
+            conversion_result.seconds = seconds_per_image
+            conversion_result.attempts = 1
+            conversion_result.compression = compressions.get(image_file)
+            conversion_results.append(conversion_result)
+        else:
+            conversion_results.append(convertImage(image_file=image_file, new_file=new_file, encoder=encoder, retries=retries, retry_delay=retry_delay, memory_limit=memory_limit))
+    return conversion_results
+
+def copyConversion(conversion_result:ConversionResult, image_file:Path, new_file:Path, link:bool=True) -> ConversionResult:
+    """Creates the output of a source that is identical to an already converted source, without encoding it again.
+    Safe to run inside a worker thread
+
+    Args:
+        conversion_result (ConversionResult): The conversion of the identical source
+        image_file (Path): The duplicate source image
+        new_file (Path): The path to the duplicate's DDS file
+        link (bool, optional): Hardlink the output instead of copying it, falling back to a copy when linking fails. Defaults to True
+
+    Returns:
+        ConversionResult: The outcome of the copy
+    """
+    duplicate_result = ConversionResult(image_file=image_file, new_file=new_file)
+    duplicate_result.duplicate_of = conversion_result.image_file
+    duplicate_result.source_digest = conversion_result.source_digest
+    duplicate_result.compression = conversion_result.compression
+    if not conversion_result.success:
+        duplicate_result.error = conversion_result.error
+        return duplicate_result
+
+    start = time.perf_counter()
+    try:
+        new_file.unlink(missing_ok=True)
+        if link:
+            try:
+                os.link(conversion_result.staged_file, new_file)
+            except OSError:
+                shutil.copyfile(conversion_result.staged_file, new_file)
+        else:
+            shutil.copyfile(conversion_result.staged_file, new_file)
+    except OSError as e:
+        duplicate_result.error = str(e)
+    duplicate_result.seconds = time.perf_counter() - start
+    duplicate_result.seconds_saved = max(0.0, conversion_result.seconds - duplicate_result.seconds)
+    return duplicate_result
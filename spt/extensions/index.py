@@ -0,0 +1,225 @@
+import logging
+import os
+from pathlib import Path
+
+class TreeIndex:
+    def __init__(self, root, stat_files:bool=False):
+        """An in-memory listing of every folder and file under a root folder, built with a single os.scandir walk
+
+        Args:
+            root (Path): The folder to index
+            stat_files (bool, optional): Whether to store the stat of every file during the walk. Defaults to False
+        """
+        self.root = Path(root)
+        self.stat_files = stat_files
+        self.scanned = False
+        self.directories = {
+            # Example
+            # "gfx/models/portraits": {
+            #     'directories': {"orks", "tau"},
+            #     'files': {"readme.txt": os.stat_result}
+            # }
+        }
+
+    def scan(self):
+        """Walks the root folder once and stores every folder and file. Later lookups are served from memory
+        """
+        self.directories = {}
+        self.scanned = True
+        if not self.root.is_dir():
+            return
+
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            directory = {'directories': set(), 'files': {}}
+            self.directories[relative_dir] = directory
+            try:
+                with os.scandir(self.root / relative_dir) as entries:
+                    for entry in entries:
+                        relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                        if entry.is_dir():
+                            directory['directories'].add(entry.name)
+                            pending.append(relative_path)
+                        elif entry.is_file():
+                            directory['files'][entry.name] = entry.stat() if self.stat_files else None
+            except OSError as e:
+                logging.warning(f"Unable to list '{self.root / relative_dir}': {e}")
+        logging.debug(f"Indexed {len(self.directories)} folders under '{self.root}'")
+
+    def ensureScanned(self):
+        if not self.scanned:
+            self.scan()
+
+    def relative(self, path) -> str:
+        """Converts a path to the key used by the index
+
+        Args:
+            path (Path | str): A path under the root, or already relative to it
+
+        Returns:
+            str: The path relative to the root, with / separators
+        """
+        path = Path(path)
+        if path.is_absolute() or path.parts[:len(self.root.parts)] == self.root.parts:
+            path = path.relative_to(self.root)
+        relative_path = path.as_posix()
+        return "" if relative_path == "." else relative_path
+
+    def walk(self, relative_dir:str=""):
+        """Walks the indexed folders top-down in sorted order
+
+        Args:
+            relative_dir (str, optional): The folder to start from, relative to the root. Defaults to the root
+
+        Yields:
+            tuple[str, list[str], list[str]]: The folder relative to the root, its sorted subfolder names and its sorted file names
+        """
+        self.ensureScanned()
+        pending = [self.relative(relative_dir)]
+        while pending:
+            current_dir = pending.pop()
+            directory = self.directories.get(current_dir)
+            if directory is None:
+                continue
+            subdirectories = sorted(directory['directories'])
+            yield current_dir, subdirectories, sorted(directory['files'])
+            pending.extend(
+                f"{current_dir}/{name}" if current_dir else name
+                for name in reversed(subdirectories)
+            )
+
+    def files(self, relative_dir:str="", suffix:str=None):
+        """Yields every file under a folder, replacing Path.rglob
+
+        Args:
+            relative_dir (str, optional): The folder to search, relative to the root. Defaults to the root
+            suffix (str, optional): Only yield files with this suffix, such as ".dds". Defaults to None
+
+        Yields:
+            Path: Each matching file, under the root
+        """
+        for current_dir, _, filenames in self.walk(relative_dir):
+            directory_path = self.root / current_dir
+            for filename in filenames:
+                if suffix is None or filename.endswith(suffix):
+                    yield directory_path / filename
+
+    def listFiles(self, relative_dir:str="", suffix:str=None):
+        """Yields the files directly inside a folder, replacing Path.glob
+
+        Args:
+            relative_dir (str, optional): The folder to list, relative to the root. Defaults to the root
+            suffix (str, optional): Only yield files with this suffix, such as ".dds". Defaults to None
+
+        Yields:
+            Path: Each matching file, under the root
+        """
+        self.ensureScanned()
+        current_dir = self.relative(relative_dir)
+        directory = self.directories.get(current_dir)
+        if directory is None:
+            return
+        directory_path = self.root / current_dir
+        for filename in sorted(directory['files']):
+            if suffix is None or filename.endswith(suffix):
+                yield directory_path / filename
+
+    def isFile(self, path) -> bool:
+        """Check whether a file exists, without touching the filesystem
+
+        Args:
+            path (Path | str): The file to check
+
+        Returns:
+            bool: Whether the file is in the index
+        """
+        self.ensureScanned()
+        relative_dir, _, filename = self.relative(path).rpartition("/")
+        directory = self.directories.get(relative_dir)
+        return directory is not None and filename in directory['files']
+
+    def stat(self, path) -> os.stat_result:
+        """Returns the stat of an indexed file, reading it from disk when it was not stored during the walk
+
+        Args:
+            path (Path | str): The file to stat
+
+        Returns:
+            os.stat_result: The stat of the file
+        """
+        self.ensureScanned()
+        relative_dir, _, filename = self.relative(path).rpartition("/")
+        file_stat = self.directories.get(relative_dir, {'files': {}})['files'].get(filename)
+        if file_stat is None:
+            file_stat = (self.root / relative_dir / filename).stat()
+        return file_stat
+
+    def addFile(self, path):
+        """Records a file written after the index was built
+
+        Args:
+            path (Path | str): The new file
+        """
+        self.ensureScanned()
+        parts = self.relative(path).split("/")
+        current_dir = ""
+        for name in parts[:-1]:
+            self.directories.setdefault(current_dir, {'directories': set(), 'files': {}})['directories'].add(name)
+            current_dir = f"{current_dir}/{name}" if current_dir else name
+        self.directories.setdefault(current_dir, {'directories': set(), 'files': {}})['files'][parts[-1]] = None
+
+    def removeFile(self, path):
+        """Forgets a file deleted after the index was built
+
+        Args:
+            path (Path | str): The deleted file
+        """
+        self.ensureScanned()
+        relative_dir, _, filename = self.relative(path).rpartition("/")
+        directory = self.directories.get(relative_dir)
+        if directory is not None:
+            directory['files'].pop(filename, None)
+
+class FileIndex:
+    def __init__(self):
+        """Shares one TreeIndex per folder, plus per-folder caches, between every stage of a run
+        """
+        self.trees = {}
+        self.directory_cache = {
+            # Example
+            # ("group_key", "gfx/models/portraits", "example", Path("gfx/models/portraits/orks")): "example_orks"
+        }
+        # Files this process wrote, which later stages may replace without treating them as conflicts
+        self.written_files = set()
+
+    def tree(self, root, stat_files:bool=False) -> TreeIndex:
+        """Returns the index for a folder, creating it the first time it is requested
+
+        Args:
+            root (Path): The folder to index
+            stat_files (bool, optional): Whether to store the stat of every file. Defaults to False
+
+        Returns:
+            TreeIndex: The index for the folder
+        """
+        key = Path(root).resolve()
+        if key not in self.trees:
+            self.trees[key] = TreeIndex(root=root, stat_files=stat_files)
+        return self.trees[key]
+
+    def cached(self, key:tuple, factory):
+        """Returns a cached per-folder value, calculating it with factory the first time
+
+        Args:
+            key (tuple): The cache key, including the folder the value belongs to
+            factory (Callable): Calculates the value when it is not cached
+
+        Returns:
+            The cached value
+        """
+        try:
+            return self.directory_cache[key]
+        except KeyError:
+            value = self.directory_cache[key] = factory()
+            return value
@@ -0,0 +1,226 @@
+import logging
+import hashlib
+import json
+import os
+from pathlib import Path
+
+class Manifest:
+    filename = ".spt-manifest.json"
+    version = 1
+
+    def __init__(self, output_folder, persist:bool=True):
+        """Tracks which source files produced which outputs, so unchanged sources are not converted again
+
+        Args:
+            output_folder (Path): The output folder the manifest is stored in
+            persist (bool, optional): Whether the manifest is read from and saved to the output folder. Defaults to True.
+                Archives are always built from scratch, so their manifest only lasts for the run
+        """
+        self.output_folder = Path(output_folder)
+        self.persist = persist
+        self.manifest_path = self.output_folder / self.filename
+        self.images = {
+            # Example
+            # "gfx/models/portraits/tau/tau_pop_00.png": {
+            #     'size': 1234,
+            #     'mtime_ns': 1700000000000000000,
+            #     'sha256': "...",
+            #     'output': "gfx/models/portraits/tau/tau_pop_00.dds",
+            #     'settings': {}
+            # }
+        }
+        self.configs = {
+            # Example
+            # "gfx/portraits/portraits/example_tau.txt": {
+            #     'sha256': "..."
+            # }
+        }
+        self.load()
+
+    def load(self):
+        """Loads the manifest from the output folder, starting empty if it is missing or unreadable
+        """
+        if not self.persist or not self.manifest_path.is_file():
+            return
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                data = json.load(manifest_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unable to read manifest '{self.manifest_path}', all files will be rebuilt: {e}")
+            return
+        if data.get("version") != self.version:
+            logging.info(f"Manifest '{self.manifest_path}' is from a different version, all files will be rebuilt")
+            return
+        self.images = data.get("images", {})
+        self.configs = data.get("configs", {})
+
+    def save(self):
+        """Writes the manifest to the output folder, replacing the previous one atomically
+        """
+        if not self.persist:
+            return
+        data = {
+            "version": self.version,
+            "images": dict(sorted(self.images.items())),
+            "configs": dict(sorted(self.configs.items()))
+        }
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_name(f"{self.filename}.tmp")
+        with open(temp_path, "w") as manifest_file:
+            json.dump(data, manifest_file, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+    @staticmethod
+    def hashFile(file:Path) -> str:
+        """Hashes the content of the provided file
+
+        Args:
+            file (Path): The file to hash
+
+        Returns:
+            str: The sha256 hex digest of the file
+        """
+        digest = hashlib.sha256()
+        with open(file, "rb") as open_file:
+            for chunk in iter(lambda: open_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def checkImage(self, relative_source:str, source_file:Path, source_stat:os.stat_result, output_exists:bool, settings:dict) -> tuple[bool, str]:
+        """Check whether the output recorded for a source is still up to date
+
+        The content hash is only calculated when the size or mtime no longer match the manifest
+
+        Args:
+            relative_source (str): The source path relative to the source folder, used as the manifest key
+            source_file (Path): The source file
+            source_stat (os.stat_result): The current stat of the source file
+            output_exists (bool): Whether the expected output file exists
+            settings (dict): The encoder settings the output would be built with
+
+        Returns:
+            tuple[bool, str]: Whether the output is up to date, and the source hash if one was calculated
+        """
+        entry = self.images.get(relative_source)
+        if entry is None or entry.get("settings") != settings or not output_exists:
+            return False, None
+
+        if entry["size"] == source_stat.st_size and entry["mtime_ns"] == source_stat.st_mtime_ns:
+            return True, entry["sha256"]
+
+        source_digest = self.hashFile(source_file)
+        if source_digest != entry["sha256"]:
+            return False, source_digest
+
+        # Touched but not edited, remember the new stat so the hash is skipped next time
+        entry["size"] = source_stat.st_size
+        entry["mtime_ns"] = source_stat.st_mtime_ns
+        return True, source_digest
+
+    def isTracked(self, relative_source:str) -> bool:
+        """Check whether the output for a source was created by a previous run
+
+        Args:
+            relative_source (str): The source path relative to the source folder
+
+        Returns:
+            bool: Whether the source has a manifest entry
+        """
+        return relative_source in self.images
+
+    def recordImage(self, relative_source:str, source_stat:os.stat_result, new_file:Path, source_digest:str, settings:dict):
+        """Record a successfully converted source
+
+        Args:
+            relative_source (str): The source path relative to the source folder
+            source_stat (os.stat_result): The stat of the source when it was queued for conversion
+            new_file (Path): The converted output file
+            source_digest (str): The sha256 hex digest of the source when it was converted
+            settings (dict): The encoder settings used for the conversion
+        """
+        self.images[relative_source] = {
+            "size": source_stat.st_size,
+            "mtime_ns": source_stat.st_mtime_ns,
+            "sha256": source_digest,
+            "output": new_file.relative_to(self.output_folder).as_posix(),
+            "settings": settings
+        }
+
+    def forgetImage(self, relative_source:str):
+        """Remove a source from the manifest, so it is rebuilt next run
+
+        Args:
+            relative_source (str): The source path relative to the source folder
+        """
+        self.images.pop(relative_source, None)
+
+    def removeImages(self, relative_sources:set) -> list[Path]:
+        """Delete the outputs of tracked sources that were deleted
+
+        Args:
+            relative_sources (set): The relative paths of the deleted sources. Untracked sources are ignored
+
+        Returns:
+            list[Path]: The output files that were removed
+        """
+        removed_files = []
+        for relative_source in sorted(relative_sources & set(self.images)):
+            entry = self.images.pop(relative_source)
+            output_file = self.output_folder / entry["output"]
+            if output_file.is_file():
+                output_file.unlink()
+                removed_files.append(output_file)
+        return removed_files
+
+    def relativeOutput(self, output_file:Path) -> str:
+        return Path(output_file).relative_to(self.output_folder).as_posix()
+
+    def configDigest(self, config_file:Path) -> str:
+        """Returns the digest a config file had when this tool last wrote it
+
+        Args:
+            config_file (Path): The config file, under the output folder
+
+        Returns:
+            str: The sha256 hex digest, or None if the file isn't tracked
+        """
+        entry = self.configs.get(self.relativeOutput(config_file))
+        return None if entry is None else entry["sha256"]
+
+    def recordConfig(self, config_file:Path, config_digest:str, merged:bool=False):
+        """Record a config file written, or confirmed unchanged, by this tool
+
+        Args:
+            config_file (Path): The config file, under the output folder
+            config_digest (str): The sha256 hex digest of its content
+            merged (bool, optional): Whether the config was merged into an existing file. Defaults to False
+        """
+        entry = {
+            "sha256": config_digest
+        }
+        if merged:
+            entry["merged"] = True
+        self.configs[self.relativeOutput(config_file)] = entry
+
+    def isMergedConfig(self, config_file:Path) -> bool:
+        entry = self.configs.get(self.relativeOutput(config_file))
+        return entry is not None and entry.get("merged", False)
+
+    def forgetConfig(self, config_file:Path):
+        self.configs.pop(self.relativeOutput(config_file), None)
+
+    def trackedConfigs(self, config_folder:Path) -> list[Path]:
+        """Lists the tracked config files directly inside a folder
+
+        Args:
+            config_folder (Path): The config folder, under the output folder
+
+        Returns:
+            list[Path]: The tracked config files, in sorted order
+        """
+        relative_folder = self.relativeOutput(config_folder)
+        return [
+            self.output_folder / relative_config
+            for relative_config in sorted(self.configs)
+            if relative_config.rpartition("/")[0] == relative_folder
+        ]
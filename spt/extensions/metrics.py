@@ -0,0 +1,161 @@
+import contextlib
+import json
+import math
+import threading
+import time
+from pathlib import Path
+
+class Metrics:
+    enabled = True
+
+    def __init__(self, slowest_count:int=10):
+        """Collects per-phase timings, per-file conversion latency and bytes read/written during a run
+
+        Args:
+            slowest_count (int, optional): The number of slowest files to include in the report. Defaults to 10
+        """
+        self.slowest_count = slowest_count
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases = {
+            # Example
+            # "convert_images": {'seconds': 12.5, 'count': 1}
+        }
+        self.file_latencies = [
+            # Example
+            # (0.25, "gfx/models/portraits/tau/tau_pop_00.png", False)
+        ]
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    @contextlib.contextmanager
+    def phase(self, name:str):
+        """Times the wrapped block and adds it to the named phase
+
+        Args:
+            name (str): The phase to add the time to
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addPhase(name=name, seconds=time.perf_counter() - start)
+
+    def addPhase(self, name:str, seconds:float, count:int=1):
+        with self.lock:
+            phase = self.phases.setdefault(name, {'seconds': 0.0, 'count': 0})
+            phase['seconds'] += seconds
+            phase['count'] += count
+
+    def recordFile(self, file, seconds:float, failed:bool=False, bytes_read:int=0, bytes_written:int=0):
+        """Records the conversion of a single file
+
+        Args:
+            file (Path): The converted file
+            seconds (float): How long the conversion took
+            failed (bool, optional): Whether the conversion failed. Defaults to False
+            bytes_read (int, optional): The size of the source file. Defaults to 0
+            bytes_written (int, optional): The size of the output file. Defaults to 0
+        """
+        with self.lock:
+            self.file_latencies.append((seconds, str(file), failed))
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+
+    def recordBytes(self, bytes_read:int=0, bytes_written:int=0):
+        with self.lock:
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+
+    @staticmethod
+    def percentile(sorted_values:list, percent:float) -> float:
+        """Nearest-rank percentile of an already sorted list
+
+        Args:
+            sorted_values (list): The values, sorted ascending
+            percent (float): The percentile, between 0 and 100
+
+        Returns:
+            float: The value at the percentile, or 0 for an empty list
+        """
+        if not sorted_values:
+            return 0.0
+        rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+        return sorted_values[rank - 1]
+
+    def report(self) -> dict:
+        """Builds the machine-readable report
+
+        Returns:
+            dict: The report
+        """
+        with self.lock:
+            latencies = sorted(self.file_latencies, reverse=True)
+            phases = {
+                name: {'seconds': round(phase['seconds'], 6), 'count': phase['count']}
+                for name, phase in self.phases.items()
+            }
+            bytes_read = self.bytes_read
+            bytes_written = self.bytes_written
+
+        seconds = sorted(latency for latency, _, _ in latencies)
+        return {
+            "wall_seconds": round(time.perf_counter() - self.start_time, 6),
+            "phases": phases,
+            "files": {
+                "count": len(latencies),
+                "failed": sum(failed for _, _, failed in latencies),
+                "latency_seconds": {
+                    "mean": round(sum(seconds) / len(seconds), 6) if seconds else 0.0,
+                    "p50": round(self.percentile(seconds, 50), 6),
+                    "p90": round(self.percentile(seconds, 90), 6),
+                    "p99": round(self.percentile(seconds, 99), 6),
+                    "max": round(seconds[-1], 6) if seconds else 0.0
+                },
+                "slowest": [
+                    {"file": file, "seconds": round(latency, 6), "failed": failed}
+                    for latency, file, failed in latencies[:self.slowest_count]
+                ]
+            },
+            "bytes": {
+                "read": bytes_read,
+                "written": bytes_written
+            }
+        }
+
+    def write(self, metrics_file:Path):
+        """Writes the report as JSON
+
+        Args:
+            metrics_file (Path): The file to write the report to
+        """
+        metrics_file = Path(metrics_file)
+        metrics_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(metrics_file, "w") as open_file:
+            json.dump(self.report(), open_file, indent=4)
+
+class NullMetrics(Metrics):
+    enabled = False
+
+    def __init__(self):
+        """Used when metrics are disabled. Every method returns immediately, so instrumented code costs close to nothing
+        """
+        self.null_phase = contextlib.nullcontext()
+
+    def phase(self, name:str):
+        return self.null_phase
+
+    def addPhase(self, name:str, seconds:float, count:int=1):
+        pass
+
+    def recordFile(self, file, seconds:float, failed:bool=False, bytes_read:int=0, bytes_written:int=0):
+        pass
+
+    def recordBytes(self, bytes_read:int=0, bytes_written:int=0):
+        pass
+
+    def report(self) -> dict:
+        return {}
+
+    def write(self, metrics_file:Path):
+        pass
@@ -0,0 +1,235 @@
+import abc
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+
+from . import index
+
+class Output(abc.ABC):
+    def __init__(self, root:Path, file_index:index.FileIndex):
+        """Where converted images and configs end up. Paths passed to an output are always under root, with the same
+        gfx/ and common/ layout whichever output is used
+
+        Args:
+            root (Path): The output folder, or archive
+            file_index (index.FileIndex): The run's index, whose tree for root lists every output file
+        """
+        self.root = Path(root)
+        self.file_index = file_index
+
+    @property
+    def tree(self) -> index.TreeIndex:
+        return self.file_index.tree(self.root)
+
+    def relative(self, file:Path) -> str:
+        return Path(file).relative_to(self.root).as_posix()
+
+    @abc.abstractmethod
+    def stagingPath(self, path:Path) -> Path:
+        """Where encoders should write a file or folder under root, as encoders can only write to the filesystem
+
+        Args:
+            path (Path): The output file or folder
+
+        Returns:
+            Path: The path encoders write to
+        """
+
+    @abc.abstractmethod
+    def commit(self, staged_file:Path, new_file:Path):
+        """Moves a file written by an encoder into the output
+
+        Args:
+            staged_file (Path): The file returned by stagingPath
+            new_file (Path): The output file
+        """
+
+    @abc.abstractmethod
+    def readBytes(self, file:Path) -> bytes:
+        """Reads an output file
+
+        Args:
+            file (Path): The output file
+
+        Returns:
+            bytes: The file content
+        """
+
+    @abc.abstractmethod
+    def writeBytes(self, file:Path, content:bytes):
+        """Writes an output file in one go
+
+        Args:
+            file (Path): The output file
+            content (bytes): The file content
+        """
+
+    @abc.abstractmethod
+    def fileSize(self, file:Path) -> int:
+        """The size of an output file
+
+        Args:
+            file (Path): The output file
+
+        Raises:
+            OSError: When the file doesn't exist
+
+        Returns:
+            int: The size in bytes
+        """
+
+    @abc.abstractmethod
+    def remove(self, file:Path) -> bool:
+        """Deletes an output file
+
+        Args:
+            file (Path): The output file
+
+        Returns:
+            bool: Whether the file existed
+        """
+
+    def close(self, completed:bool=True):
+        """Finishes writing the output
+
+        Args:
+            completed (bool, optional): Whether the run finished. Defaults to True
+        """
+        pass
+
+class DirectoryOutput(Output):
+    """Writes loose files into the output folder. Encoders write straight to their final path
+    """
+    def stagingPath(self, path:Path) -> Path:
+        return path
+
+    def commit(self, staged_file:Path, new_file:Path):
+        pass
+
+    def readBytes(self, file:Path) -> bytes:
+        return Path(file).read_bytes()
+
+    def writeBytes(self, file:Path, content:bytes):
+        """Writes an output file through a temporary file, so readers never see it half written
+        """
+        file = Path(file)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = file.with_name(f"{file.name}.tmp")
+        try:
+            temp_file.write_bytes(content)
+            os.replace(temp_file, file)
+        except OSError:
+            temp_file.unlink(missing_ok=True)
+            raise
+
+    def fileSize(self, file:Path) -> int:
+        return Path(file).stat().st_size
+
+    def remove(self, file:Path) -> bool:
+        file = Path(file)
+        if not file.is_file():
+            return False
+        file.unlink()
+        return True
+
+class ArchiveOutput(Output):
+    def __init__(self, root:Path, file_index:index.FileIndex):
+        """Writes every output file straight into a zip archive at root, instead of loose files that are zipped
+        afterwards. DDS files are stored uncompressed, as DXT data barely shrinks, and configs are deflated
+
+        The archive is built in a temporary file next to root, and only replaces root once the run completes. Archives
+        are always built from scratch, so nothing from an earlier archive is reused
+
+        Args:
+            root (Path): The zip archive to create
+            file_index (index.FileIndex): The run's index, whose tree for root lists every entry written
+        """
+        super().__init__(root=root, file_index=file_index)
+        self.root.parent.mkdir(parents=True, exist_ok=True)
+        self.temp_archive = self.root.with_name(f"{self.root.name}.tmp")
+        self.archive = zipfile.ZipFile(self.temp_archive, "w")
+        # Encoders need a real folder to write to, each file is moved into the archive as soon as it is reported
+        self.staging_folder = Path(tempfile.mkdtemp(prefix="spt-"))
+        self.entries = {
+            # Example
+            # "gfx/models/portraits/tau/tau_pop_00.dds": 262272
+        }
+        self.tree.scanned = True
+
+    def stagingPath(self, path:Path) -> Path:
+        return self.staging_folder / self.relative(path)
+
+    def checkNewEntry(self, arcname:str):
+        if arcname in self.entries:
+            raise FileExistsError(f"'{arcname}' was already written to '{self.root}', archive entries can't be replaced")
+
+    def addEntry(self, new_file:Path, file_size:int):
+        self.entries[self.relative(new_file)] = file_size
+        self.tree.addFile(new_file)
+
+    def commit(self, staged_file:Path, new_file:Path):
+        """Copies a file written by an encoder into the archive uncompressed, then deletes the staged file
+        """
+        arcname = self.relative(new_file)
+        self.checkNewEntry(arcname)
+        self.archive.write(staged_file, arcname=arcname, compress_type=zipfile.ZIP_STORED)
+        self.addEntry(new_file=new_file, file_size=self.archive.getinfo(arcname).file_size)
+        staged_file.unlink()
+
+    def readBytes(self, file:Path) -> bytes:
+        try:
+            return self.archive.read(self.relative(file))
+        except KeyError:
+            raise FileNotFoundError(f"'{file}' is not in the archive")
+
+    def writeBytes(self, file:Path, content:bytes):
+        arcname = self.relative(file)
+        self.checkNewEntry(arcname)
+        self.archive.writestr(arcname, content, compress_type=zipfile.ZIP_DEFLATED)
+        self.addEntry(new_file=file, file_size=len(content))
+
+    def fileSize(self, file:Path) -> int:
+        try:
+            return self.entries[self.relative(file)]
+        except KeyError:
+            raise FileNotFoundError(f"'{file}' is not in the archive")
+
+    def remove(self, file:Path) -> bool:
+        # Nothing is ever removed, as every archive is built from scratch
+        return False
+
+    def close(self, completed:bool=True):
+        """Writes the archive's central directory and moves it into place, or deletes it if the run didn't complete
+
+        Args:
+            completed (bool, optional): Whether the run finished. Defaults to True
+        """
+        if self.archive is None:
+            return
+        self.archive.close()
+        self.archive = None
+        shutil.rmtree(self.staging_folder, ignore_errors=True)
+        if completed:
+            os.replace(self.temp_archive, self.root)
+            logging.info(f"Wrote {len(self.entries)} files to '{self.root}'")
+        else:
+            self.temp_archive.unlink(missing_ok=True)
+            logging.info(f"Discarded the unfinished archive '{self.root}'")
+
+def createOutput(root:Path, file_index:index.FileIndex, archive:bool=False) -> Output:
+    """Creates the output the run writes to
+
+    Args:
+        root (Path): The output folder, or zip archive
+        file_index (index.FileIndex): The run's index
+        archive (bool, optional): Whether to write a zip archive instead of loose files. Defaults to False
+
+    Returns:
+        Output: The output
+    """
+    if archive:
+        return ArchiveOutput(root=root, file_index=file_index)
+    return DirectoryOutput(root=root, file_index=file_index)
@@ -0,0 +1,122 @@
+from pathlib import Path
+
+from . import errors, prescan
+
+class ConversionPlan:
+    def __init__(self, settings:dict):
+        """What converting the images would do, worked out from a single scan of the source and output folders
+
+        Args:
+            settings (dict): The encoder settings the outputs would be built with
+        """
+        self.settings = settings
+        self.source_stats = {
+            # Example
+            # "gfx/models/portraits/tau/tau_pop_00.png": os.stat_result(...)
+        }
+        # (file, new_file, source_digest) for each source to convert, where source_digest may be None if not yet calculated
+        self.queued_images = []
+        # Untracked output files a conversion would replace, whatever the conflict resolution method
+        self.conflicts = []
+        self.up_to_date_count = 0
+        # Tracked sources that no longer exist, whose outputs would be removed
+        self.removed_sources = []
+        self.output_dirs = []
+
+def conflictError(conflicting_files:list[Path]) -> errors.FileConflictError:
+    """Creates the error for a run that would replace files this tool didn't write
+
+    Args:
+        conflicting_files (list[Path]): Every conflicting file, in the order found
+
+    Returns:
+        errors.FileConflictError: The error, naming the first few files
+    """
+    shown_files = ", ".join(f"'{file}'" for file in conflicting_files[:3])
+    if len(conflicting_files) > 3:
+        shown_files += f" and {len(conflicting_files) - 3} more"
+    verb = "exists" if len(conflicting_files) == 1 else "exist"
+    return errors.FileConflictError(f"File conflict: {shown_files} already {verb}, stopping before anything is written. Check --help if you'd like files to be overrode")
+
+class BuildPlan:
+    def __init__(self, source_folder:Path, output_folder:Path, conflict_resolution_method:str, conversion_plan:ConversionPlan=None, png_headers:list[prescan.PngHeader]=None, header_errors:list[str]=None, config_plan:list[dict]=None):
+        """Everything a run would do, without having done any of it
+
+        Args:
+            source_folder (Path): The source folder
+            output_folder (Path): The output folder
+            conflict_resolution_method (str): "replace", "stop" or "skip"
+            conversion_plan (ConversionPlan, optional): The planned conversions. Defaults to None, when images aren't converted
+            png_headers (list[prescan.PngHeader], optional): The header of each queued image, in queue order. Defaults to None
+            header_errors (list[str], optional): Why each queued image can't be converted, or None if it can, in queue
+                order, as returned by encoders.Encoder.checkHeader. Defaults to None, which uses the errors in png_headers
+            config_plan (list[dict], optional): The file and action of each config, as returned by Configs.planGroups.
+                Defaults to None, when configs aren't generated
+        """
+        self.source_folder = source_folder
+        self.output_folder = output_folder
+        self.conflict_resolution_method = conflict_resolution_method
+        self.conversion_plan = conversion_plan
+        self.png_headers = png_headers or []
+        self.header_errors = header_errors or [png_header.error for png_header in self.png_headers]
+        self.config_plan = config_plan or []
+
+    @property
+    def conflicts(self) -> list[Path]:
+        image_conflicts = self.conversion_plan.conflicts if self.conversion_plan is not None else []
+        return image_conflicts + [entry["file"] for entry in self.config_plan if entry["action"] == "conflict"]
+
+    def relativeOutput(self, file:Path) -> str:
+        return Path(file).relative_to(self.output_folder).as_posix()
+
+    def configAction(self, action:str) -> str:
+        if action != "conflict":
+            return action
+        return {"replace": "write", "skip": "skip"}.get(self.conflict_resolution_method, "conflict")
+
+    def report(self) -> dict:
+        """The plan as JSON ready data. Paths are relative to the source or output folder, with / separators
+
+        Returns:
+            dict: The images to convert and remove, the configs to write and remove, every conflict, and the work involved
+        """
+        conversions = []
+        invalid_images = []
+        pixel_count = 0
+        source_bytes = 0
+        if self.conversion_plan is not None:
+            for (file, new_file, _), png_header, header_error in zip(self.conversion_plan.queued_images, self.png_headers, self.header_errors):
+                source = file.relative_to(self.source_folder).as_posix()
+                if header_error is not None:
+                    invalid_images.append({"source": source, "error": header_error})
+                    continue
+                conversions.append({
+                    "source": source,
+                    "output": self.relativeOutput(new_file),
+                    "width": png_header.width,
+                    "height": png_header.height
+                })
+                pixel_count += png_header.pixel_count
+                source_bytes += png_header.size
+
+        config_entries = [
+            {"file": self.relativeOutput(entry["file"]), "action": self.configAction(entry["action"])}
+            for entry in self.config_plan
+        ]
+        return {
+            "conflict_resolution": self.conflict_resolution_method,
+            "conflicts": [self.relativeOutput(file) for file in self.conflicts],
+            "images": {
+                "convert": conversions,
+                "invalid": invalid_images,
+                "up_to_date": self.conversion_plan.up_to_date_count if self.conversion_plan is not None else 0,
+                "remove_outputs_of": list(self.conversion_plan.removed_sources) if self.conversion_plan is not None else []
+            },
+            "configs": config_entries,
+            "work": {
+                "images": len(conversions),
+                "pixels": pixel_count,
+                "source_bytes": source_bytes,
+                "configs_written": sum(1 for entry in config_entries if entry["action"] in ["write", "merge"])
+            }
+        }
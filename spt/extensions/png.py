@@ -0,0 +1,250 @@
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+# https://www.w3.org/TR/png-3/
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+COLOR_TYPE_CHANNELS = {
+    0: 1, # Greyscale
+    2: 3, # Truecolour
+    3: 1, # Indexed-colour
+    4: 2, # Greyscale with alpha
+    6: 4  # Truecolour with alpha
+}
+
+class PngError(ValueError):
+    pass
+
+def readChunks(data:bytes):
+    """Yields every chunk in a PNG file, checking each chunk's CRC
+
+    Args:
+        data (bytes): The full PNG file
+
+    Raises:
+        PngError: When the signature, a chunk length or a CRC is invalid
+
+    Yields:
+        tuple[bytes, bytes]: The chunk type and chunk data
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise PngError("Missing PNG signature")
+
+    position = 8
+    while position + 12 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        chunk_end = position + 8 + length
+        if chunk_end + 4 > len(data):
+            raise PngError(f"Chunk '{chunk_type.decode(errors='replace')}' runs past the end of the file")
+        chunk_data = data[position + 8:chunk_end]
+        (crc,) = struct.unpack(">I", data[chunk_end:chunk_end + 4])
+        if zlib.crc32(chunk_type + chunk_data) != crc:
+            raise PngError(f"Chunk '{chunk_type.decode(errors='replace')}' has an invalid CRC")
+        yield chunk_type, chunk_data
+        if chunk_type == b"IEND":
+            return
+        position = chunk_end + 4
+    raise PngError("Missing IEND chunk")
+
+def unfilterScanlines(raw:bytes, height:int, stride:int, bytes_per_pixel:int) -> np.ndarray:
+    """Reverses the per-scanline PNG filters
+
+    The Sub, Average and Paeth filters depend on the reconstructed byte to the left, and every filter can depend on the
+    scanline above. Both neighbours lie on the previous anti-diagonal of the image, so all bytes on one anti-diagonal are
+    reconstructed together. The image is stored skewed, so that each anti-diagonal is a single column
+
+    Args:
+        raw (bytes): The decompressed image data, a filter type byte followed by each scanline
+        height (int): The number of scanlines
+        stride (int): The number of bytes in each scanline, excluding the filter type byte
+        bytes_per_pixel (int): The filter unit in bytes, at least 1
+
+    Returns:
+        np.ndarray: The reconstructed scanlines with shape (height, stride)
+    """
+    if len(raw) < height * (stride + 1):
+        raise PngError("Image data is shorter than the image dimensions require")
+
+    scanlines = np.frombuffer(raw, dtype=np.uint8, count=height * (stride + 1)).reshape(height, stride + 1)
+    filter_types = scanlines[:, 0]
+    if filter_types.max(initial=0) > 4:
+        raise PngError("Invalid scanline filter type")
+    filtered = scanlines[:, 1:]
+
+    if not filter_types.any():
+        return filtered.copy()
+
+    width = stride // bytes_per_pixel
+    filtered = filtered.reshape(height, width, bytes_per_pixel).astype(np.int16)
+
+    # Pixel (y, x) is stored at skewed[y, x + y]. reconstructed is padded with a zero scanline above and two zero
+    # columns to the left, so the neighbours of the first row and column read as zero as the specification requires
+    rows = np.arange(height)[:, None]
+    columns = np.arange(width)[None, :]
+    skewed = np.zeros((height, width + height - 1, bytes_per_pixel), dtype=np.int16)
+    skewed[rows, columns + rows] = filtered
+    reconstructed = np.zeros((height + 1, width + height + 1, bytes_per_pixel), dtype=np.int16)
+    skewed_types = filter_types.astype(np.int16)[:, None]
+
+    for diagonal in range(width + height - 1):
+        first_row = max(0, diagonal - width + 1)
+        last_row = min(height - 1, diagonal) + 1
+        column = diagonal + 2
+
+        left = reconstructed[first_row + 1:last_row + 1, column - 1]
+        up = reconstructed[first_row:last_row, column - 1]
+        up_left = reconstructed[first_row:last_row, column - 2]
+        row_types = skewed_types[first_row:last_row]
+
+        distance_left = np.abs(up - up_left)
+        distance_up = np.abs(left - up_left)
+        distance_up_left = np.abs(left + up - 2 * up_left)
+        paeth = np.where(
+            (distance_left <= distance_up) & (distance_left <= distance_up_left),
+            left,
+            np.where(distance_up <= distance_up_left, up, up_left)
+        )
+        predictor = np.select(
+            [row_types == 1, row_types == 2, row_types == 3, row_types == 4],
+            [left, up, (left + up) >> 1, paeth],
+            0
+        )
+        reconstructed[first_row + 1:last_row + 1, column] = (skewed[first_row:last_row, diagonal] + predictor) & 0xFF
+
+    unskewed = reconstructed[rows + 1, columns + rows + 2]
+    return unskewed.astype(np.uint8).reshape(height, stride)
+
+def unpackSamples(scanlines:np.ndarray, width:int, channels:int, bit_depth:int) -> np.ndarray:
+    """Splits reconstructed scanlines into samples at their full bit depth
+
+    Args:
+        scanlines (np.ndarray): The reconstructed scanlines with shape (height, stride)
+        width (int): The image width in pixels
+        channels (int): The number of samples per pixel
+        bit_depth (int): The number of bits per sample
+
+    Returns:
+        np.ndarray: The samples with shape (height, width, channels)
+    """
+    height = scanlines.shape[0]
+    if bit_depth == 16:
+        samples = scanlines.view(">u2").astype(np.uint16)
+    elif bit_depth == 8:
+        samples = scanlines
+    else:
+        bits = np.unpackbits(scanlines, axis=1).reshape(height, -1, bit_depth)
+        weights = (1 << np.arange(bit_depth - 1, -1, -1)).astype(np.uint8)
+        samples = (bits * weights).sum(axis=2, dtype=np.uint8)
+    return samples[:, :width * channels].reshape(height, width, channels)
+
+def decodePng(image_file:Path) -> np.ndarray:
+    """Decodes a PNG file to 8 bit RGBA pixels. Every colour type and bit depth is supported, but interlaced images are not
+
+    Args:
+        image_file (Path): The PNG file to decode
+
+    Raises:
+        PngError: When the file is not a valid PNG or uses an unsupported feature
+
+    Returns:
+        np.ndarray: The pixels with shape (height, width, 4)
+    """
+    with open(image_file, "rb") as open_file:
+        data = open_file.read()
+
+    header = None
+    palette = None
+    transparency = None
+    compressed = []
+    for chunk_type, chunk_data in readChunks(data):
+        match chunk_type:
+            case b"IHDR":
+                header = struct.unpack(">IIBBBBB", chunk_data)
+            case b"PLTE":
+                palette = np.frombuffer(chunk_data, dtype=np.uint8).reshape(-1, 3)
+            case b"tRNS":
+                transparency = chunk_data
+            case b"IDAT":
+                compressed.append(chunk_data)
+
+    if header is None:
+        raise PngError("Missing IHDR chunk")
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if color_type not in COLOR_TYPE_CHANNELS or bit_depth not in (1, 2, 4, 8, 16):
+        raise PngError(f"Unsupported colour type {color_type} with bit depth {bit_depth}")
+    if interlace:
+        raise PngError("Interlaced PNG files are not supported")
+    if color_type == 3 and palette is None:
+        raise PngError("Missing PLTE chunk for an indexed-colour image")
+
+    channels = COLOR_TYPE_CHANNELS[color_type]
+    stride = (width * channels * bit_depth + 7) // 8
+    bytes_per_pixel = max(1, channels * bit_depth // 8)
+    try:
+        raw = zlib.decompress(b"".join(compressed))
+    except zlib.error as e:
+        raise PngError(f"Unable to decompress image data: {e}")
+
+    scanlines = unfilterScanlines(raw=raw, height=height, stride=stride, bytes_per_pixel=bytes_per_pixel)
+    samples = unpackSamples(scanlines=scanlines, width=width, channels=channels, bit_depth=bit_depth)
+
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    if color_type == 3:
+        alphas = np.full(256, 255, dtype=np.uint8)
+        if transparency is not None:
+            alphas[:len(transparency)] = np.frombuffer(transparency, dtype=np.uint8)
+        indices = samples[..., 0]
+        full_palette = np.zeros((256, 3), dtype=np.uint8)
+        full_palette[:len(palette)] = palette
+        pixels[..., :3] = full_palette[indices]
+        pixels[..., 3] = alphas[indices]
+        return pixels
+
+    max_value = (1 << bit_depth) - 1
+    scaled = (samples.astype(np.uint32) * 255 + max_value // 2) // max_value
+    color_channels = 1 if color_type in (0, 4) else 3
+    pixels[..., :3] = scaled[..., :color_channels]
+    if color_type in (4, 6):
+        pixels[..., 3] = scaled[..., -1]
+    elif transparency is not None:
+        # tRNS holds one 16 bit value per colour channel that marks fully transparent pixels
+        key = np.frombuffer(transparency[:2 * color_channels], dtype=">u2")
+        pixels[..., 3] = np.where(np.all(samples == key, axis=2), 0, 255)
+    else:
+        pixels[..., 3] = 255
+    return pixels
+
+def isOpaque(image_file:Path) -> bool:
+    """Checks whether every pixel in a PNG file is fully opaque. Images that have neither an alpha channel nor a tRNS
+    chunk are answered from their header, the rest are decoded and their alpha channel checked in one pass
+
+    Args:
+        image_file (Path): The PNG file to check
+
+    Raises:
+        PngError: When the file is not a valid PNG or uses an unsupported feature
+
+    Returns:
+        bool: Whether the image is fully opaque
+    """
+    with open(image_file, "rb") as open_file:
+        data = open_file.read()
+
+    color_type = None
+    has_transparency = False
+    for chunk_type, chunk_data in readChunks(data):
+        if chunk_type == b"IHDR":
+            color_type = chunk_data[9]
+        elif chunk_type == b"tRNS":
+            has_transparency = True
+        elif chunk_type == b"IDAT":
+            # tRNS always comes before the image data
+            break
+
+    if color_type not in (4, 6) and not has_transparency:
+        return True
+    return bool(decodePng(image_file)[..., 3].min() == 255)
@@ -0,0 +1,197 @@
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+# https://www.w3.org/TR/png-3/
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# The smallest possible PNG: signature, IHDR, an empty IDAT and IEND
+MINIMUM_PNG_BYTES = 8 + 25 + 12 + 12
+
+COLOR_TYPE_BIT_DEPTHS = {
+    0: (1, 2, 4, 8, 16), # Greyscale
+    2: (8, 16), # Truecolour
+    3: (1, 2, 4, 8), # Indexed-colour
+    4: (8, 16), # Greyscale with alpha
+    6: (8, 16) # Truecolour with alpha
+}
+
+class PngHeaderError(ValueError):
+    pass
+
+class PngHeader:
+    def __init__(self, image_file:Path, size:int=0, mtime_ns:int=0):
+        """What a PNG file's header and chunk table say about it, read without decoding any pixels
+
+        Args:
+            image_file (Path): The PNG file
+            size (int, optional): The file size when it was read. Defaults to 0
+            mtime_ns (int, optional): The file modification time when it was read. Defaults to 0
+        """
+        self.image_file = image_file
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.width = 0
+        self.height = 0
+        self.bit_depth = 0
+        self.color_type = 0
+        self.interlaced = False
+        self.has_transparency = False
+        self.image_data_bytes = 0
+        self.chunks = [
+            # Example
+            # (b"IHDR", 8, 13)
+        ]
+        self.error = None
+
+    @property
+    def valid(self) -> bool:
+        return self.error is None
+
+    @property
+    def has_alpha(self) -> bool:
+        """Whether any pixel may be transparent. False means every pixel is fully opaque
+        """
+        return self.color_type in (4, 6) or self.has_transparency
+
+    @property
+    def pixel_count(self) -> int:
+        return self.width * self.height
+
+def readChunkTable(data, png_header:PngHeader):
+    """Walks the chunk table of a PNG, filling in the header. Only chunk lengths and types are read, and the IHDR CRC is
+    checked, so the pages holding image data are never touched
+
+    Args:
+        data (mmap.mmap): The PNG file
+        png_header (PngHeader): The header to fill in
+
+    Raises:
+        PngHeaderError: When the signature, chunk table or IHDR is invalid
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise PngHeaderError("Missing PNG signature")
+
+    file_size = len(data)
+    position = 8
+    has_palette = False
+    while True:
+        if position + 12 > file_size:
+            raise PngHeaderError("Missing IEND chunk, the file may be truncated")
+        length, chunk_type = struct.unpack_from(">I4s", data, position)
+        chunk_end = position + 12 + length
+        if chunk_end > file_size:
+            raise PngHeaderError(f"Chunk '{chunk_type.decode(errors='replace')}' runs past the end of the file, the file may be truncated")
+        if not png_header.chunks and chunk_type != b"IHDR":
+            raise PngHeaderError("The first chunk is not IHDR")
+        png_header.chunks.append((chunk_type, position, length))
+
+        match chunk_type:
+            case b"IHDR":
+                if length != 13:
+                    raise PngHeaderError(f"IHDR chunk has length {length} instead of 13")
+                (crc,) = struct.unpack_from(">I", data, position + 21)
+                if zlib.crc32(data[position + 4:position + 21]) != crc:
+                    raise PngHeaderError("IHDR chunk has an invalid CRC")
+                width, height, bit_depth, color_type, compression, filter_method, interlace = struct.unpack_from(">IIBBBBB", data, position + 8)
+                if not 0 < width < 2 ** 31 or not 0 < height < 2 ** 31:
+                    raise PngHeaderError(f"Invalid dimensions {width}x{height}")
+                if bit_depth not in COLOR_TYPE_BIT_DEPTHS.get(color_type, ()):
+                    raise PngHeaderError(f"Invalid colour type {color_type} with bit depth {bit_depth}")
+                if compression != 0 or filter_method != 0 or interlace not in (0, 1):
+                    raise PngHeaderError("Unknown compression, filter or interlace method")
+                png_header.width = width
+                png_header.height = height
+                png_header.bit_depth = bit_depth
+                png_header.color_type = color_type
+                png_header.interlaced = interlace == 1
+            case b"PLTE":
+                has_palette = True
+            case b"tRNS":
+                png_header.has_transparency = True
+            case b"IDAT":
+                png_header.image_data_bytes += length
+            case b"IEND":
+                break
+        position = chunk_end
+
+    if png_header.image_data_bytes == 0:
+        raise PngHeaderError("Missing image data")
+    if png_header.color_type == 3 and not has_palette:
+        raise PngHeaderError("Missing PLTE chunk for an indexed-colour image")
+
+def readHeader(image_file:Path, file_stat:os.stat_result=None) -> PngHeader:
+    """Reads the header and chunk table of a PNG through mmap, capturing any problem instead of raising it. Safe to run
+    inside a worker thread
+
+    Args:
+        image_file (Path): The PNG file
+        file_stat (os.stat_result, optional): The file's stat, if already known
+
+    Returns:
+        PngHeader: The header, with error set when the file is not a valid PNG
+    """
+    png_header = PngHeader(image_file=image_file)
+    try:
+        with open(image_file, "rb") as open_file:
+            file_stat = file_stat or os.fstat(open_file.fileno())
+            png_header.size = file_stat.st_size
+            png_header.mtime_ns = file_stat.st_mtime_ns
+            if file_stat.st_size < MINIMUM_PNG_BYTES:
+                raise PngHeaderError(f"The file is only {file_stat.st_size} bytes, too small to be a PNG")
+            with mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                readChunkTable(data=data, png_header=png_header)
+    except (OSError, ValueError) as e:
+        png_header.error = str(e)
+    return png_header
+
+class PngIndex:
+    def __init__(self):
+        """Holds the header of every scanned PNG, so dimensions and alpha presence are known before any conversion starts.
+        Entries are reused until the file's size or modification time changes
+        """
+        self.headers = {
+            # Example
+            # Path("source/gfx/models/portraits/tau/tau_pop_00.png"): PngHeader(...)
+        }
+
+    def scan(self, image_files:list[Path], file_stats:list[os.stat_result]=None) -> list[PngHeader]:
+        """Reads the header of every file that isn't indexed yet, or has changed since it was indexed
+
+        Args:
+            image_files (list[Path]): The PNG files
+            file_stats (list[os.stat_result], optional): The stat of each file, used to detect changed files. Defaults to
+                None, which reads every file again
+
+        Returns:
+            list[PngHeader]: The header of each file, in the order provided
+        """
+        file_stats = file_stats or [None] * len(image_files)
+        stale_files = []
+        stale_stats = []
+        for image_file, file_stat in zip(image_files, file_stats):
+            png_header = self.headers.get(image_file)
+            if png_header is None or file_stat is None or (png_header.size, png_header.mtime_ns) != (file_stat.st_size, file_stat.st_mtime_ns):
+                stale_files.append(image_file)
+                stale_stats.append(file_stat)
+
+        for png_header in map(readHeader, stale_files, stale_stats):
+            self.headers[png_header.image_file] = png_header
+        return [self.headers[image_file] for image_file in image_files]
+
+    def get(self, image_file:Path) -> PngHeader:
+        """Returns the indexed header of a file
+
+        Args:
+            image_file (Path): The PNG file
+
+        Returns:
+            PngHeader: The header, or None if the file hasn't been scanned
+        """
+        return self.headers.get(image_file)
+
+    def forget(self, image_file:Path):
+        self.headers.pop(image_file, None)
@@ -0,0 +1,222 @@
+import functools
+
+ANCHORS = {
+    # anchor: (vertical, horizontal, ImageMagick gravity)
+    "center": ("center", "center", "Center"),
+    "top": ("top", "center", "North"),
+    "bottom": ("bottom", "center", "South"),
+    "left": ("center", "left", "West"),
+    "right": ("center", "right", "East"),
+    "top-left": ("top", "left", "NorthWest"),
+    "top-right": ("top", "right", "NorthEast"),
+    "bottom-left": ("bottom", "left", "SouthWest"),
+    "bottom-right": ("bottom", "right", "SouthEast")
+}
+
+FITS = ["cover", "contain"]
+
+class CropSettings:
+    def __init__(self, width:int, height:int, fit:str="cover", anchor:str="center", padding:int=0):
+        """Describes how source images are fitted to the portrait size
+
+        Args:
+            width (int): The portrait width in pixels
+            height (int): The portrait height in pixels
+            fit (str, optional): "cover" fills the area inside the padding and crops the overflow, "contain" fits the whole
+                image inside the padding and leaves the rest transparent. Defaults to "cover"
+            anchor (str, optional): Which part of the image is kept when cropping, or where it is placed when it doesn't
+                fill the area. Defaults to "center"
+            padding (int, optional): Transparent border in pixels on every side. Defaults to 0
+
+        Raises:
+            ValueError: When the settings are invalid
+        """
+        if fit not in FITS:
+            raise ValueError(f"Unknown fit '{fit}', choose from {', '.join(FITS)}")
+        if anchor not in ANCHORS:
+            raise ValueError(f"Unknown anchor '{anchor}', choose from {', '.join(ANCHORS)}")
+        if padding < 0:
+            raise ValueError(f"Padding of {padding} is negative, it should be 0 or more pixels")
+        if width - 2 * padding < 1 or height - 2 * padding < 1:
+            raise ValueError(f"Padding of {padding} leaves no room inside a {width}x{height} portrait")
+        self.width = width
+        self.height = height
+        self.fit = fit
+        self.anchor = anchor
+        self.padding = padding
+
+    @classmethod
+    def fromSize(cls, size:str, **kwargs):
+        """Creates the settings from a WIDTHxHEIGHT string, such as "512x512"
+
+        Args:
+            size (str): The portrait size
+
+        Raises:
+            ValueError: When the size is not in WIDTHxHEIGHT form
+
+        Returns:
+            CropSettings: The settings
+        """
+        try:
+            width, height = (int(part) for part in size.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"Portrait size '{size}' should look like WIDTHxHEIGHT, such as 512x512")
+        return cls(width=width, height=height, **kwargs)
+
+    def addsTransparency(self) -> bool:
+        """Whether fitting may leave transparent pixels around the image, even when the source is fully opaque
+
+        Returns:
+            bool: True when there is padding or the whole image is fitted inside the portrait
+        """
+        return self.padding > 0 or self.fit == "contain"
+
+    def asDict(self) -> dict:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "fit": self.fit,
+            "anchor": self.anchor,
+            "padding": self.padding
+        }
+
+    def magickArguments(self) -> list[str]:
+        """The ImageMagick arguments that fit an image the same way fitPixels does
+
+        Returns:
+            list[str]: Arguments to place between the input and output file
+        """
+        inner_size = f"{self.width - 2 * self.padding}x{self.height - 2 * self.padding}"
+        gravity = ANCHORS[self.anchor][2]
+        resize_geometry = f"{inner_size}^" if self.fit == "cover" else inner_size
+        return [
+            "-resize", resize_geometry,
+            "-background", "none",
+            "-gravity", gravity,
+            "-extent", inner_size,
+            "-gravity", "Center",
+            "-extent", f"{self.width}x{self.height}"
+        ]
+
+def anchorOffset(space:int, alignment:str) -> int:
+    """How far to move content along one axis to honour the anchor
+
+    Args:
+        space (int): The difference between the larger and smaller size along the axis
+        alignment (str): "top"/"left", "center" or "bottom"/"right"
+
+    Returns:
+        int: The offset in pixels
+    """
+    if alignment in ("top", "left"):
+        return 0
+    if alignment in ("bottom", "right"):
+        return space
+    return space // 2
+
+@functools.lru_cache(maxsize=128)
+def resampleWeights(input_size:int, output_size:int):
+    """Builds the Lanczos-3 resampling matrix for one axis. Matrices are cached, so every image with the same input size
+    reuses them
+
+    Args:
+        input_size (int): The number of source pixels along the axis
+        output_size (int): The number of resampled pixels along the axis
+
+    Returns:
+        np.ndarray: Weights with shape (output_size, input_size), each row summing to 1
+    """
+    import numpy as np
+
+    scale = output_size / input_size
+    # When shrinking, the kernel is stretched so every source pixel contributes
+    kernel_scale = min(1.0, scale)
+    centers = (np.arange(output_size) + 0.5) / scale - 0.5
+    distance = (np.arange(input_size)[None, :] - centers[:, None]) * kernel_scale
+    weights = np.sinc(distance) * np.sinc(distance / 3)
+    weights[np.abs(distance) >= 3] = 0
+    weights = (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32)
+    # The cached matrix is shared between threads, so nothing may change it
+    weights.setflags(write=False)
+    return weights
+
+def resample(pixels, row_weights, column_weights):
+    """Resamples RGBA pixels with separable weights. Colour is premultiplied by alpha, so transparent pixels don't bleed
+    into their neighbours
+
+    Args:
+        pixels (np.ndarray): RGBA pixels with shape (height, width, 4)
+        row_weights (np.ndarray): Weights with shape (new_height, height)
+        column_weights (np.ndarray): Weights with shape (new_width, width)
+
+    Returns:
+        np.ndarray: The resampled RGBA pixels with shape (new_height, new_width, 4)
+    """
+    import numpy as np
+
+    premultiplied = pixels.astype(np.float32)
+    premultiplied[..., :3] *= premultiplied[..., 3:] / 255
+    height, width, channels = premultiplied.shape
+    # Both passes are plain matrix products, so they run through BLAS
+    resampled = (row_weights @ premultiplied.reshape(height, width * channels)).reshape(-1, width, channels)
+    resampled = np.matmul(column_weights, resampled)
+
+    alpha = np.clip(resampled[..., 3:], 0, 255)
+    color = np.where(alpha > 0, resampled[..., :3] * 255 / np.maximum(alpha, 1e-6), 0)
+    resampled = np.concatenate([color, alpha], axis=2)
+    return np.clip(np.rint(resampled), 0, 255).astype(np.uint8)
+
+def fitPixels(pixels, crop_settings:CropSettings):
+    """Resizes and crops or pads RGBA pixels to the portrait size
+
+    Args:
+        pixels (np.ndarray): RGBA pixels with shape (height, width, 4)
+        crop_settings (CropSettings): How to fit the image
+
+    Returns:
+        np.ndarray: RGBA pixels with shape (crop_settings.height, crop_settings.width, 4)
+    """
+    import numpy as np
+
+    height, width = pixels.shape[:2]
+    inner_width = crop_settings.width - 2 * crop_settings.padding
+    inner_height = crop_settings.height - 2 * crop_settings.padding
+    vertical, horizontal, _ = ANCHORS[crop_settings.anchor]
+
+    if crop_settings.fit == "cover":
+        scale = max(inner_width / width, inner_height / height)
+        scaled_width = max(inner_width, round(width * scale))
+        scaled_height = max(inner_height, round(height * scale))
+        crop_x = anchorOffset(scaled_width - inner_width, horizontal)
+        crop_y = anchorOffset(scaled_height - inner_height, vertical)
+        crop_columns = slice(crop_x, crop_x + inner_width)
+        crop_rows = slice(crop_y, crop_y + inner_height)
+        place_x = place_y = 0
+    else:
+        scale = min(inner_width / width, inner_height / height)
+        scaled_width = max(1, min(inner_width, round(width * scale)))
+        scaled_height = max(1, min(inner_height, round(height * scale)))
+        crop_columns = slice(0, scaled_width)
+        crop_rows = slice(0, scaled_height)
+        place_x = anchorOffset(inner_width - scaled_width, horizontal)
+        place_y = anchorOffset(inner_height - scaled_height, vertical)
+
+    if (scaled_height, scaled_width) == (height, width):
+        fitted = pixels[crop_rows, crop_columns]
+    else:
+        # Only the rows of the cached weights that land inside the crop are used
+        fitted = resample(
+            pixels,
+            row_weights=resampleWeights(height, scaled_height)[crop_rows],
+            column_weights=resampleWeights(width, scaled_width)[crop_columns]
+        )
+
+    if fitted.shape[:2] == (crop_settings.height, crop_settings.width):
+        return fitted
+
+    canvas = np.zeros((crop_settings.height, crop_settings.width, 4), dtype=np.uint8)
+    top = crop_settings.padding + place_y
+    left = crop_settings.padding + place_x
+    canvas[top:top + fitted.shape[0], left:left + fitted.shape[1]] = fitted
+    return canvas
@@ -0,0 +1,100 @@
+import collections
+import contextlib
+import re
+import threading
+
+MEMORY_UNITS = {
+    "": 1,
+    "k": 1024,
+    "m": 1024 ** 2,
+    "g": 1024 ** 3,
+    "t": 1024 ** 4
+}
+
+def parseMemorySize(size:str) -> int:
+    """Parses a memory size such as 512M, 4G or 4GiB. Units are binary, and a number without a unit is in bytes
+
+    Args:
+        size (str): The memory size
+
+    Raises:
+        ValueError: When the size isn't a positive number with an optional K, M, G or T unit
+
+    Returns:
+        int: The size in bytes
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*", size, re.IGNORECASE)
+    if match is None or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid memory size '{size}', expected a size such as 512M or 4G")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).lower()])
+
+def formatMemorySize(size:int) -> str:
+    for unit in ["T", "G", "M", "K"]:
+        if size >= MEMORY_UNITS[unit.lower()]:
+            return f"{size / MEMORY_UNITS[unit.lower()]:.1f}{unit}iB"
+    return f"{size}B"
+
+class MemoryBudget:
+    def __init__(self, budget:int):
+        """Limits how much memory the conversions running at once may use, from each conversion's estimated memory
+
+        Conversions are admitted in the order they ask. The oldest waiting conversion holds a claim on the memory it needs,
+        so smaller conversions only start alongside it when they fit in what that claim leaves over, and a large image is
+        never starved by a stream of small ones. A conversion larger than the whole budget runs once nothing else is
+
+        Args:
+            budget (int): The memory budget in bytes
+        """
+        self.budget = budget
+        self.used = 0
+        self.condition = threading.Condition()
+        self.waiting = collections.deque()
+
+    def fits(self, ticket:list) -> bool:
+        amount = ticket[0]
+        if ticket is self.waiting[0]:
+            return self.used == 0 or self.used + amount <= self.budget
+        return self.used + self.waiting[0][0] + amount <= self.budget
+
+    def acquire(self, amount:int) -> int:
+        """Waits until the conversion can start, then takes its memory from the budget
+
+        Args:
+            amount (int): The conversion's estimated memory in bytes
+
+        Returns:
+            int: The memory taken, which is never more than the whole budget
+        """
+        amount = min(amount, self.budget)
+        # A list rather than the amount, so every waiting conversion is told apart by identity
+        ticket = [amount]
+        with self.condition:
+            self.waiting.append(ticket)
+            while not self.fits(ticket):
+                self.condition.wait()
+            self.waiting.remove(ticket)
+            self.used += amount
+            # The next oldest conversion may fit now
+            self.condition.notify_all()
+        return amount
+
+    def release(self, amount:int):
+        with self.condition:
+            self.used -= amount
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, amount:int):
+        """Holds memory from the budget while the block runs
+
+        Args:
+            amount (int): The conversion's estimated memory in bytes
+
+        Yields:
+            int: The memory taken, which is never more than the whole budget
+        """
+        amount = self.acquire(amount)
+        try:
+            yield amount
+        finally:
+            self.release(amount)
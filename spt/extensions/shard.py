@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+def parseShard(shard:str) -> tuple[int, int]:
+    """Parses a shard written as i/N, where i counts from 1
+
+    Args:
+        shard (str): The shard, such as "2/4"
+
+    Raises:
+        ValueError: When the shard isn't written as i/N with 1 <= i <= N
+
+    Returns:
+        tuple[int, int]: The shard number and the number of shards
+    """
+    try:
+        shard_number, shard_count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{shard}', expected i/N such as 1/4")
+    if not 1 <= shard_number <= shard_count:
+        raise ValueError(f"Invalid shard '{shard}', i must be between 1 and N")
+    return shard_number, shard_count
+
+def shardOf(relative_source:str, shard_count:int) -> int:
+    """Picks the shard a source belongs to from a hash of its relative path, so every build agent agrees on it without
+    talking to the others, and a source only moves when it is renamed or the number of shards changes
+
+    Args:
+        relative_source (str): The source path relative to the source folder, with / separators
+        shard_count (int): The number of shards
+
+    Returns:
+        int: The shard number, counting from 1
+    """
+    digest = hashlib.blake2b(relative_source.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count + 1
+
+class ShardManifest:
+    version = 1
+
+    def __init__(self, shard_number:int, shard_count:int, settings:dict=None, portraits:list[str]=None):
+        """Lists the DDS files one shard produced, so the configs for every shard can be generated without scanning the images
+
+        Args:
+            shard_number (int): The shard, counting from 1
+            shard_count (int): The number of shards
+            settings (dict, optional): The encoder settings the shard used. Defaults to None
+            portraits (list[str], optional): The DDS files relative to the output folder, with / separators. Defaults to None
+        """
+        self.shard_number = shard_number
+        self.shard_count = shard_count
+        self.settings = settings or {}
+        self.portraits = portraits or []
+
+    @staticmethod
+    def filename(shard_number:int, shard_count:int) -> str:
+        return f".spt-shard-{shard_number}-of-{shard_count}.json"
+
+    def save(self, manifest_path:Path):
+        """Writes the partial manifest, replacing any previous one atomically
+
+        Args:
+            manifest_path (Path): The file to write
+        """
+        data = {
+            "version": self.version,
+            "shard": self.shard_number,
+            "shards": self.shard_count,
+            "settings": self.settings,
+            "portraits": sorted(self.portraits)
+        }
+        manifest_path = Path(manifest_path)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+        with open(temp_path, "w") as manifest_file:
+            json.dump(data, manifest_file, indent=1)
+        os.replace(temp_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path:Path) -> "ShardManifest":
+        """Reads a partial manifest written by a shard
+
+        Args:
+            manifest_path (Path): The file to read
+
+        Raises:
+            ValueError: When the file can't be read or isn't a partial manifest from this version
+
+        Returns:
+            ShardManifest: The partial manifest
+        """
+        try:
+            with open(manifest_path, "r") as manifest_file:
+                data = json.load(manifest_file)
+            if data.get("version") != cls.version:
+                raise ValueError("it is from a different version")
+            return cls(
+                shard_number=int(data["shard"]),
+                shard_count=int(data["shards"]),
+                settings=data.get("settings", {}),
+                portraits=list(data["portraits"])
+            )
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Unable to read shard manifest '{manifest_path}': {e}")
+
+def mergeShardManifests(shard_manifests:list[ShardManifest]) -> list[str]:
+    """Combines the partial manifests of every shard of a build
+
+    Args:
+        shard_manifests (list[ShardManifest]): One partial manifest per shard
+
+    Raises:
+        ValueError: When a shard is missing or repeated, the shards disagree on the number of shards, or they were
+            converted with different encoder settings
+
+    Returns:
+        list[str]: Every DDS file relative to the output folder, in the order a scan of the output folder would list them
+    """
+    if not shard_manifests:
+        raise ValueError("No shard manifests to merge")
+    shard_count = shard_manifests[0].shard_count
+    settings = shard_manifests[0].settings
+    shard_numbers = []
+    for shard_manifest in shard_manifests:
+        if shard_manifest.shard_count != shard_count:
+            raise ValueError(f"Shard {shard_manifest.shard_number}/{shard_manifest.shard_count} is from a build with {shard_manifest.shard_count} shards, not {shard_count}")
+        if shard_manifest.settings != settings:
+            raise ValueError(f"Shard {shard_manifest.shard_number}/{shard_count} was converted with different encoder settings")
+        shard_numbers.append(shard_manifest.shard_number)
+
+    repeated_shards = sorted({shard_number for shard_number in shard_numbers if shard_numbers.count(shard_number) > 1})
+    if repeated_shards:
+        raise ValueError(f"The manifests of shards {', '.join(map(str, repeated_shards))} were provided more than once")
+    missing_shards = sorted(set(range(1, shard_count + 1)) - set(shard_numbers))
+    if missing_shards:
+        raise ValueError(f"Missing the manifests of shards {', '.join(map(str, missing_shards))} of {shard_count}")
+
+    portraits = {portrait for shard_manifest in shard_manifests for portrait in shard_manifest.portraits}
+    # Files directly in a folder come before its subfolders, matching index.TreeIndex.files
+    return sorted(portraits, key=lambda portrait: (tuple(portrait.split("/")[:-1]), portrait.rpartition("/")[2]))
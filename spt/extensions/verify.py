@@ -0,0 +1,141 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+
+# https://learn.microsoft.com/en-us/windows/win32/direct3ddds/dds-header
+# Kept apart from dds, which needs NumPy to encode, so outputs can be checked without it
+
+DDS_MAGIC = b"DDS "
+DDS_HEADER_SIZE = 124
+DDS_PIXELFORMAT_SIZE = 32
+# The magic number followed by the header
+DDS_PREAMBLE_BYTES = 4 + DDS_HEADER_SIZE
+
+DDSD_MIPMAPCOUNT = 0x20000
+DDPF_FOURCC = 0x4
+
+BLOCK_BYTES = {
+    b"DXT1": 8,
+    b"DXT5": 16
+}
+
+FOUR_CC = {
+    "dxt1": b"DXT1",
+    "dxt5": b"DXT5"
+}
+
+class DdsHeaderError(ValueError):
+    pass
+
+class DdsHeader:
+    def __init__(self, dds_file:Path):
+        """What a DDS file's header says about it, and whether the rest of the file matches
+
+        Args:
+            dds_file (Path): The DDS file
+        """
+        self.dds_file = dds_file
+        self.size = 0
+        self.width = 0
+        self.height = 0
+        self.four_cc = None
+        self.mipmap_count = 1
+        self.error = None
+
+    @property
+    def valid(self) -> bool:
+        return self.error is None
+
+def payloadBytes(width:int, height:int, four_cc:bytes, mipmap_count:int=1) -> int:
+    """The size of the compressed blocks of a DDS surface, with every mipmap level
+
+    Args:
+        width (int): The width of the largest level in pixels
+        height (int): The height of the largest level in pixels
+        four_cc (bytes): The compression format
+        mipmap_count (int, optional): The number of levels. Defaults to 1
+
+    Returns:
+        int: The payload size in bytes
+    """
+    payload_bytes = 0
+    for _ in range(mipmap_count):
+        payload_bytes += max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * BLOCK_BYTES[four_cc]
+        width = max(1, width // 2)
+        height = max(1, height // 2)
+    return payload_bytes
+
+def readDdsHeader(data, dds_header:DdsHeader):
+    """Parses and checks the magic number, header and pixel format of a block compressed DDS file
+
+    Args:
+        data (mmap.mmap | bytes): The file content
+        dds_header (DdsHeader): Filled in with what the header says
+
+    Raises:
+        DdsHeaderError: When the file isn't a DXT1 or DXT5 compressed DDS file
+    """
+    if data[:4] != DDS_MAGIC:
+        raise DdsHeaderError("Missing the DDS magic number")
+    header_size, flags, height, width, _, _, mipmap_count = struct.unpack_from("<7I", data, 4)
+    if header_size != DDS_HEADER_SIZE:
+        raise DdsHeaderError(f"Invalid header size {header_size}, expected {DDS_HEADER_SIZE}")
+    pixel_format_size, pixel_format_flags, four_cc = struct.unpack_from("<2I4s", data, 76)
+    if pixel_format_size != DDS_PIXELFORMAT_SIZE:
+        raise DdsHeaderError(f"Invalid pixel format size {pixel_format_size}, expected {DDS_PIXELFORMAT_SIZE}")
+    if not pixel_format_flags & DDPF_FOURCC or four_cc not in BLOCK_BYTES:
+        raise DdsHeaderError(f"Unsupported pixel format {four_cc!r}, expected DXT1 or DXT5")
+    if width == 0 or height == 0:
+        raise DdsHeaderError(f"Invalid dimensions {width}x{height}")
+
+    dds_header.width = width
+    dds_header.height = height
+    dds_header.four_cc = four_cc
+    dds_header.mipmap_count = mipmap_count if flags & DDSD_MIPMAPCOUNT and mipmap_count > 0 else 1
+
+def checkLength(dds_header:DdsHeader):
+    """Checks that a DDS file is exactly as long as the surface and mipmaps its header describes
+
+    Args:
+        dds_header (DdsHeader): The header, as filled in by readDdsHeader
+
+    Raises:
+        DdsHeaderError: When the file is truncated or has trailing data
+    """
+    expected_bytes = DDS_PREAMBLE_BYTES + payloadBytes(dds_header.width, dds_header.height, dds_header.four_cc, dds_header.mipmap_count)
+    if dds_header.size != expected_bytes:
+        raise DdsHeaderError(f"The file is {dds_header.size} bytes, but a {dds_header.width}x{dds_header.height} {dds_header.four_cc.decode()} surface with {dds_header.mipmap_count} mipmap levels is {expected_bytes} bytes")
+
+def checkDds(dds_file:Path, size:tuple[int, int]=None, compressions:list[str]=None) -> DdsHeader:
+    """Checks a converted DDS file through mmap, reading only its header, capturing any problem instead of raising it.
+    Safe to run inside a worker thread
+
+    Args:
+        dds_file (Path): The DDS file
+        size (tuple[int, int], optional): The expected width and height. Defaults to None, which accepts any size
+        compressions (list[str], optional): The expected compressions, such as ["dxt5"]. Defaults to None, which
+            accepts DXT1 and DXT5
+
+    Returns:
+        DdsHeader: The header, with error set when the file is missing, invalid or not what was expected
+    """
+    dds_header = DdsHeader(dds_file=dds_file)
+    try:
+        with open(dds_file, "rb") as open_file:
+            dds_header.size = os.fstat(open_file.fileno()).st_size
+            if dds_header.size < DDS_PREAMBLE_BYTES:
+                raise DdsHeaderError(f"The file is only {dds_header.size} bytes, too small to be a DDS file")
+            with mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                readDdsHeader(data=data, dds_header=dds_header)
+
+        if compressions is not None and dds_header.four_cc not in [FOUR_CC[compression] for compression in compressions]:
+            raise DdsHeaderError(f"Compressed as {dds_header.four_cc.decode()}, expected {' or '.join(compression.upper() for compression in compressions)}")
+        if size is not None and (dds_header.width, dds_header.height) != tuple(size):
+            raise DdsHeaderError(f"The image is {dds_header.width}x{dds_header.height}, expected {size[0]}x{size[1]}")
+        checkLength(dds_header)
+    except FileNotFoundError:
+        dds_header.error = "The file is missing"
+    except (OSError, ValueError) as e:
+        dds_header.error = str(e)
+    return dds_header
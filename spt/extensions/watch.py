@@ -0,0 +1,233 @@
+import abc
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+# https://man7.org/linux/man-pages/man7/inotify.7.html
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_CREATE is only acted on for folders, files are picked up once they are closed after writing
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+class Watcher(abc.ABC):
+    def __init__(self, root:Path):
+        self.root = Path(root)
+
+    @abc.abstractmethod
+    def poll(self, timeout:float=None) -> set[Path]:
+        """Waits for changes under the root
+
+        Args:
+            timeout (float, optional): The longest time to wait in seconds. Defaults to None, which waits until something changes
+
+        Returns:
+            set[Path]: The changed files and folders, empty when nothing changed before the timeout
+        """
+
+    def waitForChanges(self, debounce:float=0.2) -> set[Path]:
+        """Waits until something changes, then keeps collecting changes until none arrive for the debounce time, so a
+        burst of saves is handled as a single update
+
+        Args:
+            debounce (float, optional): Seconds without changes that end a burst. Defaults to 0.2
+
+        Returns:
+            set[Path]: The changed files and folders
+        """
+        changes = self.poll()
+        while True:
+            more_changes = self.poll(timeout=debounce)
+            if not more_changes:
+                return changes
+            changes |= more_changes
+
+    def close(self):
+        pass
+
+class PollingWatcher(Watcher):
+    def __init__(self, root:Path, interval:float=0.5):
+        """Detects changes by comparing the size and modification time of every file between scans. Works everywhere,
+        but every scan walks the whole tree
+
+        Args:
+            root (Path): The folder to watch
+            interval (float, optional): Seconds between scans. Defaults to 0.5
+        """
+        super().__init__(root)
+        self.interval = interval
+        self.files = self.snapshot()
+
+    def snapshot(self) -> dict:
+        files = {}
+        pending = [self.root]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            pending.append(Path(entry.path))
+                        elif entry.is_file():
+                            entry_stat = entry.stat()
+                            files[Path(entry.path)] = (entry_stat.st_size, entry_stat.st_mtime_ns)
+            except OSError:
+                continue
+        return files
+
+    def poll(self, timeout:float=None) -> set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            files = self.snapshot()
+            changes = {path for path in files.keys() | self.files.keys() if files.get(path) != self.files.get(path)}
+            self.files = files
+            if changes:
+                return changes
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            wait = self.interval if deadline is None else min(self.interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(wait)
+
+class InotifyWatcher(Watcher):
+    def __init__(self, root:Path):
+        """Receives changes from the Linux kernel through inotify, with one watch per folder
+
+        Args:
+            root (Path): The folder to watch
+
+        Raises:
+            OSError: When inotify is not available, or the watch limit is reached
+        """
+        super().__init__(root)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+        self.watches = {
+            # Example
+            # 1: Path("source/gfx/models/portraits/tau")
+        }
+        try:
+            self.addTree(self.root)
+        except OSError:
+            self.close()
+            raise
+
+    def addWatch(self, directory:Path):
+        watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, f"Unable to watch '{directory}': {os.strerror(error_number)}")
+        self.watches[watch_descriptor] = directory
+
+    def addTree(self, directory:Path) -> set[Path]:
+        """Watches a folder and every folder inside it
+
+        Args:
+            directory (Path): The folder to watch
+
+        Returns:
+            set[Path]: The files already inside, which may have been written before the watches were added. Empty files
+                are left out, as they are still being written and are reported once they are closed
+        """
+        files = set()
+        pending = [directory]
+        while pending:
+            current_dir = pending.pop()
+            self.addWatch(current_dir)
+            try:
+                with os.scandir(current_dir) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            pending.append(Path(entry.path))
+                        elif entry.is_file() and entry.stat().st_size > 0:
+                            files.add(Path(entry.path))
+            except OSError:
+                continue
+        return files
+
+    def readEvents(self):
+        data = b""
+        while True:
+            try:
+                data += os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+        position = 0
+        while position + EVENT_HEADER.size <= len(data):
+            watch_descriptor, mask, _, name_length = EVENT_HEADER.unpack_from(data, position)
+            position += EVENT_HEADER.size
+            name = data[position:position + name_length].rstrip(b"\0")
+            position += name_length
+            yield watch_descriptor, mask, os.fsdecode(name)
+
+    def poll(self, timeout:float=None) -> set[Path]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changes = set()
+        for watch_descriptor, mask, name in self.readEvents():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so everything is treated as changed
+                logging.warning(f"Too many changes under '{self.root}' at once, checking every file")
+                changes.add(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(watch_descriptor, None)
+                continue
+            directory = self.watches.get(watch_descriptor)
+            if directory is None:
+                continue
+            path = directory / name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        changes |= self.addTree(path)
+                    except OSError as e:
+                        logging.warning(e)
+                else:
+                    # Files under a deleted or moved out folder don't get their own events
+                    changes.add(path)
+            elif not mask & IN_CREATE:
+                changes.add(path)
+        return changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def createWatcher(root:Path, poll_interval:float=0.5) -> Watcher:
+    """Watches a folder with inotify where available, falling back to polling
+
+    Args:
+        root (Path): The folder to watch
+        poll_interval (float, optional): Seconds between scans when polling. Defaults to 0.5
+
+    Returns:
+        Watcher: The watcher
+    """
+    try:
+        watcher = InotifyWatcher(root=root)
+        logging.debug(f"Watching '{root}' with inotify")
+        return watcher
+    except (OSError, AttributeError) as e:
+        logging.info(f"Unable to use inotify ({e}), checking '{root}' for changes every {poll_interval}s instead")
+        return PollingWatcher(root=root, interval=poll_interval)
@@ -0,0 +1,330 @@
+import contextlib
+import json
+import logging
+import os
+import signal
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from spt import StellarisPortraitTool
+from extensions import errors, metrics
+
+# The job fields each caller may set, and their defaults. Everything else comes from the service's own arguments
+JOB_FIELDS = {
+    "source": None,
+    "output": None,
+    "config_prefix": "",
+    "species_archetype": "BIOLOGICAL",
+    "conflict": "stop",
+    "generate_configs": True,
+    "pipeline": False,
+    "skip_image_convert": False,
+    "full_rebuild": False,
+    "merge_configs": False,
+    "plan": False
+}
+# The Host header of requests on the localhost port. Anything else may be a web page reaching the port through DNS rebinding
+ALLOWED_HOSTS = frozenset(["localhost", "127.0.0.1"])
+JOB_CHOICES = {
+    "species_archetype": ["BIOLOGICAL", "MACHINE"],
+    "conflict": ["replace", "stop", "skip"]
+}
+
+class JobRequestError(ValueError):
+    pass
+
+def isAllowedHost(host_header:str) -> bool:
+    """Checks that a request was addressed to localhost, with or without a port
+
+    Args:
+        host_header (str): The request's Host header, or None if it had none
+
+    Returns:
+        bool: Whether the host is allowed
+    """
+    host, _, port = (host_header or "").strip().lower().partition(":")
+    return host in ALLOWED_HOSTS and (port == "" or port.isdigit())
+
+def parseJob(data) -> dict:
+    """Validates a job request and fills in the defaults
+
+    Args:
+        data: The decoded JSON body of the request
+
+    Raises:
+        JobRequestError: When the job is missing a folder, has unknown fields, or a field has the wrong type
+
+    Returns:
+        dict: Every job field
+    """
+    if not isinstance(data, dict):
+        raise JobRequestError("The job must be a JSON object")
+    unknown_fields = sorted(set(data) - set(JOB_FIELDS))
+    if unknown_fields:
+        raise JobRequestError(f"Unknown job fields: {', '.join(unknown_fields)}")
+
+    job = dict(JOB_FIELDS)
+    job.update(data)
+    for field in ["source", "output"]:
+        if not isinstance(job[field], str) or not job[field]:
+            raise JobRequestError(f"'{field}' must be the path of a folder")
+    for field, default in JOB_FIELDS.items():
+        if default is not None and not isinstance(job[field], type(default)):
+            raise JobRequestError(f"'{field}' must be a {type(default).__name__}")
+    for field, choices in JOB_CHOICES.items():
+        if job[field] not in choices:
+            raise JobRequestError(f"'{field}' must be one of {', '.join(choices)}")
+    return job
+
+class PortraitService:
+    def __init__(self, spt_params:dict, jobs:int=None):
+        """Runs conversion and config jobs for other tools without exiting between them. The interpreter, imports, encoder
+        check, worker pool and PNG header index stay warm from one job to the next
+
+        Args:
+            spt_params (dict): The StellarisPortraitTool parameters shared by every job, such as the encoder
+            jobs (int, optional): The number of conversion workers shared by every job. Defaults to the number of CPU cores
+        """
+        self.spt_params = dict(spt_params)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, jobs or os.cpu_count() or 1))
+        self.png_index = self.spt_params.pop("png_index", None)
+        # The encoder checked by warm(), shared by every job so it is only probed once
+        self.encoder = None
+        self.lock = threading.Lock()
+        # Only the outputs with a job running or waiting have a lock, so the locks don't pile up
+        self.output_locks = {
+            # Example
+            # Path("/builds/mod/output"): [threading.Lock(), 1]
+        }
+        self.completed_jobs = 0
+        self.running_jobs = 0
+
+    def warm(self):
+        """Checks the encoder once before the first job arrives. Jobs reuse it, unless it wasn't available, in which
+        case each job checks it again
+        """
+        from extensions import encoders, prescan
+
+        self.png_index = self.png_index or prescan.PngIndex()
+        encoder = encoders.getEncoder(
+            self.spt_params.get("encoder", "magick"),
+            crop_settings=self.spt_params.get("crop_settings"),
+            compression=self.spt_params.get("compression", "dxt5"),
+            png_index=self.png_index,
+            timeout=self.spt_params.get("timeout")
+        )
+        if encoder.checkAvailable() and encoder.checkCompressionAvailable():
+            self.encoder = encoder
+        else:
+            logging.warning(f"The '{encoder.name}' encoder isn't available, so jobs that convert images will fail")
+
+    @contextlib.contextmanager
+    def outputLock(self, output_folder:Path):
+        """Holds the lock for an output folder, so two jobs never write to the same output at once. The lock is dropped
+        once no job is running or waiting on that output
+
+        Args:
+            output_folder (Path): The job's output folder
+
+        Yields:
+            None: Once the lock is held
+        """
+        key = output_folder.resolve()
+        with self.lock:
+            output_lock = self.output_locks.setdefault(key, [threading.Lock(), 0])
+            output_lock[1] += 1
+        try:
+            with output_lock[0]:
+                yield
+        finally:
+            with self.lock:
+                output_lock[1] -= 1
+                if output_lock[1] == 0:
+                    del self.output_locks[key]
+
+    def runJob(self, job:dict) -> dict:
+        """Runs a single job. Errors are returned in the result rather than raised
+
+        Args:
+            job (dict): The job, as returned by parseJob
+
+        Returns:
+            dict: The result, with "status" set to "ok" or "error"
+        """
+        spt_params = dict(self.spt_params)
+        spt_params.update({
+            "source_folder": Path(job["source"]),
+            "output_folder": Path(job["output"]),
+            "config_prefix": job["config_prefix"],
+            "species_archetype": job["species_archetype"],
+            "conflict_resolution_method": job["conflict"],
+            "full_rebuild": job["full_rebuild"],
+            "merge_configs": job["merge_configs"],
+            "executor": self.executor,
+            "png_index": self.png_index,
+            "checked_encoder": self.encoder,
+            "run_metrics": metrics.Metrics()
+        })
+
+        with self.lock:
+            self.running_jobs += 1
+        start = time.perf_counter()
+        result = {"status": "ok"}
+        spt = None
+        try:
+            with self.outputLock(spt_params["output_folder"]):
+                logging.info(f"Starting job for '{job['source']}' to '{job['output']}'")
+                with StellarisPortraitTool(**spt_params) as spt:
+                    if job["plan"]:
+                        result["plan"] = spt.plan(generate_configs=job["generate_configs"], skip_image_convert=job["skip_image_convert"]).report()
+                        # Nothing was written, so an archive is left as it was
+                        spt.close(completed=False)
+                    else:
+                        spt.run(generate_configs=job["generate_configs"], pipeline=job["pipeline"], skip_image_convert=job["skip_image_convert"])
+        except errors.SptError as e:
+            logging.error(e)
+            result = {"status": "error", "error": {"type": e.__class__.__name__, "message": str(e)}}
+        except Exception as e:
+            logging.exception(f"Job for '{job['source']}' failed")
+            result = {"status": "error", "error": {"type": "InternalError", "message": str(e)}}
+        finally:
+            with self.lock:
+                self.running_jobs -= 1
+                self.completed_jobs += 1
+
+        result["seconds"] = round(time.perf_counter() - start, 6)
+        if spt is not None:
+            result["failed_files"] = [
+                {"file": str(file), "error": error}
+                for file, error in spt.failed_files
+            ]
+            result["metrics"] = spt.metrics.report()
+        logging.info(f"Finished job for '{job['source']}' in {result['seconds']:.2f}s with status '{result['status']}'")
+        return result
+
+    def status(self) -> dict:
+        with self.lock:
+            return {"status": "ok", "running_jobs": self.running_jobs, "completed_jobs": self.completed_jobs}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def createHandler(service:PortraitService, check_host:bool=True):
+    """Creates the HTTP request handler for a service
+
+    Endpoints:
+        GET /health: The service status and job counts
+        POST /jobs: Runs the job in the JSON body and responds once it finishes. 200 when the job succeeded, 422 when it
+            failed, 400 when the request is invalid and 415 when the body isn't sent as application/json. Every response
+            body is JSON
+
+    Requests addressed to any host but localhost are refused with 403. Browsers can only send a cross-site POST
+    without a preflight as a form or plain text, so requiring application/json keeps web pages from starting jobs
+
+    Args:
+        service (PortraitService): The service that runs the jobs
+        check_host (bool, optional): Whether to check the Host header. Defaults to True. Unix sockets can't be reached
+            from a browser, so their clients may send any host
+
+    Returns:
+        type: The BaseHTTPRequestHandler class
+    """
+    class ServiceHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def sendJson(self, status_code:int, body:dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def checkHost(self) -> bool:
+            if not check_host or isAllowedHost(self.headers.get("Host")):
+                return True
+            # The body is never read, so the connection can't be reused
+            self.close_connection = True
+            self.sendJson(403, {"status": "error", "error": {"type": "Forbidden", "message": "Requests must be addressed to localhost or 127.0.0.1"}})
+            return False
+
+        def do_GET(self):
+            if not self.checkHost():
+                return
+            if self.path == "/health":
+                self.sendJson(200, service.status())
+            else:
+                self.sendJson(404, {"status": "error", "error": {"type": "NotFound", "message": f"No endpoint at '{self.path}'"}})
+
+        def do_POST(self):
+            if not self.checkHost():
+                return
+            if self.path != "/jobs":
+                self.sendJson(404, {"status": "error", "error": {"type": "NotFound", "message": f"No endpoint at '{self.path}'"}})
+                return
+            if self.headers.get_content_type() != "application/json":
+                self.close_connection = True
+                self.sendJson(415, {"status": "error", "error": {"type": "UnsupportedMediaType", "message": "Jobs must be sent with Content-Type: application/json"}})
+                return
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                job = parseJob(json.loads(body or b"null"))
+            except (ValueError, JobRequestError) as e:
+                self.sendJson(400, {"status": "error", "error": {"type": "InvalidJob", "message": str(e)}})
+                return
+            result = service.runJob(job)
+            self.sendJson(200 if result["status"] == "ok" else 422, result)
+
+        def log_message(self, format, *args):
+            # Unix socket clients have no address
+            logging.debug(f"Service request: {format % args}")
+
+    return ServiceHandler
+
+def stopServing(signal_number, frame):
+    raise KeyboardInterrupt
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+def serve(service:PortraitService, socket_path:Path=None, port:int=8470):
+    """Serves jobs until interrupted or terminated, on a Unix socket or a port on localhost only
+
+    Args:
+        service (PortraitService): The service that runs the jobs
+        socket_path (Path, optional): The Unix socket to listen on. Defaults to None, which listens on the port
+        port (int, optional): The localhost port to listen on. Defaults to 8470
+    """
+    handler = createHandler(service, check_host=socket_path is None)
+    if socket_path is not None:
+        socket_path = Path(socket_path)
+        if socket_path.is_socket():
+            # Left behind by a service that didn't shut down cleanly
+            socket_path.unlink()
+        server = UnixHTTPServer(str(socket_path), handler)
+        address = f"unix socket '{socket_path}'"
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        address = f"http://127.0.0.1:{server.server_address[1]}"
+
+    service.warm()
+    signal.signal(signal.SIGTERM, stopServing)
+    logging.info(f"Serving jobs on {address}, press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stopping the service")
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path is not None:
+            socket_path.unlink(missing_ok=True)
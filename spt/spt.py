@@ -1,109 +1,1048 @@
-import sys
+from __future__ import annotations
+
+import collections
+import contextlib
+import os
+import threading
+import time
+import typing
 import logging
 from pathlib import Path
-import subprocess
-from extensions import image, config
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from extensions import errors, index, metrics, output, plan, prescan, resize, schedule, shard, verify
+
+# The image and config subsystems are imported inside the stages that use them, so a run only loads what it needs.
+# They're only imported here for the annotations
+if typing.TYPE_CHECKING:
+    from extensions import config, encoders, image, manifest
 
 class StellarisPortraitTool:
-    def __init__(self, source_folder="source", output_folder="output", conflict_resolution_method:str="stop", config_prefix:str="", species_archetype:str="BIOLOGICAL"):
-        self.source_folder = Path(source_folder)
+    def __init__(self, source_folder="source", output_folder="output", conflict_resolution_method:str="stop", config_prefix:str="", species_archetype:str="BIOLOGICAL", jobs:int=None, full_rebuild:bool=False, batch_size:int=1, encoder:str="magick", compression:str="dxt5", dedupe:str="link", crop_settings:resize.CropSettings=None, output_archive:bool=False, shard:tuple=None, timeout:float=None, retries:int=1, straggler_seconds:float=30.0, memory_budget:schedule.MemoryBudget=None, verify:bool=False, merge_configs:bool=False, executor:ThreadPoolExecutor=None, png_index:prescan.PngIndex=None, checked_encoder:encoders.Encoder=None, run_metrics:metrics.Metrics=None):
+        # Merging shards only reads their manifests, so it doesn't need a source folder
+        self.source_folder = Path(source_folder) if source_folder is not None else None
         self.output_folder = Path(output_folder)
         self.conflict_resolution_method = conflict_resolution_method
         self.accepted_image_extensions = [".png"]
         self.config_prefix = config_prefix
         self.species_archetype = species_archetype
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.full_rebuild = full_rebuild
+        self.batch_size = max(1, batch_size)
+        self.encoder_name = encoder
+        # An encoder another run already checked, such as the service's, isn't probed again
+        self.encoder = checked_encoder
+        self.compression = compression
+        self.dedupe = dedupe
+        self.crop_settings = crop_settings
+        self.output_archive = output_archive
+        self.shard = shard
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.straggler_seconds = straggler_seconds
+        # May be shared with other runs, such as every job of the service
+        self.memory_budget = memory_budget
+        self.verify = verify
+        self.merge_configs = merge_configs
+        self.dependencies_available = True if checked_encoder is not None else None
+        self.file_index = index.FileIndex()
+        # A pool and header index shared with other runs, such as the service's, stay warm between runs
+        self.executor = executor
+        self.png_index = png_index or prescan.PngIndex()
+        self.failed_files = [
+            # Example
+            # (Path("source/gfx/models/portraits/tau/tau_pop_00.png"), "The file is only 0 bytes, too small to be a PNG")
+        ]
+        # When each batch still converting started, so stragglers can be reported
+        self.running_batches = {
+            # Example
+            # (Path("source/gfx/models/portraits/tau/tau_pop_00.png"),): 1520.31
+        }
+        self.running_lock = threading.Lock()
+        self.build_manifest = None
+        # The configs rendered by the plan that runs first, kept until they are written
+        self.rendered_configs = None
+        self.metrics = run_metrics or metrics.NullMetrics()
 
-        if not self.checkDependencies():
-            sys.exit(1)
-        if not self.checkPaths():
-            sys.exit(1)
+        self.checkPaths()
+        self.output = output.createOutput(root=self.output_folder, file_index=self.file_index, archive=output_archive)
 
-    @staticmethod
-    def checkDependencies():
-        """Checks if all dependencies for the SPT to run are available
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Failed conversions are only raised once every other stage has finished, so an archive keeps the images that
+        # did convert, as an output folder does
+        self.close(completed=exc_type is None or issubclass(exc_type, errors.ConversionError))
+
+    def close(self, completed:bool=True):
+        """Finishes the output. An archive is only moved into place when the run completed
+
+        Args:
+            completed (bool, optional): Whether every stage of the run finished. Defaults to True
+        """
+        self.output.close(completed=completed)
+
+    def loadEncoder(self) -> encoders.Encoder:
+        """Creates the encoder the first time it is needed, without checking that it can run
+
+        Returns:
+            encoders.Encoder: The encoder
+        """
+        if self.encoder is None:
+            from extensions import encoders
+
+            self.encoder = encoders.getEncoder(self.encoder_name, crop_settings=self.crop_settings, compression=self.compression, png_index=self.png_index, timeout=self.timeout)
+        return self.encoder
+
+    def checkDependencies(self):
+        """Checks if all dependencies for converting images are available. The encoder is only probed the first time this
+        is called, so runs that only generate configs or plan never probe it
 
         Returns:
             (bool): Whether all dependencies are available
         """
-        try:
-            command = ["magick", "--version"]
-            result = subprocess.run(command, check=True, text=True, capture_output=True)
-            logging.debug(result)
-        except Exception as e:
-            logging.error(f"Missing ImageMagick dependency: {e}")
-            logging.error(f"Please install ImageMagick to your system path: https://imagemagick.org/")
-            return False
-        return True
+        if self.dependencies_available is None:
+            encoder = self.loadEncoder()
+            with self.metrics.phase("check_dependencies"):
+                self.dependencies_available = encoder.checkAvailable() and encoder.checkCompressionAvailable()
+        return self.dependencies_available
     
     def checkPaths(self):
-        """Checks if provided paths are valid
+        """Checks if provided paths are valid, creating the output folder if needed
 
-        Returns:
-            (bool): Whether all required paths are valid
+        Raises:
+            errors.PathError: When the source folder doesn't exist, or the output can't be created
         """
         # Source folder check
-        valid_source = (
+        valid_source = self.source_folder is None or (
             self.source_folder.exists() 
             and 
             self.source_folder.is_dir()
         )
         if not valid_source:
-            logging.error(f"'{self.source_folder}' source folder either does not exist, or is not a directory")
-            return False
+            raise errors.PathError(f"'{self.source_folder}' source folder either does not exist, or is not a directory")
         
         # Output folder check
-        self.output_folder.mkdir(parents=True, exist_ok=True)
-        return True
+        if self.output_archive:
+            if self.output_folder.is_dir():
+                raise errors.PathError(f"'{self.output_folder}' is a folder, so it can't be replaced by the output archive")
+            return
+        try:
+            self.output_folder.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise errors.PathError(f"Unable to create the output folder '{self.output_folder}': {e}")
+
+    def loadManifest(self) -> manifest.Manifest:
+        """Loads the output manifest the first time it is needed, so every stage of the run shares one copy
+
+        Returns:
+            manifest.Manifest: The output manifest
+        """
+        from extensions import manifest
+
+        if self.build_manifest is None:
+            self.build_manifest = manifest.Manifest(output_folder=self.output_folder, persist=not self.output_archive)
+            if self.full_rebuild:
+                self.build_manifest.images = {}
+        return self.build_manifest
     
-    def bulkConvertImages(self):
-        """Bulk convert all images in the source location to the destination location in the required Stellaris format
+    def planConversions(self, changed_files:set=None) -> plan.ConversionPlan:
+        """Works out which sources need converting from a single scan of the source and output folders, without running
+        the encoder or changing the output. Every conflict is collected, whatever the conflict resolution method
+
+        With self.verify, every up to date output is checked too, and the sources of invalid outputs are queued again
+
+        Args:
+            changed_files (set, optional): Only check these source files, and plan to remove the outputs of any that no
+                longer exist. Defaults to None, which checks every source file and every deleted source
+
+        Returns:
+            plan.ConversionPlan: The conversions, conflicts and removals
         """
         new_image_extension = ".dds"
-        
-        for file in self.source_folder.rglob('*'):
-            relative_path = file.relative_to(self.source_folder)
-            new_path = self.output_folder / relative_path
-            new_file = new_path.with_suffix(new_image_extension)
+        conversion_plan = plan.ConversionPlan(settings=self.loadEncoder().settings())
+        source_tree = self.file_index.tree(self.source_folder, stat_files=True)
+        output_tree = self.file_index.tree(self.output_folder)
+        build_manifest = self.loadManifest()
 
-            if not file.is_file():
-                new_path.mkdir(parents=True, exist_ok=True)
-                continue
+        with self.metrics.phase("directory_walk"):
+            source_tree.ensureScanned()
+            output_tree.ensureScanned()
+
+        if changed_files is None:
+            source_files = source_tree.files()
+            conversion_plan.output_dirs = [self.output_folder / relative_dir for relative_dir, _, _ in source_tree.walk()]
+        else:
+            source_files = sorted(file for file in changed_files if source_tree.isFile(file))
+            conversion_plan.output_dirs = sorted({(self.output_folder / file.relative_to(self.source_folder)).parent for file in source_files})
+
+        # (position, file, new_file, source_digest) for each up to date output, checked when self.verify is set
+        unchanged_images = []
+        for file in source_files:
+            relative_path = file.relative_to(self.source_folder)
+            new_file = (self.output_folder / relative_path).with_suffix(new_image_extension)
 
             file_extension= file.suffix.lower()
             if not file_extension in self.accepted_image_extensions:
                 logging.debug(f"Skipping file '{file}' as not accepted")
                 continue
 
-            if new_file.is_file():
-                match self.conflict_resolution_method:
-                    case "stop":
-                        logging.error(f"File conflict: '{file}' already exists, stopping execution. Check --help if you'd like files to be overrode")
-                        sys.exit(1)
-                    case "skip":
-                        logging.debug(f"File conflict: '{file}' already exists, skipping")
-                        continue
-
-            logging.info(f"Converting '{file}' to '{new_file}'")
-            
-            image_object = image.Image(
-                image_file = file
+            relative_source = relative_path.as_posix()
+            if self.shard is not None and shard.shardOf(relative_source, self.shard[1]) != self.shard[0]:
+                continue
+            source_stat = conversion_plan.source_stats[relative_source] = source_tree.stat(file)
+            output_exists = output_tree.isFile(new_file)
+            up_to_date, source_digest = build_manifest.checkImage(
+                relative_source=relative_source,
+                source_file=file,
+                source_stat=source_stat,
+                output_exists=output_exists,
+                settings=conversion_plan.settings
             )
+            if up_to_date:
+                logging.debug(f"'{file}' is unchanged since the last build, skipping")
+                conversion_plan.up_to_date_count += 1
+                if self.verify:
+                    # Where the source would be queued if its output turns out to be invalid
+                    unchanged_images.append((len(conversion_plan.queued_images), file, new_file, source_digest))
+                continue
+
+            # Outputs tracked by the manifest belong to this tool, so only untracked files are conflicts
+            if output_exists and not build_manifest.isTracked(relative_source):
+                conversion_plan.conflicts.append(new_file)
+                if self.conflict_resolution_method != "replace":
+                    logging.debug(f"File conflict: '{file}' already exists, skipping")
+                    continue
+
+            conversion_plan.queued_images.append((file, new_file, source_digest))
+
+        if unchanged_images:
+            dds_headers = self.verifyOutputs([(file, new_file) for _, file, new_file, _ in unchanged_images])
+            # Inserted from the last to the first, so every earlier position still points at the same place
+            for (position, file, new_file, source_digest), dds_header in reversed(list(zip(unchanged_images, dds_headers))):
+                if dds_header.valid:
+                    continue
+                logging.warning(f"'{new_file}' is invalid, converting '{file}' again: {dds_header.error}")
+                conversion_plan.up_to_date_count -= 1
+                conversion_plan.queued_images.insert(position, (file, new_file, source_digest))
 
-            image_object.formatToDds(
-                new_file = new_file
+        if changed_files is None:
+            removed_sources = set(build_manifest.images) - set(conversion_plan.source_stats)
+        else:
+            removed_sources = {
+                file.relative_to(self.source_folder).as_posix()
+                for file in changed_files
+                if not source_tree.isFile(file)
+            }
+        conversion_plan.removed_sources = sorted(removed_sources & set(build_manifest.images))
+        return conversion_plan
+
+    def bulkConvertImages(self, pipeline:config.PortraitPipeline=None, changed_files:set=None, conversion_plan:plan.ConversionPlan=None):
+        """Bulk convert all images in the source location to the destination location in the required Stellaris format
+
+        Conversions run on a pool of self.jobs worker threads. Results are reported in source order once each file finishes.
+        Sources recorded in the output manifest are only converted again when their content or the encoder settings change.
+        With a batch size above 1, images that share an output folder are sent to the encoder in groups of self.batch_size.
+        Unless self.dedupe is "off", byte-identical sources are encoded once and the other copies linked or copied from it.
+        Every queued source's PNG header is read first, so invalid files are rejected before any conversion starts and the
+        largest images are started first. With a memory budget, each batch waits until its estimated memory fits in the
+        budget before it starts
+
+        Args:
+            pipeline (config.PortraitPipeline, optional): Told about every queued and finished conversion, so portrait
+                group configs can be written while other images are still converting. Defaults to None
+            changed_files (set, optional): Only check these source files, and remove the outputs of any that no longer
+                exist. Defaults to None, which checks every source file and removes the outputs of every deleted source
+            conversion_plan (plan.ConversionPlan, optional): Already planned conversions, for changed_files. Defaults to
+                None, which plans them first
+
+        Raises:
+            errors.DependencyError: When the encoder can't run
+            errors.FileConflictError: When the conflict resolution method is "stop" and any output would replace a file
+                this tool didn't write. Nothing is converted or removed
+        """
+        if not self.checkDependencies():
+            raise errors.DependencyError(f"Missing dependencies for the '{self.encoder_name}' encoder")
+
+        conversion_plan = conversion_plan or self.planConversions(changed_files=changed_files)
+        if self.conflict_resolution_method == "stop" and conversion_plan.conflicts:
+            raise plan.conflictError(conversion_plan.conflicts)
+
+        encoder_settings = conversion_plan.settings
+        source_stats = conversion_plan.source_stats
+        output_tree = self.file_index.tree(self.output_folder)
+        build_manifest = self.loadManifest()
+        compression_counts = collections.Counter()
+        bytes_saved = 0
+        duplicate_count = 0
+        seconds_saved = 0.0
+        futures = []
+        pending_batches = {}
+
+        for output_dir in conversion_plan.output_dirs:
+            self.output.stagingPath(output_dir).mkdir(parents=True, exist_ok=True)
+
+        with self.metrics.phase("convert_images"), self.workerPool() as executor:
+            valid_images = self.prescanImages(conversion_plan.queued_images, build_manifest)
+            if pipeline is not None:
+                for _, new_file, _ in valid_images:
+                    pipeline.expect(new_file)
+            # Removed before the group keys are checked, so a renamed folder doesn't collide with its old name
+            for removed_file in build_manifest.removeImages(relative_sources=set(conversion_plan.removed_sources)):
+                output_tree.removeFile(removed_file)
+                logging.info(f"Removed '{removed_file}' as its source no longer exists")
+            if pipeline is not None:
+                pipeline.checkGroupKeys()
+
+            unique_images = self.groupDuplicateImages(valid_images, executor)
+            # Larger images take longer to encode, so starting them first keeps one slow image from finishing last
+            work_order = sorted(
+                range(len(unique_images)),
+                key=lambda position: self.png_index.get(unique_images[position][0]).pixel_count,
+                reverse=True
             )
+            for position in work_order:
+                new_file = unique_images[position][1]
+                batch = pending_batches.setdefault(new_file.parent, [])
+                batch.append(position)
+                if len(batch) >= self.batch_size:
+                    futures.append(self.submitBatch(executor, unique_images, pending_batches.pop(new_file.parent)))
+            for batch in pending_batches.values():
+                futures.append(self.submitBatch(executor, unique_images, batch))
+            # Results are still reported in source order
+            futures.sort(key=lambda batch_future: batch_future[0])
 
-    def bulkGenerateConfigs(self):
-        """Bulk generate configs for Stellaris portraits based off converted image files
+            if pipeline is not None:
+                pipeline.plan()
+
+            for _, future in futures:
+                for conversion_result in self.waitForBatch(future):
+                    if conversion_result.success:
+                        try:
+                            self.output.commit(conversion_result.staged_file, conversion_result.new_file)
+                        except OSError as e:
+                            conversion_result.error = str(e)
+                    self.reportConversion(conversion_result)
+
+                    relative_source = conversion_result.image_file.relative_to(self.source_folder).as_posix()
+                    if self.metrics.enabled:
+                        self.recordConversionMetrics(conversion_result, source_stats[relative_source])
+                    if conversion_result.success:
+                        build_manifest.recordImage(
+                            relative_source=relative_source,
+                            source_stat=source_stats[relative_source],
+                            new_file=conversion_result.new_file,
+                            source_digest=conversion_result.source_digest,
+                            settings=encoder_settings
+                        )
+                        output_tree.addFile(conversion_result.new_file)
+                        compression_counts[conversion_result.compression] += 1
+                        if conversion_result.compression == "dxt1":
+                            bytes_saved += self.dxt1Savings(conversion_result.new_file)
+                        if conversion_result.duplicate_of is not None:
+                            duplicate_count += 1
+                            seconds_saved += conversion_result.seconds_saved
+                    else:
+                        build_manifest.forgetImage(relative_source)
+                        # The old output was removed before converting, so configs mustn't reference it
+                        output_tree.removeFile(conversion_result.new_file)
+                        self.failed_files.append((conversion_result.image_file, conversion_result.error))
+                        self.discardRenderedConfigs()
+
+                    if pipeline is not None:
+                        pipeline.finish(conversion_result.new_file)
+
+        build_manifest.save()
+        self.reportCompression(compression_counts, bytes_saved)
+        if duplicate_count:
+            logging.info(f"Reused {duplicate_count} outputs of identical sources instead of encoding them, saving about {seconds_saved:.2f}s of encoder time")
+
+        if self.shard is not None:
+            self.writeShardManifest(settings=encoder_settings)
+
+    def shardManifestPath(self, shard_number:int, shard_count:int) -> Path:
+        filename = shard.ShardManifest.filename(shard_number, shard_count)
+        if self.output_archive:
+            # Kept next to the archive, so it can be read without opening the archive
+            return self.output_folder.with_name(f"{self.output_folder.name}{filename}")
+        return self.output_folder / filename
+
+    def writeShardManifest(self, settings:dict):
+        """Writes the partial manifest of this shard, listing every DDS file in its output
+
+        Args:
+            settings (dict): The encoder settings the shard converted images with
+        """
+        output_tree = self.file_index.tree(self.output_folder)
+        shard_manifest = shard.ShardManifest(
+            shard_number=self.shard[0],
+            shard_count=self.shard[1],
+            settings=settings,
+            portraits=[output_tree.relative(file) for file in output_tree.files(suffix=".dds")]
+        )
+        manifest_path = self.shardManifestPath(*self.shard)
+        shard_manifest.save(manifest_path)
+        logging.info(f"Wrote the manifest of shard {self.shard[0]}/{self.shard[1]} to '{manifest_path}'")
+
+    def mergeShards(self, shard_manifest_paths:list[Path]):
+        """Generates every config from the partial manifests of a sharded build, without scanning any images. The DDS
+        files each shard converted are expected to be copied into the output alongside the configs
+
+        Args:
+            shard_manifest_paths (list[Path]): The partial manifest of every shard
+        """
+        from extensions import config
+
+        try:
+            shard_manifests = [shard.ShardManifest.load(manifest_path) for manifest_path in shard_manifest_paths]
+            portrait_files = shard.mergeShardManifests(shard_manifests)
+        except ValueError as e:
+            raise errors.ShardError(f"Unable to merge shards: {e}")
+        logging.info(f"Merging {len(portrait_files)} DDS files from {len(shard_manifests)} shards")
+        dds_files = [self.output_folder / portrait_file for portrait_file in portrait_files]
+
+        self.planFirst(generate_configs=True, skip_image_convert=True, dds_files=dds_files)
+        try:
+            portraits = config.Portraits(**self.createConfigParams())
+            portraits.writeGroups(portraits.generateGroups(files=dds_files))
+            self.generateSharedConfigs(portrait_groups=list(portraits.config_store))
+        finally:
+            self.rendered_configs = None
+
+    def prescanImages(self, queued_images:list[tuple], build_manifest:manifest.Manifest) -> list[tuple]:
+        """Reads the PNG header and chunk table of every queued source, without decoding any pixels. Invalid files, and
+        files the encoder can't read, are reported and dropped, so they fail before any conversion starts rather than
+        partway through the run
+
+        Args:
+            queued_images (list[tuple]): (file, new_file, source_digest) for each image to convert
+            build_manifest (manifest.Manifest): The output manifest, which forgets every rejected source
+
+        Returns:
+            list[tuple]: The queued images with a valid PNG header, in queue order
+        """
+        with self.metrics.phase("prescan"):
+            png_headers = self.png_index.scan(
+                image_files=[file for file, _, _ in queued_images],
+                file_stats=[self.file_index.tree(self.source_folder).stat(file) for file, _, _ in queued_images]
+            )
+
+        encoder = self.loadEncoder()
+        valid_images = []
+        for queued_image, png_header in zip(queued_images, png_headers):
+            file = queued_image[0]
+            header_error = encoder.checkHeader(png_header)
+            if header_error is None:
+                valid_images.append(queued_image)
+                continue
+            logging.error(f"Unable to convert '{file}' to 'dds': {header_error}")
+            build_manifest.forgetImage(file.relative_to(self.source_folder).as_posix())
+            self.failed_files.append((file, header_error))
+            self.metrics.recordFile(file=file, seconds=0.0, failed=True, bytes_read=png_header.size)
+        return valid_images
+
+    def workerPool(self):
+        """Returns the shared worker pool if there is one, or a new pool of self.jobs workers that is shut down after use
+
+        Returns:
+            contextlib.AbstractContextManager: Yields the ThreadPoolExecutor
+        """
+        if self.executor is not None:
+            return contextlib.nullcontext(self.executor)
+        return ThreadPoolExecutor(max_workers=self.jobs)
+
+    def submitBatch(self, executor:ThreadPoolExecutor, unique_images:list[tuple], batch:list[int]) -> tuple:
+        """Submits a batch of unique images to the worker pool
+
+        Args:
+            executor (ThreadPoolExecutor): The worker pool
+            unique_images (list[tuple]): The images returned by groupDuplicateImages
+            batch (list[int]): The positions of the batch's images in unique_images
+
+        Returns:
+            tuple: The first position in the batch, used to report results in source order, and the batch's future
+        """
+        batch = sorted(batch)
+        return batch[0], executor.submit(self.convertTrackedImages, [unique_images[position] for position in batch])
+
+    def waitForBatch(self, future) -> list[image.ConversionResult]:
+        """Waits for a batch to finish converting, reporting every conversion that has been running for longer than
+        self.straggler_seconds while it waits. A straggler_seconds of 0 or None waits quietly
+
+        Args:
+            future (concurrent.futures.Future): The batch's future, as returned by submitBatch
+
+        Returns:
+            list[image.ConversionResult]: The batch's results
+        """
+        while True:
+            try:
+                return future.result(timeout=self.straggler_seconds or None)
+            except TimeoutError:
+                self.reportStragglers()
+
+    def reportStragglers(self):
+        now = time.perf_counter()
+        with self.running_lock:
+            running_batches = list(self.running_batches.items())
+        for files, started in sorted(running_batches, key=lambda item: item[1]):
+            elapsed = now - started
+            if elapsed >= self.straggler_seconds:
+                batch_text = f" and {len(files) - 1} more in its batch" if len(files) > 1 else ""
+                logging.warning(f"Still converting '{files[0]}'{batch_text} after {elapsed:.1f}s")
+
+    def groupDuplicateImages(self, queued_images:list[tuple], executor:ThreadPoolExecutor) -> list[tuple]:
+        """Hashes the queued sources that haven't been hashed yet on the worker pool, then groups byte-identical sources so
+        each is only encoded once. Nothing is grouped when self.dedupe is "off"
+
+        Args:
+            queued_images (list[tuple]): (file, new_file, source_digest) for each image to convert, where source_digest
+                may be None if not yet calculated
+            executor (ThreadPoolExecutor): The worker pool
+
+        Returns:
+            list[tuple]: (file, new_file, source_digest, duplicates) for each unique source in queue order, where duplicates
+                holds (file, new_file) for every other source with the same content
+        """
+        from extensions import manifest
+
+        unhashed_files = [file for file, _, source_digest in queued_images if source_digest is None]
+        calculated_digests = iter(executor.map(manifest.Manifest.hashFile, unhashed_files))
+
+        unique_images = {}
+        for file, new_file, source_digest in queued_images:
+            if source_digest is None:
+                source_digest = next(calculated_digests)
+            key = file if self.dedupe == "off" else source_digest
+            if key in unique_images:
+                unique_images[key][3].append((file, new_file))
+            else:
+                unique_images[key] = (file, new_file, source_digest, [])
+        return list(unique_images.values())
+
+    def convertTrackedImages(self, batch:list[tuple]) -> list[image.ConversionResult]:
+        """Converts a batch of unique images that share an output folder, then creates the outputs of their duplicates
+        from the converted files. With self.verify, each converted file is checked before anything is copied from it.
+        Runs inside a worker thread
+
+        Args:
+            batch (list[tuple]): (file, new_file, source_digest, duplicates) for each image, as returned by groupDuplicateImages
+
+        Returns:
+            list[image.ConversionResult]: The outcome of each conversion, each followed by the outcomes of its duplicates
         """
-        params = {
+        from extensions import image
+
+        files = tuple(file for file, _, _, _ in batch)
+        # Encoders write to the staging path, which is only different from the output path when writing an archive
+        staged_files = [self.output.stagingPath(new_file) for _, new_file, _, _ in batch]
+
+        if self.memory_budget is not None:
+            # The images of a batch are encoded one after another, so it needs the memory of its largest image
+            estimated_memory = max(self.encoder.estimateMemory(self.png_index.get(file)) for file in files)
+            if estimated_memory > self.memory_budget.budget:
+                logging.debug(f"'{files[0]}' needs about {schedule.formatMemorySize(estimated_memory)}, more than the whole memory budget, so it will convert on its own")
+            reservation = self.memory_budget.reserve(estimated_memory)
+        else:
+            reservation = contextlib.nullcontext()
+
+        with reservation as memory_limit:
+            with self.running_lock:
+                self.running_batches[files] = time.perf_counter()
+            try:
+                if len(batch) > 1 and self.encoder.supports_batch:
+                    conversion_results = image.convertImageBatch(image_files=list(files), new_files=staged_files, encoder=self.encoder, retries=self.retries, memory_limit=memory_limit)
+                else:
+                    conversion_results = [
+                        image.convertImage(image_file=file, new_file=staged_file, encoder=self.encoder, retries=self.retries, memory_limit=memory_limit)
+                        for file, staged_file in zip(files, staged_files)
+                    ]
+            finally:
+                with self.running_lock:
+                    self.running_batches.pop(files, None)
+
+        batch_results = []
+        for conversion_result, (_, new_file, source_digest, duplicates) in zip(conversion_results, batch):
+            if self.verify and conversion_result.success:
+                # Before the duplicates are copied from it, so an invalid file is never copied
+                self.verifyConversion(conversion_result)
+            conversion_result.new_file = new_file
+            conversion_result.source_digest = source_digest
+            batch_results.append(conversion_result)
+            for duplicate_file, duplicate_new_file in duplicates:
+                duplicate_result = image.copyConversion(
+                    conversion_result=conversion_result,
+                    image_file=duplicate_file,
+                    new_file=self.output.stagingPath(duplicate_new_file),
+                    link=self.dedupe == "link"
+                )
+                duplicate_result.new_file = duplicate_new_file
+                batch_results.append(duplicate_result)
+        return batch_results
+
+    def expectedDdsSize(self, file:Path) -> tuple[int, int]:
+        """The width and height a source's DDS file should have, from the crop settings or the source's indexed PNG header
+
+        Args:
+            file (Path): The source image
+
+        Returns:
+            tuple[int, int]: The width and height, or None when they aren't known, such as for a source that no longer exists
+        """
+        if self.crop_settings is not None:
+            return self.crop_settings.width, self.crop_settings.height
+        png_header = self.png_index.get(file)
+        if png_header is None or not png_header.valid:
+            return None
+        return png_header.width, png_header.height
+
+    def expectedCompressions(self) -> list[str]:
+        if self.compression == "auto":
+            return ["dxt1", "dxt5"]
+        return [self.compression]
+
+    def verifyConversion(self, conversion_result:image.ConversionResult):
+        """Checks a converted file before it is committed to the output. An invalid file is deleted and the conversion
+        marked as failed. Runs inside a worker thread
+
+        Args:
+            conversion_result (image.ConversionResult): The successful conversion, whose staged file is checked
+        """
+        # Encoders report the compression they picked, which is only ever one of the expected compressions
+        compressions = [conversion_result.compression] if conversion_result.compression in verify.FOUR_CC else self.expectedCompressions()
+        dds_header = verify.checkDds(
+            dds_file=conversion_result.staged_file,
+            size=self.expectedDdsSize(conversion_result.image_file),
+            compressions=compressions
+        )
+        if not dds_header.valid:
+            conversion_result.error = f"The converted file is invalid: {dds_header.error}"
+            conversion_result.staged_file.unlink(missing_ok=True)
+
+    def verifyOutputs(self, outputs:list[tuple]) -> list[verify.DdsHeader]:
+        """Checks DDS files in the output folder on the worker pool, reading only their headers and the headers of their
+        sources. Each worker checks a chunk of files, as a single check takes less time than handing it to a worker
+
+        Args:
+            outputs (list[tuple]): (file, new_file) for each source and its DDS file
+
+        Returns:
+            list[verify.DdsHeader]: The header of each DDS file, in the order provided, with error set when it is invalid
+        """
+        chunk_size = min(256, len(outputs) // self.jobs + 1)
+        chunks = [outputs[start:start + chunk_size] for start in range(0, len(outputs), chunk_size)]
+        with self.metrics.phase("verify"), self.workerPool() as executor:
+            return [
+                dds_header
+                for chunk_headers in executor.map(self.verifyOutputChunk, chunks)
+                for dds_header in chunk_headers
+            ]
+
+    def verifyOutputChunk(self, outputs:list[tuple]) -> list[verify.DdsHeader]:
+        """Checks a chunk of DDS files against their sources. Runs inside a worker thread
+
+        Args:
+            outputs (list[tuple]): (file, new_file) for each source and its DDS file
+
+        Returns:
+            list[verify.DdsHeader]: The header of each DDS file, in the order provided
+        """
+        if self.crop_settings is None:
+            # Read again whatever is already indexed, as the source may have changed since. Missing sources are invalid,
+            # so their outputs are checked without dimensions
+            self.png_index.scan(image_files=[file for file, _ in outputs])
+        compressions = self.expectedCompressions()
+        return [
+            verify.checkDds(dds_file=new_file, size=self.expectedDdsSize(file), compressions=compressions)
+            for file, new_file in outputs
+        ]
+
+    def verifyTrackedOutputs(self):
+        """Checks every output recorded in the manifest, for runs that don't convert images. Invalid and missing outputs
+        are reported as failures and left out of the configs. The manifest is unchanged, so a run with --verify that
+        converts images converts them again
+        """
+        build_manifest = self.loadManifest()
+        output_tree = self.file_index.tree(self.output_folder)
+        tracked_sources = sorted(build_manifest.images)
+        outputs = [
+            (self.source_folder / relative_source, self.output_folder / build_manifest.images[relative_source]["output"])
+            for relative_source in tracked_sources
+        ]
+        dds_headers = self.verifyOutputs(outputs)
+
+        invalid_count = 0
+        for (file, new_file), dds_header in zip(outputs, dds_headers):
+            if dds_header.valid:
+                continue
+            invalid_count += 1
+            logging.error(f"'{new_file}' is invalid, so it is left out of the configs: {dds_header.error}")
+            output_tree.removeFile(new_file)
+            self.failed_files.append((file, f"The converted file is invalid: {dds_header.error}"))
+            self.discardRenderedConfigs()
+        logging.info(f"Verified {len(outputs)} DDS files, {invalid_count} invalid")
+
+    def dxt1Savings(self, new_file:Path) -> int:
+        """How many bytes a DXT1 output saves over the same image compressed as DXT5. DXT5 blocks are twice the size of DXT1
+        blocks at every mipmap level, so the saving is the whole payload after the 128 byte header
+
+        Args:
+            new_file (Path): The DXT1 compressed DDS file
+
+        Returns:
+            int: The bytes saved
+        """
+        try:
+            return max(0, self.output.fileSize(new_file) - 128)
+        except OSError:
+            return 0
+
+    def reportCompression(self, compression_counts:collections.Counter, bytes_saved:int):
+        """Logs how many converted images used each compression, and the bytes saved by DXT1
+
+        Args:
+            compression_counts (collections.Counter): The number of converted images per compression
+            bytes_saved (int): The bytes saved over compressing every image as DXT5
+        """
+        if self.compression == "dxt5" or not compression_counts:
+            return
+        counts = ", ".join(
+            f"{count} as {(compression or 'unknown').upper()}"
+            for compression, count in sorted(compression_counts.items(), key=lambda item: item[0] or "")
+        )
+        logging.info(f"Compressed {counts}, saving {bytes_saved / (1024 * 1024):.2f} MiB ({bytes_saved} bytes) compared to DXT5")
+
+    def recordConversionMetrics(self, conversion_result:image.ConversionResult, source_stat:os.stat_result):
+        """Adds a finished conversion to the run metrics
+
+        Args:
+            conversion_result (image.ConversionResult): The result returned by a conversion worker
+            source_stat (os.stat_result): The stat of the source image
+        """
+        bytes_written = 0
+        if conversion_result.success:
+            try:
+                bytes_written = self.output.fileSize(conversion_result.new_file)
+            except OSError:
+                pass
+        self.metrics.addPhase("format_to_dds", conversion_result.seconds)
+        self.metrics.recordFile(
+            file=conversion_result.image_file,
+            seconds=conversion_result.seconds,
+            failed=not conversion_result.success,
+            bytes_read=source_stat.st_size,
+            bytes_written=bytes_written
+        )
+
+    @staticmethod
+    def reportConversion(conversion_result:image.ConversionResult):
+        """Logs the outcome of a single image conversion
+
+        Args:
+            conversion_result (image.ConversionResult): The result returned by a conversion worker
+        """
+        if conversion_result.duplicate_of is not None:
+            logging.info(f"Copying '{conversion_result.image_file}' to '{conversion_result.new_file}', as it is identical to '{conversion_result.duplicate_of}'")
+        else:
+            logging.info(f"Converting '{conversion_result.image_file}' to '{conversion_result.new_file}'")
+        if not conversion_result.success:
+            logging.error(f"Unable to convert '{conversion_result.image_file}' to 'dds': {conversion_result.error}")
+        elif conversion_result.attempts > 1:
+            logging.info(f"Converted '{conversion_result.image_file}' after {conversion_result.attempts} attempts")
+
+    def reportFailures(self):
+        """Logs every image that failed to convert during the run
+
+        Raises:
+            errors.ConversionError: When any image failed to convert
+        """
+        if not self.failed_files:
+            return
+        logging.error("These images failed to convert, so their portraits are missing from the output:")
+        for file, error in self.failed_files:
+            logging.error(f"  '{file}': {error}")
+        raise errors.ConversionError(f"{len(self.failed_files)} images failed to convert")
+
+    def createConfigParams(self) -> dict:
+        return {
             "source_path": self.output_folder,
             "mod_prefix": self.config_prefix,
             "conflict_resolution_method": self.conflict_resolution_method,
-            "species_archetype": self.species_archetype
+            "species_archetype": self.species_archetype,
+            "file_index": self.file_index,
+            "run_metrics": self.metrics,
+            "build_manifest": self.loadManifest(),
+            "run_output": self.output,
+            "merge_configs": self.merge_configs,
+            "rendered_configs": self.rendered_configs
         }
-        config.Portraits(**params).generate()
-        config.PortraitSets(**params).generate()
-        config.SpeciesClass(**params).generate()
-        config.SpeciesNames(**params).generate()
-        config.PortraitCategories(**params).generate()
\ No newline at end of file
+
+    def plan(self, generate_configs:bool=False, skip_image_convert:bool=False, dds_files:list[Path]=None) -> plan.BuildPlan:
+        """Works out everything a run would do from a single scan of the source and output folders, without running the
+        encoder or changing the output. Only the PNG headers of the images to convert are read, and the configs are
+        rendered in memory from the DDS files the run would leave behind
+
+        Args:
+            generate_configs (bool, optional): Whether to plan the configs. Defaults to False
+            skip_image_convert (bool, optional): Plan no conversions. Defaults to False
+            dds_files (list[Path], optional): With skip_image_convert, the DDS files to build the configs from, grouped
+                by folder, such as the files listed by shard manifests. Defaults to None, which uses the DDS files already
+                in the output, or the files the conversions would leave behind
+
+        Returns:
+            plan.BuildPlan: The conversions, configs and conflicts of the run
+        """
+        from extensions import config
+
+        conversion_plan = None
+        png_headers = []
+        header_errors = []
+        if not skip_image_convert:
+            conversion_plan = self.planConversions()
+            queued_files = [file for file, _, _ in conversion_plan.queued_images]
+            with self.metrics.phase("prescan"):
+                png_headers = self.png_index.scan(
+                    image_files=queued_files,
+                    file_stats=[self.file_index.tree(self.source_folder).stat(file) for file in queued_files]
+                )
+            header_errors = [self.loadEncoder().checkHeader(png_header) for png_header in png_headers]
+            removed_outputs = {
+                self.output_folder / self.loadManifest().images[relative_source]["output"]
+                for relative_source in conversion_plan.removed_sources
+            }
+            new_files = {
+                new_file
+                for (_, new_file, _), header_error in zip(conversion_plan.queued_images, header_errors)
+                if header_error is None
+            }
+            # Files directly in a folder come before its subfolders, matching index.TreeIndex.files
+            existing_files = set(self.file_index.tree(self.output_folder).files(suffix=".dds"))
+            dds_files = sorted((existing_files | new_files) - removed_outputs, key=lambda file: (file.parent.parts, file.name))
+
+        config_plan = []
+        if generate_configs:
+            params = self.createConfigParams()
+            portraits = config.Portraits(**params)
+            config_plan.extend(portraits.planGroups(portraits.generateGroups(files=dds_files)))
+            params["portrait_groups"] = list(portraits.config_store)
+            for config_class in config.SHARED_CONFIGS:
+                shared_configs = config_class(**params)
+                config_plan.extend(shared_configs.planGroups(shared_configs.generateGroups()))
+
+        return plan.BuildPlan(
+            source_folder=self.source_folder,
+            output_folder=self.output_folder,
+            conflict_resolution_method=self.conflict_resolution_method,
+            conversion_plan=conversion_plan,
+            png_headers=png_headers,
+            header_errors=header_errors,
+            config_plan=config_plan
+        )
+
+    def run(self, generate_configs:bool=False, pipeline:bool=False, skip_image_convert:bool=False):
+        """Runs the requested stages, the same way the command line does. When the conflict resolution method is "stop",
+        the run is planned first, so a conflicting image or config stops it before any image is converted. With
+        self.verify, every DDS file is checked before the configs reference it
+
+        Args:
+            generate_configs (bool, optional): Whether to generate configs. Defaults to False
+            pipeline (bool, optional): Write each portrait group config as soon as its images are converted. Defaults to False
+            skip_image_convert (bool, optional): Do not convert any images. Defaults to False
+
+        Raises:
+            errors.FileConflictError: When any output would replace a file this tool didn't write, before anything is written
+            errors.ConversionError: When any image failed to convert or verify, after every other stage has finished
+        """
+        conversion_plan = self.planFirst(generate_configs=generate_configs, skip_image_convert=skip_image_convert)
+        try:
+            if pipeline and generate_configs and not skip_image_convert:
+                self.bulkConvertAndGenerate(conversion_plan=conversion_plan)
+            else:
+                if not skip_image_convert:
+                    self.bulkConvertImages(conversion_plan=conversion_plan)
+                elif self.verify:
+                    self.verifyTrackedOutputs()
+                if generate_configs:
+                    self.bulkGenerateConfigs()
+        finally:
+            self.rendered_configs = None
+        self.reportFailures()
+
+    def planFirst(self, generate_configs:bool, skip_image_convert:bool=False, dds_files:list[Path]=None) -> plan.ConversionPlan:
+        """When the conflict resolution method is "stop", plans the run before anything is converted or written, so a
+        conflicting image or config stops it while the output is still untouched. The configs the plan renders are kept
+        in self.rendered_configs, so they aren't rendered again when written
+
+        Args:
+            generate_configs (bool): Whether the run generates configs
+            skip_image_convert (bool, optional): Whether the run converts no images. Defaults to False
+            dds_files (list[Path], optional): The DDS files to build the configs from, as plan takes them. Defaults to None
+
+        Raises:
+            errors.FileConflictError: When any output would replace a file this tool didn't write
+
+        Returns:
+            plan.ConversionPlan: The planned conversions, or None when nothing was planned or no images are converted
+        """
+        if self.conflict_resolution_method != "stop" or (skip_image_convert and not generate_configs):
+            return None
+        from extensions import config
+
+        self.rendered_configs = config.RenderedConfigs()
+        with self.metrics.phase("plan"):
+            build_plan = self.plan(generate_configs=generate_configs, skip_image_convert=skip_image_convert, dds_files=dds_files)
+        if build_plan.conflicts:
+            self.rendered_configs = None
+            raise plan.conflictError(build_plan.conflicts)
+        return build_plan.conversion_plan
+
+    def discardRenderedConfigs(self):
+        """Drops the configs the plan rendered, once a conversion fails and the configs will no longer match the plan
+        """
+        if self.rendered_configs is not None:
+            self.rendered_configs.clear()
+
+    def bulkGenerateConfigs(self):
+        """Bulk generate configs for Stellaris portraits based off converted image files
+        """
+        from extensions import config
+
+        portraits = config.Portraits(**self.createConfigParams())
+        portraits.generate()
+        self.generateSharedConfigs(portrait_groups=list(portraits.config_store))
+
+    def bulkConvertAndGenerate(self, conversion_plan:plan.ConversionPlan=None):
+        """Converts images and generates configs in a single pass. Each portrait group's config is written as soon as the
+        last of its images is converted, and the shared configs are built from the groups in memory
+
+        Args:
+            conversion_plan (plan.ConversionPlan, optional): Already planned conversions. Defaults to None, which plans them first
+        """
+        from extensions import config
+
+        portraits = config.Portraits(**self.createConfigParams())
+        pipeline = config.PortraitPipeline(portraits=portraits)
+        self.bulkConvertImages(pipeline=pipeline, conversion_plan=conversion_plan)
+        self.generateSharedConfigs(portrait_groups=pipeline.close())
+
+    def watch(self, generate_configs:bool=False, debounce:float=0.2, poll_interval:float=0.5):
+        """Converts every image, then keeps running and brings the outputs up to date whenever source files change, until
+        interrupted. Only changed images are converted again, and with generate_configs only the affected portrait group
+        configs are rewritten, plus the portrait set when groups are added or removed
+
+        Args:
+            generate_configs (bool, optional): Whether to generate and update configs. Defaults to False
+            debounce (float, optional): Seconds without changes that end a burst of changes. Defaults to 0.2
+            poll_interval (float, optional): Seconds between scans when inotify is not available. Defaults to 0.5
+        """
+        from extensions import watch
+
+        # The watcher starts before the first run, so nothing saved during it is missed
+        watcher = watch.createWatcher(root=self.source_folder, poll_interval=poll_interval)
+        try:
+            conversion_plan = self.planFirst(generate_configs=generate_configs)
+            try:
+                if generate_configs:
+                    self.bulkConvertAndGenerate(conversion_plan=conversion_plan)
+                else:
+                    self.bulkConvertImages(conversion_plan=conversion_plan)
+            finally:
+                self.rendered_configs = None
+            portrait_groups = self.listPortraitGroups() if generate_configs else None
+
+            logging.info(f"Watching '{self.source_folder}' for changes, press Ctrl+C to stop")
+            while True:
+                changed_paths = watcher.waitForChanges(debounce=debounce)
+                try:
+                    portrait_groups = self.updateSources(
+                        changed_paths=changed_paths,
+                        generate_configs=generate_configs,
+                        portrait_groups=portrait_groups
+                    )
+                except errors.SptError as e:
+                    # A failed update, such as a file conflict, is reported and the watch carries on
+                    logging.error(e)
+                    logging.error(f"Unable to apply the latest changes, waiting for the next change")
+        except KeyboardInterrupt:
+            logging.info(f"Stopped watching '{self.source_folder}'")
+        finally:
+            watcher.close()
+
+    def updateSources(self, changed_paths:set, generate_configs:bool, portrait_groups:list) -> list:
+        """Converts changed images, removes the outputs of deleted ones and rewrites the configs they affect
+
+        Args:
+            changed_paths (set): The changed files and folders under the source folder
+            generate_configs (bool): Whether to update configs
+            portrait_groups (list): The portrait groups the current portrait set was written with
+
+        Returns:
+            list: The portrait groups after the update, or None when configs are not generated
+        """
+        from extensions import config
+
+        start = time.perf_counter()
+        source_tree = self.file_index.tree(self.source_folder, stat_files=True)
+        changed_files = set()
+        for path in changed_paths:
+            if path.is_dir() or source_tree.relative(path) in source_tree.directories:
+                # Folders that were created, moved or deleted, or the whole tree after lost events
+                changed_files.update(source_tree.files(path))
+                for directory, _, filenames in os.walk(path):
+                    changed_files.update(Path(directory) / filename for filename in filenames)
+            else:
+                changed_files.add(path)
+
+        changed_images = set()
+        for file in changed_files:
+            if file.is_file():
+                source_tree.addFile(file)
+            else:
+                source_tree.removeFile(file)
+            if file.suffix.lower() in self.accepted_image_extensions:
+                changed_images.add(file)
+        if not changed_images:
+            return portrait_groups
+
+        if not generate_configs:
+            self.bulkConvertImages(changed_files=changed_images)
+            logging.info(f"Updated outputs for {len(changed_images)} changed images in {time.perf_counter() - start:.2f}s")
+            return None
+
+        portraits = config.Portraits(**self.createConfigParams())
+        directories = {(self.output_folder / file.relative_to(self.source_folder)).parent for file in changed_images}
+        pipeline = config.PortraitPipeline(portraits=portraits, directories=directories)
+        self.bulkConvertImages(pipeline=pipeline, changed_files=changed_images)
+        pipeline.close()
+        for directory in directories:
+            if directory not in pipeline.written and pipeline.isPortraitDirectory(directory):
+                portraits.removeGroup(directory=directory)
+        portraits.reportConfigCounts()
+
+        updated_groups = portraits.listGroups()
+        if updated_groups != portrait_groups:
+            params = self.createConfigParams()
+            params["portrait_groups"] = updated_groups
+            config.PortraitSets(**params).generate()
+        self.build_manifest.save()
+        logging.info(f"Updated outputs for {len(changed_images)} changed images in {time.perf_counter() - start:.2f}s")
+        return updated_groups
+
+    def listPortraitGroups(self) -> list:
+        from extensions import config
+
+        return config.Portraits(**self.createConfigParams()).listGroups()
+
+    def generateSharedConfigs(self, portrait_groups:list):
+        """Generates the configs shared by every portrait group
+
+        Args:
+            portrait_groups (list): The names of every portrait group
+        """
+        from extensions import config
+
+        params = self.createConfigParams()
+        params["portrait_groups"] = portrait_groups
+        for config_class in config.SHARED_CONFIGS:
+            config_class(**params).generate()
+        self.build_manifest.save()
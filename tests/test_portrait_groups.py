@@ -0,0 +1,59 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "spt"))
+
+from extensions import config, errors
+
+class PortraitGroupTests(unittest.TestCase):
+    def setUp(self):
+        self.work_folder = tempfile.TemporaryDirectory(prefix="spt-portrait-groups-")
+        self.output_folder = Path(self.work_folder.name)
+        self.image_root = self.output_folder / "gfx/models/portraits"
+
+    def tearDown(self):
+        self.work_folder.cleanup()
+
+    def addDds(self, *relative_files:str):
+        for relative_file in relative_files:
+            dds_file = self.image_root / relative_file
+            dds_file.parent.mkdir(parents=True, exist_ok=True)
+            dds_file.touch()
+
+    def test_same_named_folders_at_different_depths_are_separate_groups(self):
+        self.addDds("tau/tau_pop_00.dds", "tau/tau_pop_01.dds", "kroot/tau/tau_ruler_00.dds")
+        portraits = config.Portraits(source_path=self.output_folder, mod_prefix="ex")
+
+        self.assertEqual(list(portraits.generateGroups()), ["ex_kroot_tau", "ex_tau"])
+        self.assertEqual(list(portraits.portrait_files["ex_tau"]), ["tau_pop_00", "tau_pop_01"])
+        self.assertEqual(list(portraits.portrait_files["ex_kroot_tau"]), ["tau_tau_ruler_00"])
+
+    def test_folders_sharing_a_group_key_stop_before_any_group_is_built(self):
+        self.addDds("orks/bigga/ork_leader_00.dds", "orks_bigga/ork_leader_01.dds")
+        portraits = config.Portraits(source_path=self.output_folder, mod_prefix="ex")
+
+        with self.assertRaises(errors.PortraitGroupError):
+            next(portraits.generateGroups())
+        self.assertEqual(portraits.config_store, {})
+
+    def test_listed_files_sharing_a_group_key_are_rejected(self):
+        self.addDds("orks/bigga/ork_leader_00.dds", "orks_bigga/ork_leader_01.dds")
+        portraits = config.Portraits(source_path=self.output_folder, mod_prefix="ex")
+        dds_files = [self.image_root / "orks/bigga/ork_leader_00.dds", self.image_root / "orks_bigga/ork_leader_01.dds"]
+
+        with self.assertRaises(errors.PortraitGroupError):
+            next(portraits.generateGroups(files=dds_files))
+
+    def test_pipeline_checks_queued_folders_against_converted_ones(self):
+        self.addDds("orks/bigga/ork_leader_00.dds")
+        portraits = config.Portraits(source_path=self.output_folder, mod_prefix="ex")
+        pipeline = config.PortraitPipeline(portraits=portraits)
+        pipeline.expect(self.image_root / "orks_bigga/ork_leader_01.dds")
+
+        with self.assertRaises(errors.PortraitGroupError):
+            pipeline.checkGroupKeys()
+
+if __name__ == "__main__":
+    unittest.main()